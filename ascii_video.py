@@ -0,0 +1,186 @@
+import mmap
+import struct
+import sys
+import numpy as np
+
+# Binary ASCII video container:
+#   header    magic, version, fps, width, height, palette size, frame count, keyframe interval, index offset
+#   palette   one little endian uint32 code point per entry
+#   frames    each frame is stored as uint8 palette indices, encoded as one of the FRAME_* kinds below
+#   index     one INDEX_DTYPE record per frame, so any frame can be found without reading the others
+MAGIC = b'AHVD'
+VERSION = 1
+HEADER = struct.Struct('<4sHfHHHIHQ')
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('size', '<u4'), ('kind', 'u1'), ('keyframe', '<u4')])
+
+FRAME_RAW = 0    # width * height palette indices
+FRAME_RLE = 1    # (run length, palette index) byte pairs
+FRAME_DELTA = 2  # changed cell count, positions and palette indices, relative to the previous frame
+
+def rle_encode(cells):
+    if len(cells) == 0:
+        return b''
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(cells)) + 1))
+    lengths = np.diff(np.concatenate((starts, [len(cells)])))
+    # Runs longer than 255 are split so their lengths fit in a byte
+    repeats = (lengths + 254) // 255
+    part = np.arange(repeats.sum()) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+    pairs = np.empty((len(part), 2), dtype=np.uint8)
+    pairs[:, 0] = np.minimum(255, np.repeat(lengths, repeats) - 255 * part)
+    pairs[:, 1] = np.repeat(cells[starts], repeats)
+    return pairs.tobytes()
+
+def rle_decode(data):
+    pairs = np.frombuffer(data, dtype=np.uint8).reshape(-1, 2)
+    return np.repeat(pairs[:, 1], pairs[:, 0])
+
+class AsciiVideoWriter:
+    def __init__(self, path, fps, width, height, palette, keyframe_interval=48):
+        if len(palette) > 256:
+            raise ValueError("An ASCII video palette can have at most 256 characters")
+        self.fps = fps
+        self.width = width
+        self.height = height
+        self.palette = palette
+        self.keyframe_interval = keyframe_interval
+        self.char_to_index = {char: i for i, char in enumerate(palette)}
+        self.position_dtype = np.uint16 if width * height <= 0xFFFF else np.uint32
+        self.index = []
+        self.previous = None
+        self.last_keyframe = 0
+        self.file = open(path, 'wb')
+        self.file.write(b'\0' * HEADER.size)  # Filled in on close, once the frame count is known
+        self.file.write(np.array([ord(char) for char in palette], dtype='<u4').tobytes())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def encode_text(self, text):
+        cells = np.frombuffer(text.encode('utf-32-le'), dtype='<u4')
+        lut = {ord(char): i for char, i in self.char_to_index.items()}
+        codes, inverse = np.unique(cells, return_inverse=True)
+        return np.array([lut[code] for code in codes], dtype=np.uint8)[inverse]
+
+    def write_text_frame(self, text):
+        self.write_frame(self.encode_text(text))
+
+    def write_frame(self, cells):
+        cells = np.ascontiguousarray(cells, dtype=np.uint8).ravel()
+        frame_number = len(self.index)
+        keyframe = self.previous is None or frame_number - self.last_keyframe >= self.keyframe_interval
+        data, kind = None, None
+        if not keyframe:
+            changed = np.flatnonzero(cells != self.previous)
+            data = struct.pack('<I', len(changed)) + changed.astype(self.position_dtype).tobytes() + cells[changed].tobytes()
+            kind = FRAME_DELTA
+        # Deltas bigger than the frame itself are stored as keyframes instead
+        if keyframe or len(data) >= len(cells):
+            rle = rle_encode(cells)
+            data, kind = (rle, FRAME_RLE) if len(rle) < len(cells) else (cells.tobytes(), FRAME_RAW)
+            self.last_keyframe = frame_number
+        self.index.append((self.file.tell(), len(data), kind, self.last_keyframe))
+        self.file.write(data)
+        self.previous = cells
+
+    def close(self):
+        if self.file.closed:
+            return
+        index_offset = self.file.tell()
+        self.file.write(np.array(self.index, dtype=INDEX_DTYPE).tobytes())
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.fps, self.width, self.height, len(self.palette),
+                                    len(self.index), self.keyframe_interval, index_offset))
+        self.file.close()
+
+class AsciiVideo:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.fps, self.width, self.height, palette_size, frame_count, self.keyframe_interval, index_offset = \
+            HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} ASCII video")
+        self.palette = np.frombuffer(self.mmap, dtype='<u4', count=palette_size, offset=HEADER.size)
+        self.index = np.frombuffer(self.mmap, dtype=INDEX_DTYPE, count=frame_count, offset=index_offset)
+        self.position_dtype = np.uint16 if self.width * self.height <= 0xFFFF else np.uint32
+        self.cached_number = None
+        self.cached_cells = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, frame_number):
+        return self.get_text(frame_number)
+
+    def __iter__(self):
+        for frame_number in range(len(self)):
+            yield self.get_text(frame_number)
+
+    def close(self):
+        self.index = self.palette = None
+        self.mmap.close()
+
+    def decode(self, frame_number, previous):
+        offset, size, kind, _ = self.index[frame_number]
+        data = self.mmap[offset:offset + size]
+        if kind == FRAME_RAW:
+            return np.frombuffer(data, dtype=np.uint8).copy()
+        if kind == FRAME_RLE:
+            return rle_decode(data)
+        count, = struct.unpack_from('<I', data)
+        positions = np.frombuffer(data, dtype=self.position_dtype, count=count, offset=4)
+        cells = previous.copy()
+        cells[positions] = np.frombuffer(data, dtype=np.uint8, count=count, offset=4 + positions.nbytes)
+        return cells
+
+    def get_cells(self, frame_number):
+        # Palette indices of a frame, shape (height, width). Playing forward only decodes one delta
+        # per frame, seeking decodes at most keyframe_interval frames from the nearest keyframe.
+        if frame_number < 0:
+            frame_number += len(self)
+        if not 0 <= frame_number < len(self):
+            raise IndexError("frame number out of range")
+        if self.cached_number is not None and self.cached_number <= frame_number and \
+           self.index[frame_number]['keyframe'] <= self.cached_number:
+            start, cells = self.cached_number + 1, self.cached_cells
+        else:
+            start, cells = int(self.index[frame_number]['keyframe']), None
+        for number in range(start, frame_number + 1):
+            cells = self.decode(number, cells)
+        self.cached_number, self.cached_cells = frame_number, cells
+        return cells.reshape(self.height, self.width)
+
+    def get_text(self, frame_number):
+        # Same layout as a frame line of the text format
+        return self.palette[self.get_cells(frame_number)].tobytes().decode('utf-32-le')
+
+def is_ascii_video(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def load_legacy_ascii_video(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        fps = int(f.readline().strip())
+        frame_width = int(f.readline().strip())
+        frame_height = int(f.readline().strip())
+        frames = [line.strip() for line in f.readlines()]
+    return fps, frame_width, frame_height, frames
+
+def convert_legacy_ascii_video(text_path, output_path, keyframe_interval=48):
+    fps, width, height, frames = load_legacy_ascii_video(text_path)
+    frames = [frame.ljust(width * height)[:width * height] for frame in frames]
+    palette = sorted(set(''.join(frames)) | {' '})
+    with AsciiVideoWriter(output_path, fps, width, height, palette, keyframe_interval) as writer:
+        for frame in frames:
+            writer.write_text_frame(frame)
+    return len(frames)
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python ascii_video.py <legacy_video.txt> <output.ahv>")
+        sys.exit(1)
+    count = convert_legacy_ascii_video(sys.argv[1], sys.argv[2])
+    print(f"Converted {count} frames to {sys.argv[2]}")
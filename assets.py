@@ -0,0 +1,136 @@
+import sys
+import threading
+import numpy as np
+from utils import generate_perlin_noise
+
+class AssetRegistry:
+    # Process wide owner of everything that is expensive to build and the same for every run:
+    # the sound system (and with it the pygame mixer), the input thread, the terminal output, terrain noise
+    # and character tables.
+    # Resources are built once, on first use or by warm_up(), and shared read-only afterwards.
+    def __init__(self):
+        self.resources = {}
+        self.building = {}  # name -> Event, set once the resource is built or its build failed
+        self.failures = {}  # name -> what the last build raised, for the threads that waited on it
+        self.lock = threading.Lock()
+
+    def get(self, name, factory):
+        with self.lock:
+            if name in self.resources:
+                return self.resources[name]
+            event = self.building.get(name)
+            owner = event is None
+            if owner:
+                event = self.building[name] = threading.Event()
+        if not owner:
+            # Someone else (usually the warm up thread) is building it already
+            event.wait()
+            with self.lock:
+                if name in self.resources:
+                    return self.resources[name]
+                error = self.failures[name]
+            raise error
+        try:
+            resource = factory()
+            with self.lock:
+                self.resources[name] = resource
+                self.failures.pop(name, None)
+        except BaseException as error:
+            with self.lock:
+                self.failures[name] = error  # The next get() tries again
+            raise
+        finally:
+            with self.lock:
+                del self.building[name]
+            event.set()
+        return resource
+
+    def provide(self, name, resource):
+        # A resource built elsewhere, e.g. attached from shared memory, get() hands it out from now on
+        with self.lock:
+            self.resources[name] = resource
+
+    def find(self, name):
+        # The resource if it is built, None otherwise. Never builds or waits.
+        with self.lock:
+            return self.resources.get(name)
+
+    def release(self, name):
+        with self.lock:
+            self.resources.pop(name, None)
+
+    def sound_system(self):
+        from sounds import SoundSystem  # Initializes pygame, only when audio is actually wanted
+        return self.get("sound_system", SoundSystem)
+
+    def input_system(self, backend=None):
+        from controls import create_input
+        return self.get("input_system", lambda: create_input(backend))
+
+    def output(self, backend=None, adaptive=False, max_rate=None, spectate=()):
+        from output import create_output
+        return self.get("output", lambda: create_output(backend, adaptive, max_rate, spectate))
+
+    def terrain_noise(self, width, height, scale, octaves, persistence, lacunarity):
+        def build():
+            noise = np.empty((height, width))
+            for y in range(height):
+                for x in range(width):
+                    noise[y, x] = generate_perlin_noise(x, y, 0, scale, octaves, persistence, lacunarity)
+            noise.flags.writeable = False
+            return noise
+        return self.get(("terrain_noise", width, height, scale, octaves, persistence, lacunarity), build)
+
+    def char_tables(self):
+        return self.get("char_tables", build_char_tables)
+
+    def warm_up(self, sound=True, world_size=(256, 256), wait=False):
+        # Builds the shared resources on a background thread so the first game starts instantly
+        def build():
+            self.char_tables()
+            if sound:
+                self.sound_system()
+            if world_size:
+                from world import World
+                World.get_terrain(*world_size)
+        thread = threading.Thread(target=build, daemon=True)
+        thread.start()
+        if wait:
+            thread.join()
+        return thread
+
+    def memory_usage(self):
+        usage = {}
+        with self.lock:
+            resources = list(self.resources.items())
+        for name, resource in resources:
+            usage[name] = estimate_size(resource)
+        return usage
+
+def estimate_size(resource):
+    if isinstance(resource, np.ndarray):
+        return resource.nbytes
+    if hasattr(resource, "memory_usage"):
+        return resource.memory_usage()
+    if isinstance(resource, dict):
+        return sys.getsizeof(resource) + sum(estimate_size(value) for value in resource.values())
+    if isinstance(resource, (list, tuple)):
+        return sys.getsizeof(resource) + sum(estimate_size(value) for value in resource)
+    return sys.getsizeof(resource)
+
+def build_char_tables():
+    corrupted_chars = '!#$%^&*()_-={}[]|\\:;"\'<>,.?/'
+    cursed_chars = '⛧⎊⏧⏣☈☇⚯⚮⛮⛥⛤⛢⚝⚹⚶⚸⭘⭙⭔⭓⍜⍛⍭⍱⍲'
+    return {
+        "corrupted_chars": corrupted_chars,
+        "cursed_chars": cursed_chars,
+        "corrupted_and_cursed_chars": corrupted_chars + cursed_chars,
+        "cursed_words": ('ĄBØMINĄTIØN', 'DÆMØN', 'DĘVĮŁ', 'ĘVĪŁ', 'FĪĘND', 'HĄUNT', 'HØRRØR', 'PHĄNTĄSM', 'SPĪRĪT', 'WRĄĪTH', 'BŁĄSPHĘMY', 'CĄRNĄGĘ', 'DĘSĘCRĄTĪØN', 'ĘNTRÅĪŁS', 'FŁĘSHGØŁĘM', 'GĪBBĘT', 'HĘŁŁSPĄWN', 'ĪMMØŁĄTĪØN', 'MĄDNĘSS', 'NĘCRØPHĄGĘ', 'PĘSTĪŁĘNCĘ', 'QUĘŁCH', 'RĄVĄGĘ', 'SŁĄUGHTĘR', 'TØRMĘNT', 'UNDĘĄD', 'VĪSCĘRĄ', 'WRĘTCH', 'YØKĄĪ'),
+        "obstacle_char": '▓',
+        "unseen_char": '░',
+        "empty_char": ' ',
+        "echo_chars": '⛧⎊⏧⏣☈☇⚯⚮⛮⛥⛤⛢⚝⚹⚶⚸⭘⭙⭔⭓⍜⍛⍭⍱⍲ĄĪĘØÆĪŁ',
+        "unseen_distortion_chars": '▒▓█▄▀░',
+    }
+
+registry = AssetRegistry()
@@ -0,0 +1,170 @@
+import asyncio
+import time
+import startup
+
+class AsyncGameRunner:
+    # Runs a Game on an asyncio event loop instead of its own threads, so it can live next to other work
+    # on the same loop, e.g. a supervisor or a server with one game per connection. Every subsystem is a
+    # task that sleeps until it is due next: simulation ticks, rendering, ambient sounds, echoes and text
+    # typing. Only composing and writing a frame leaves the loop, on the default executor, so a slow
+    # terminal doesn't hold up the other tasks.
+    # reader is an asyncio.StreamReader to take keys from, for a game.input that is a controls.TerminalInput
+    # nobody else feeds. Without one the input system delivers keys on its own.
+    # render_in_executor=False draws on the loop itself, for outputs that never block, e.g. sockets.
+    def __init__(self, game, next_run=None, reader=None, render_in_executor=True):
+        self.game = game
+        self.next_run = next_run
+        self.reader = reader
+        self.render_in_executor = render_in_executor
+        self.tick = 1 / game.tick_rate
+        self.published = asyncio.Event()
+        self.input_changed = asyncio.Event()
+        self.text_started = asyncio.Event()
+        self.typing_idle = False
+        self.stopping = False
+        # Since the last get_stats(reset=True)
+        self.ticks = 0
+        self.tick_time = 0
+        self.max_tick_time = 0
+        self.frames = 0
+        self.frame_time = 0
+
+    async def run(self):
+        # Same result as Game.run: True to restart, False to terminate
+        game = self.game
+        game.start()
+
+        # A recorded game keeps everything on its ticks, so replaying the inputs of each tick replays the game
+        game.scheduled_subsystems = game.recorder is None
+        simulation = asyncio.ensure_future(self.simulate())
+        renderer = asyncio.ensure_future(self.render())
+        subsystems = []
+        if game.scheduled_subsystems:
+            subsystems = [asyncio.ensure_future(coroutine) for coroutine in
+                          (self.play_ambient_sounds(), self.play_echoes(), self.type_text())]
+        if self.reader:
+            subsystems += [asyncio.ensure_future(self.read_input()), asyncio.ensure_future(self.release_keys())]
+        try:
+            # The simulation decides when the game is over, the other tasks only end early by failing
+            waiting = {simulation, renderer, *subsystems}
+            while not simulation.done():
+                done, waiting = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()  # Raises whatever the task raised
+            return simulation.result()
+        finally:
+            game.scheduled_subsystems = False
+            for task in [simulation] + subsystems:
+                task.cancel()
+            # The renderer finishes the frame it is writing, the next game shares the output
+            self.stopping = True
+            self.published.set()
+            await asyncio.gather(simulation, renderer, *subsystems, return_exceptions=True)
+
+    async def simulate(self):
+        game = self.game
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while game.running:
+            now = loop.time()
+            if now < next_tick:
+                await asyncio.sleep(next_tick - now)
+                continue
+            # Same fixed tick as Game.run_simulation
+            next_tick = max(next_tick + self.tick, now - self.tick)
+            start = time.perf_counter()
+            restart = game.step(self.next_run)
+            tick_time = time.perf_counter() - start
+            self.ticks += 1
+            self.tick_time += tick_time
+            self.max_tick_time = max(self.max_tick_time, tick_time)
+            if restart:
+                return True
+            self.published.set()
+            if self.typing_idle and ((game.text_display_active and not game.text_fully_displayed) or game.current_message):
+                self.text_started.set()
+        game.sound_system.stop_music()
+        return False
+
+    async def render(self):
+        game = self.game
+        while not self.stopping:
+            await self.published.wait()
+            self.published.clear()
+            snapshot = game.snapshots.take(timeout=0)
+            if snapshot is None:
+                continue
+            start = time.perf_counter()
+            if self.render_in_executor:
+                # Snapshots published meanwhile replace each other, only the newest is drawn next
+                await asyncio.to_thread(game.render, snapshot)
+            else:
+                game.render(snapshot)
+            frame_time = time.perf_counter() - start
+            self.frames += 1
+            self.frame_time += frame_time
+            if game.slow_frames:
+                game.slow_frames.frame_done(game.graphics, frame_time)
+            startup.mark("game first frame")
+
+    async def play_ambient_sounds(self):
+        # The interval shrinks as the signal gets weaker
+        sound_system = self.game.sound_system
+        while True:
+            await asyncio.sleep(sound_system.get_ambient_interval())
+            if self.game.is_simulating():
+                sound_system.play_random_ambient_sound()
+
+    async def play_echoes(self):
+        game = self.game
+        while True:
+            ticks = 0
+            if game.is_simulating():
+                ticks = game.play_echo(*game.get_echo_distance())
+            # Nothing in range is checked again next tick
+            await asyncio.sleep(max(1, ticks) * self.tick)
+
+    async def type_text(self):
+        while True:
+            delay = self.game.update_typing()
+            if delay is None:
+                # Nothing to type until the simulation starts a text or a message
+                self.typing_idle = True
+                self.text_started.clear()
+                await self.text_started.wait()
+                self.typing_idle = False
+            else:
+                await asyncio.sleep(delay)
+
+    async def read_input(self):
+        game = self.game
+        while True:
+            data = await self.reader.read(64)
+            if not data:
+                game.running = False  # The other side is gone
+                return
+            game.input.feed(data)
+            self.input_changed.set()
+
+    async def release_keys(self):
+        # Key up events once a key's repeats stop coming, see TerminalInput
+        while True:
+            self.input_changed.clear()
+            delay = self.game.input.release_due()
+            try:
+                await asyncio.wait_for(self.input_changed.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def get_stats(self, reset=False):
+        stats = {
+            "ticks": self.ticks,
+            "tick_time": self.tick_time,
+            "max_tick_time": self.max_tick_time,
+            "frames": self.frames,
+            "frame_time": self.frame_time,
+        }
+        if reset:
+            self.ticks = self.frames = 0
+            self.tick_time = self.max_tick_time = self.frame_time = 0
+        return stats
@@ -0,0 +1,304 @@
+import os
+import socket
+import stat
+import threading
+import time
+from output import OutputBackend
+
+# Lets any number of spectators watch a game. Every frame is encoded once, as the ANSI diff the player's
+# terminal gets, and the same bytes go to every viewer. A viewer that can't keep up skips frames instead of
+# holding up the game, and once it has caught up gets a keyframe (the whole screen) to continue from.
+# The keyframe is also encoded at most once per frame, however many viewers need it.
+#
+#   python game.py --spectate tcp:2424 --spectate pipe:/tmp/watch
+#   telnet localhost 2424   or   cat /tmp/watch
+
+class Viewer:
+    # One spectator. Writes never block: what the other side doesn't take right away stays pending, and as
+    # long as anything is pending the viewer skips frames.
+    def __init__(self):
+        self.pending = memoryview(b'')
+        self.needs_keyframe = True  # Joined, fell behind or the screen was cleared
+        self.done = threading.Event()
+        self.frames_sent = 0
+        self.keyframes_sent = 0
+        self.frames_skipped = 0
+        self.bytes_sent = 0
+
+    @property
+    def closed(self):
+        return self.done.is_set()
+
+    def send(self, data):
+        # Sends what the other side takes without waiting, returns how many bytes that was. The base
+        # viewer takes everything and sends it nowhere.
+        return len(data)
+
+    def is_behind(self):
+        if len(self.pending):
+            self.flush()
+        return len(self.pending) > 0
+
+    def write(self, data):
+        self.pending = memoryview(data)
+        self.flush()
+
+    def flush(self):
+        try:
+            sent = self.send(self.pending)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self.close()  # Gone
+            return
+        self.pending = self.pending[sent:]
+        self.bytes_sent += sent
+
+    def close(self):
+        self.done.set()
+
+class SocketViewer(Viewer):
+    def __init__(self, sock):
+        super().__init__()
+        self.socket = sock
+        sock.setblocking(False)
+
+    def send(self, data):
+        return self.socket.send(data)
+
+    def close(self):
+        if not self.closed:
+            self.socket.close()
+        super().close()
+
+class FileViewer(Viewer):
+    # A pipe or FIFO. Writing a regular file never has to wait, so it doesn't skip anything.
+    def __init__(self, fd):
+        super().__init__()
+        self.fd = fd
+        os.set_blocking(fd, False)
+
+    def send(self, data):
+        return os.write(self.fd, data)
+
+    def close(self):
+        if not self.closed:
+            os.close(self.fd)
+        super().close()
+
+class TransportViewer(Viewer):
+    # An asyncio connection, see server.py. The transport takes every write and buffers what the socket
+    # doesn't, so anything in that buffer counts as behind.
+    def __init__(self, transport):
+        super().__init__()
+        self.transport = transport
+
+    def is_behind(self):
+        if self.transport.is_closing():
+            self.close()
+        return self.transport.get_write_buffer_size() > 0
+
+    def send(self, data):
+        self.transport.write(data)
+        return len(data)
+
+class Broadcast:
+    # The screen as the spectators see it and the viewers watching it. publish() is called from whatever
+    # draws the game, viewers can be added from any thread.
+    def __init__(self):
+        self.viewers = []
+        self.lock = threading.Lock()
+        self.rows = []  # Text of every row on screen, for keyframes
+        self.frames = 0
+        self.keyframes = 0
+        self.skipped = 0  # Frames some viewer didn't get because it was behind
+        self.encode_time = 0
+        self.send_time = 0
+
+    def add(self, viewer):
+        with self.lock:
+            viewer.needs_keyframe = True
+            self.viewers.append(viewer)
+
+    def remove(self, viewer):
+        with self.lock:
+            if viewer in self.viewers:
+                self.viewers.remove(viewer)
+
+    def clear(self):
+        # The screen was cleared, viewers start over from a keyframe
+        self.rows = []
+        with self.lock:
+            for viewer in self.viewers:
+                viewer.needs_keyframe = True
+
+    def publish(self, changes, height):
+        # changes are the (y, text) rows that differ from the last frame
+        if len(self.rows) != height:
+            self.rows = (self.rows + [''] * height)[:height]
+        for y, text in changes:
+            if y < height:
+                self.rows[y] = text
+        with self.lock:
+            viewers = list(self.viewers)
+        if not viewers:
+            return  # Nobody watching, keeping the rows up to date is all there is to do
+
+        start = time.perf_counter()
+        diff = self.encode_diff(changes, height) if changes else None
+        keyframe = None
+        self.frames += 1
+        sent = time.perf_counter()
+        for viewer in viewers:
+            if viewer.closed or viewer.is_behind():
+                viewer.needs_keyframe = True
+                viewer.frames_skipped += 1
+                self.skipped += 1
+                if viewer.closed:
+                    self.remove(viewer)
+                continue
+            if viewer.needs_keyframe:
+                if keyframe is None:
+                    encoded = time.perf_counter()
+                    keyframe = self.encode_keyframe(height)
+                    self.keyframes += 1
+                    sent += time.perf_counter() - encoded  # Counts as encoding, not sending
+                viewer.needs_keyframe = False
+                viewer.keyframes_sent += 1
+                viewer.write(keyframe)
+            elif diff is not None:
+                viewer.frames_sent += 1
+                viewer.write(diff)
+        end = time.perf_counter()
+        self.encode_time += sent - start
+        self.send_time += end - sent
+
+    def encode_diff(self, changes, height):
+        # What AnsiOutput writes for the same frame
+        parts = ["\033[H"]
+        parts += [f"\033[{y + 1};1H{text}" for y, text in changes if y < height]
+        parts.append(f"\033[{height + 1};1H")
+        return ''.join(parts).encode('utf-8')
+
+    def encode_keyframe(self, height):
+        parts = ["\033[2J\033[H"]
+        parts += [f"\033[{y + 1};1H{text}" for y, text in enumerate(self.rows) if text]
+        parts.append(f"\033[{height + 1};1H")
+        return ''.join(parts).encode('utf-8')
+
+    def close(self):
+        with self.lock:
+            viewers, self.viewers = self.viewers, []
+        for viewer in viewers:
+            viewer.close()
+
+    def get_stats(self, reset=False):
+        with self.lock:
+            viewers = list(self.viewers)
+        stats = {
+            "viewers": len(viewers),
+            "broadcast_frames": self.frames,
+            "keyframes": self.keyframes,
+            "encode_time": self.encode_time,
+            "send_time": self.send_time,
+            "skipped": self.skipped,
+        }
+        if reset:
+            self.frames = self.keyframes = self.skipped = 0
+            self.encode_time = self.send_time = 0
+        return stats
+
+class BroadcastOutput(OutputBackend):
+    # Goes between Graphics and the player's output: passes every frame on and broadcasts it. Frames the
+    # player's output skips (see AnsiOutput adaptive) still reach the spectators, the rows they changed
+    # are held back for the player's next frame. Without an output the game is only broadcast.
+    def __init__(self, output=None, broadcast=None):
+        super().__init__()
+        self.output = output
+        self.broadcast = broadcast or Broadcast()
+        self.changes = []
+        self.held_rows = {}  # y -> text the player's output hasn't had yet
+
+    def begin_frame(self):
+        self.changes = []
+        return True
+
+    def write_row(self, y, text):
+        self.changes.append((y, text))
+        self.bytes_written += len(text)
+
+    def end_frame(self, height):
+        self.broadcast.publish(self.changes, height)
+        self.frames_written += 1
+        if self.output is None:
+            return
+        self.held_rows.update(self.changes)
+        if not self.output.begin_frame():
+            self.frames_coalesced += 1
+            return
+        for y in sorted(self.held_rows):
+            if y < height:
+                self.output.write_row(y, self.held_rows[y])
+        self.held_rows = {}
+        self.output.end_frame(height)
+
+    def get_size(self):
+        return self.output.get_size() if self.output else None
+
+    def clear_screen(self):
+        if self.output:
+            self.output.clear_screen()
+        self.held_rows = {}
+        self.broadcast.clear()
+
+    def close(self):
+        if self.output:
+            self.output.close()
+        self.broadcast.close()
+
+    def get_stats(self):
+        stats = self.output.get_stats() if self.output else super().get_stats()
+        stats.update(self.broadcast.get_stats())
+        return stats
+
+def listen_tcp(broadcast, host, port):
+    # Every connection is a viewer, whatever it sends is ignored
+    server = socket.create_server((host, port))
+
+    def accept():
+        while True:
+            connection, _ = server.accept()
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # Telnet clients: we echo (nothing) and suppress go-ahead, so typing doesn't mess up the picture
+            connection.sendall(bytes([255, 251, 1, 255, 251, 3]))
+            broadcast.add(SocketViewer(connection))
+
+    threading.Thread(target=accept, daemon=True).start()
+    return server
+
+def listen_pipe(broadcast, path):
+    # A FIFO, created if needed. It has one reader at a time, the next one gets the game once that one is gone.
+    if not os.path.exists(path):
+        os.mkfifo(path)
+    elif not stat.S_ISFIFO(os.stat(path).st_mode):
+        raise ValueError(f"{path} is not a FIFO")
+
+    def attach():
+        while True:
+            viewer = FileViewer(os.open(path, os.O_WRONLY))  # Waits for a reader
+            broadcast.add(viewer)
+            viewer.done.wait()
+
+    threading.Thread(target=attach, daemon=True).start()
+
+def listen(broadcast, address):
+    # "tcp:PORT", "tcp:HOST:PORT" or "pipe:PATH"
+    kind, _, target = address.partition(":")
+    if kind == "tcp":
+        host, _, port = target.rpartition(":")
+        if not port.isdigit() or int(port) > 65535:
+            raise ValueError(f"Bad spectator address {address}, expected tcp:[HOST:]PORT")
+        return listen_tcp(broadcast, host or "127.0.0.1", int(port))
+    if kind == "pipe" and target:
+        return listen_pipe(broadcast, target)
+    raise ValueError(f"Unknown spectator address {address}, expected tcp:[HOST:]PORT or pipe:PATH")
@@ -0,0 +1,249 @@
+import atexit
+import codecs
+import collections
+import os
+import sys
+import threading
+import time
+import latency
+
+# Terminal escape sequences -> the key names the keyboard module uses
+ESCAPE_SEQUENCES = {
+    '\x1b[A': 'up',
+    '\x1b[B': 'down',
+    '\x1b[C': 'right',
+    '\x1b[D': 'left',
+    '\x1bOA': 'up',
+    '\x1bOB': 'down',
+    '\x1bOC': 'right',
+    '\x1bOD': 'left',
+}
+CHAR_NAMES = {
+    '\r': 'enter',
+    '\n': 'enter',
+    ' ': 'space',
+    '\x7f': 'backspace',
+}
+
+KeyEvent = collections.namedtuple('KeyEvent', 'key down repeat time')
+
+class InputSystem:
+    # Key events are read on a dedicated thread and queued with their time. The game drains the queue
+    # once per step with poll(), so a tap between two frames is never lost and input doesn't wait for
+    # the next frame to be noticed.
+    def __init__(self):
+        self.events = collections.deque()  # append and popleft are atomic, no lock needed
+        self.held_by_reader = set()  # Key state as the reader thread sees it, to tell repeats from presses
+        self.held = set()
+        self.tapped = set()  # Went down since the previous poll, even if already released again
+        self.press_times = {}  # key -> time of its first press nobody has reacted to yet, for latency tracking
+        self.step_events = []
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._reader, daemon=True)
+        self.thread.start()
+
+    def _reader(self):
+        pass  # Subclasses read their device here, the base class gets no events (e.g. headless)
+
+    def push(self, key, down):
+        repeat = down and key in self.held_by_reader
+        if down:
+            self.held_by_reader.add(key)
+        else:
+            self.held_by_reader.discard(key)
+        self.events.append(KeyEvent(key, down, repeat, time.monotonic()))
+
+    def poll(self):
+        # Call once per simulation step, returns the events of this step
+        self.tapped = set()
+        self.step_events = []
+        now = time.monotonic()
+        # A press that was released again without anything happening won't be answered anymore
+        for key in [key for key in self.press_times if key not in self.held]:
+            del self.press_times[key]
+        while self.events:
+            event = self.events.popleft()
+            self.step_events.append(event)
+            if event.down:
+                self.held.add(event.key)
+                if not event.repeat:
+                    self.tapped.add(event.key)
+                    self.press_times.setdefault(event.key, event.time)
+                    latency.record("input -> poll", now - event.time)
+            else:
+                self.held.discard(event.key)
+        return self.step_events
+
+    def is_pressed(self, key):
+        # Held right now, or tapped since the last step
+        return key in self.held or key in self.tapped
+
+    def was_pressed(self, key):
+        # Went down since the last step, auto repeat doesn't count
+        return key in self.tapped
+
+    def take_press_time(self, *keys):
+        # Earliest unanswered press of any of the keys, or None. Forgets them, a press is answered once.
+        times = [self.press_times.pop(key) for key in keys if key in self.press_times]
+        return min(times) if times else None
+
+    def close(self):
+        pass
+
+class KeyboardInput(InputSystem):
+    # Global keyboard hook, has real key up events. Needs root on Linux.
+    def __init__(self):
+        super().__init__()
+        import keyboard
+        self.keyboard = keyboard
+        self.hook = keyboard.hook(self._on_event)
+
+    def start(self):
+        pass  # The keyboard module already delivers events on its own listener thread
+
+    def _on_event(self, event):
+        if event.name:
+            self.push(event.name, event.event_type == self.keyboard.KEY_DOWN)
+
+    def close(self):
+        self.keyboard.unhook(self.hook)
+
+class TerminalInput(InputSystem):
+    # Keys from what a terminal sends, fed in with feed() by whoever reads it: the stdin reader thread below,
+    # or a task reading a socket. Terminals only send key presses and auto repeats, so a key counts as held
+    # until its repeats stop coming. A single tap is held for repeat_timeout only, holding a key works like
+    # typing: one press, the terminal's repeat delay, then a steady hold.
+    def __init__(self, repeat_timeout=0.1, escape_timeout=0.05):
+        super().__init__()
+        self.repeat_timeout = repeat_timeout  # Longest gap between two repeats
+        self.escape_timeout = escape_timeout  # An escape with nothing after it for this long is the Esc key
+        self.release_times = {}  # key -> when it counts as released if nothing else comes
+        self.condition = threading.Condition()
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')  # A character can be split between reads
+        self.pending = ''
+        self.pending_since = None  # When the escape sequence waiting in pending started
+
+    def feed(self, data):
+        with self.condition:
+            self.pending = self._parse(self.pending + self.decoder.decode(data))
+            if not self.pending:
+                self.pending_since = None
+            elif self.pending_since is None:
+                self.pending_since = time.monotonic()
+            self.condition.notify()
+
+    def _parse(self, data):
+        # Returns what is left over: the start of an escape sequence whose rest is still on its way
+        while data:
+            if data[0] == '\x1b':
+                if len(data) == 1:
+                    return data  # Esc, or the start of a sequence split between reads
+                if data[1] == '[':
+                    # CSI: parameters and intermediates, up to a final byte in 0x40-0x7E
+                    end = next((i for i in range(2, len(data)) if '\x40' <= data[i] <= '\x7e'), None)
+                    if end is None:
+                        return data
+                    sequence, data = data[:end + 1], data[end + 1:]
+                elif data[1] == 'O':
+                    # SS3: one final byte
+                    if len(data) < 3:
+                        return data
+                    sequence, data = data[:3], data[3:]
+                else:
+                    self._key_down('esc')
+                    data = data[1:]
+                    continue
+                key = ESCAPE_SEQUENCES.get(sequence)
+                if key:
+                    self._key_down(key)
+                continue  # Delete, F-keys, modified arrows etc. are dropped whole
+            char, data = data[0], data[1:]
+            self._key_down(CHAR_NAMES.get(char, char.lower()))
+        return data
+
+    def _key_down(self, key):
+        with self.condition:
+            self.release_times[key] = time.monotonic() + self.repeat_timeout
+            self.push(key, True)
+            self.condition.notify()
+
+    def release_due(self):
+        # Turns "no more repeats" into key up events and an escape nothing followed into Esc, returns the
+        # seconds until the next of those is due or None
+        with self.condition:
+            now = time.monotonic()
+            if self.pending_since is not None and now - self.pending_since >= self.escape_timeout:
+                if self.pending == '\x1b':
+                    self._key_down('esc')
+                self.pending = ''  # A sequence cut short is dropped
+                self.pending_since = None
+            for key, release_time in list(self.release_times.items()):
+                if release_time <= now:
+                    del self.release_times[key]
+                    self.push(key, False)
+            due = list(self.release_times.values())
+            if self.pending_since is not None:
+                due.append(self.pending_since + self.escape_timeout)
+            return max(0, min(due) - now) if due else None
+
+class StdinInput(TerminalInput):
+    # Reads the terminal the game runs in, in cbreak mode, no root needed
+    def __init__(self, repeat_timeout=0.1):
+        super().__init__(repeat_timeout)
+        import termios
+        import tty
+        self.termios = termios
+        if not sys.stdin.isatty():
+            raise ValueError("stdin is not a terminal, run the game in one or use --input keyboard")
+        self.fd = sys.stdin.fileno()
+        self.saved_settings = termios.tcgetattr(self.fd)
+        tty.setcbreak(self.fd)
+        atexit.register(self.close)
+        self.running = True
+
+    def start(self):
+        super().start()
+        threading.Thread(target=self._releaser, daemon=True).start()
+
+    def _reader(self):
+        while self.running:
+            try:
+                data = os.read(self.fd, 64)
+            except OSError:
+                break
+            if not data:
+                break
+            self.feed(data)
+
+    def _releaser(self):
+        with self.condition:
+            while self.running:
+                self.condition.wait(self.release_due())
+
+    def close(self):
+        if self.running:
+            self.running = False
+            with self.condition:
+                self.condition.notify()
+            self.termios.tcsetattr(self.fd, self.termios.TCSADRAIN, self.saved_settings)
+
+def create_input(backend=None):
+    # "keyboard" or "stdin", without a choice the keyboard hook is tried first, then the terminal. With
+    # neither (e.g. headless with stdin redirected) the game gets no input at all.
+    if backend in (None, "keyboard"):
+        try:
+            input_system = KeyboardInput()
+        except Exception:
+            # Not root, no input devices or no keyboard module
+            if backend == "keyboard":
+                raise
+        else:
+            input_system.start()
+            return input_system
+        if not sys.stdin.isatty():
+            return InputSystem()
+    input_system = StdinInput()
+    input_system.start()
+    return input_system
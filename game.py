@@ -1,26 +1,53 @@
-import keyboard
+import startup  # First, so it can time the other imports
+import argparse
+import asyncio
+import os
+import struct
 import time
 import math
-import pygame
 import random
+import threading
 import colorama
+import latency
 from graphics import Graphics
 from player import Player
 from world import World
 from utils import get_random_position, distance
-from sounds import SoundSystem
-from video_converter import convert_video_to_ascii
+from assets import registry
+from next_run import NextRunBuilder
+from video_player import VideoPlayer
+from async_runner import AsyncGameRunner
+from savegame import SlowFrameRecorder, read_save, write_save, SaveError
+from recording import InputRecorder
+from snapshot import SnapshotBuffer, FrameSnapshot, WorldSnapshot, PlayerSnapshot
 
 colorama.init(autoreset=True)
 
 class Game:
-    def __init__(self, width, height):
-        self.width = width
-        self.height = height
-        self.graphics = Graphics(width, height)        
-        self.player = Player(128, 128)  # Start player in the center of the world
-        self.world = World(256, 256, self.player)  # Much larger world
-        self.sound_system = SoundSystem()
+    def __init__(self, width=None, height=None, sound_system=None, world=None, input_system=None, output=None, seed=None):
+        # Key events come from a reader thread, polled once per step in run()
+        self.input = input_system or registry.input_system()
+        # Without a size the screen follows the terminal, without an output it is the shared one from the registry
+        self.graphics = Graphics(width, height, output)        
+        if world is None:
+            with startup.timed("world generation"):
+                world = World(256, 256, Player(128, 128))  # Much larger world, player starts in the center
+        # Usually prepared in the background by a NextRunBuilder while the menu or end screen was up
+        self.world = world
+        self.player = world.player
+        # Everything random in the game and on screen comes from the seed, and time from the simulation clock
+        # below, so the same inputs on the same ticks replay the same game, see recording.py
+        self.seed = seed if seed is not None else random.randrange(2**32)
+        self.random = random.Random(self.seed)
+        self.graphics.seed(self.random.getrandbits(32))
+        self.tick_rate = 60
+        self.ticks = 0
+        self.clock_start = time.time()
+        self.time = self.clock_start  # Simulation time, advances one tick per step()
+        world.clock = self.get_time
+        self.recorder = None  # A recording.InputRecorder to log the inputs of every tick
+        # Audio is generated once per process and shared through the asset registry
+        self.sound_system = sound_system or registry.sound_system()
         self.running = True
         self.visibility_radius = 5
         self.step_counter = 0
@@ -48,10 +75,10 @@ class Game:
         self.temperature = 57.0
         self.humidity = 98
         self.signal_strength = 91
-        self.temp_direction = random.choice([-1, 1])
-        self.humidity_direction = random.choice([-1, 1])
+        self.temp_direction = self.random.choice([-1, 1])
+        self.humidity_direction = self.random.choice([-1, 1])
         self.update_counter = 0
-        self.last_update_time = time.time()
+        self.last_update_time = self.time
         self.movement_step = 0
         self.echo_cooldown = 0
         self.last_scary_text_time = 0
@@ -70,13 +97,28 @@ class Game:
         self.game_won = False
         self.low_signal_start_time = None
         self.total_time = 0
-        self.start_time = time.time()
+        self.start_time = self.time
         self.echo_creation_delay = 30
         self.max_distance_to_echo = 200
         self.slow_down_step = 7
         self.video_playing = False
-        self.video_file = None
+        self.video = None
+        self.video_stats = None
+        self.restart_requested = False
+        self.ripples = []  # (x, y, radius), see Graphics.draw_ripples
+        self.pending_inputs = []  # (input time, sim time) of inputs since the last snapshot
+        # The simulation ticks on the thread that calls run(), a render thread draws the latest snapshot
+        self.snapshots = SnapshotBuffer()
+        self.render_thread = None
+        self.render_stop = threading.Event()
+        self.render_error = None
+        # Ambient sounds, echoes and typing are updated every tick unless an AsyncGameRunner runs them as tasks
+        self.scheduled_subsystems = False
+        self.slow_frames = None  # A savegame.SlowFrameRecorder to save the game when a tick or frame is slow
         
+    def get_time(self):
+        return self.time
+
     def set_temperature(self, value):
         self.temperature = value
         self.temperature = max(-148, min(100, self.temperature))
@@ -88,12 +130,12 @@ class Game:
 
     def handle_input(self):
         if self.video_playing:
-            if keyboard.is_pressed('space'):
-                self.video_playing = False
+            if self.input.was_pressed('space'):
+                self.stop_video()
             return
 
         if self.text_display_active:
-            if keyboard.is_pressed('enter'):
+            if self.input.was_pressed('enter'):
                 if self.text_fully_displayed:
                     self.next_text()
                 else:
@@ -106,62 +148,72 @@ class Game:
         moved = False
         self.movement_step += 1
         if not self.game_over and not self.game_won and self.movement_step >= self.slow_down_step:  # Slow down overall movement
-            if keyboard.is_pressed('up') and self.player.y > 1:
+            if self.input.is_pressed('up') and self.player.y > 1:
                 self.vertical_step += 1
                 if self.vertical_step >= 3:  # Further slow down vertical movement
                     dy = -1
                     self.vertical_step = 0
                 moved = True
-            elif keyboard.is_pressed('down') and self.player.y < self.world.height - 2:
+            elif self.input.is_pressed('down') and self.player.y < self.world.height - 2:
                 self.vertical_step += 1
                 if self.vertical_step >= 3:  # Further slow down vertical movement
                     dy = 1
                     self.vertical_step = 0
                 moved = True
-            elif keyboard.is_pressed('left') and self.player.x > 1:
+            elif self.input.is_pressed('left') and self.player.x > 1:
                 dx = -1
                 moved = True
-            elif keyboard.is_pressed('right') and self.player.x < self.world.width - 2:
+            elif self.input.is_pressed('right') and self.player.x < self.world.width - 2:
                 dx = 1
                 moved = True
-            #elif keyboard.is_pressed('u'):
+            #elif self.input.is_pressed('u'):
             #    self.update_signal_strength(10)
-            #elif keyboard.is_pressed('i'):
+            #elif self.input.is_pressed('i'):
             #    self.update_signal_strength(-10)
-            elif keyboard.is_pressed('esc'):
+            elif self.input.is_pressed('esc'):
                 self.running = False
             # Test keys for winning and losing
-            #elif keyboard.is_pressed('w'):  # 'w' for win
+            #elif self.input.is_pressed('w'):  # 'w' for win
             #    self.samples_collected = self.total_samples
-            #elif keyboard.is_pressed('l'):  # 'l' for lose
+            #elif self.input.is_pressed('l'):  # 'l' for lose
             #    self.signal_strength = 1
-            #    self.low_signal_start_time = time.time() - 6  # Force immediate loss
-            #elif keyboard.is_pressed('v'):  # Add this to trigger video playback
+            #    self.low_signal_start_time = self.time - 6  # Force immediate loss
+            #elif self.input.is_pressed('v'):  # Add this to trigger video playback
             #    self.play_video("output_ascii_video.txt")
 
             if moved:
                 self.movement_step = 0
 
+        # The press that led to this step, vertical presses only count once the step actually happens
+        input_time = self.input.take_press_time('up', 'down', 'left', 'right') if dx or dy else None
         if not self.world.is_obstacle(self.player.x + dx, self.player.y + dy):
             self.world.move(dx, dy)  # Move the world instead of the player
+            if input_time is not None:
+                now = time.monotonic()
+                latency.record("input -> sim", now - input_time)
+                self.pending_inputs.append((input_time, now))
             if moved:
                 self.step_counter += 1
                 if self.step_counter % 2 == 0:
-                    self.sound_system.play_sound("footstep")
+                    self.sound_system.play_sound("footstep", input_time)
 
     def update(self):
+        current_time = self.time
+        # Calculate the time elapsed since the last update
+        elapsed_time = current_time - self.last_update_time
+        self.last_update_time = current_time
+
         if self.video_playing:
-            self.graphics.play_ascii_video(self.video_file)
-            self.video_playing = False
+            # Only picks the frame, the loop keeps running so input and audio stay live
+            self.video_frame = self.video.update()
+            if self.video.finished:
+                self.stop_video()
             return
 
         if self.game_over or self.game_won:
             return
 
-        current_time = time.time()
-        # Calculate the time elapsed since the last update
-        elapsed_time = current_time - self.last_update_time
-        self.total_time = int(time.time() - self.start_time)
+        self.total_time = int(self.time - self.start_time)
         
         if self.total_time > self.echo_creation_delay and len(self.world.echo_sources) == 0:
             self.world.generate_echo_sources()
@@ -184,13 +236,8 @@ class Game:
 
     def _process_frame(self, delta_time):
         if self.text_display_active:
-            if time.time() - self.last_type_time > 0.02 and self.text_index < len(self.current_text):
-                self.text_index += random.randint(1, 2)
-                if random.random() < 0.5:
-                    self.sound_system.play_sound("typing")
-                self.last_type_time = time.time()
-            elif self.text_index >= len(self.current_text):
-                self.text_fully_displayed = True
+            if not self.scheduled_subsystems:
+                self.update_typing()
             return
 
         item = self.world.get_item(self.player.x, self.player.y)
@@ -204,7 +251,7 @@ class Game:
         if self.update_counter >= 10:  # Update every 10 frames
 
             # Update humidity
-            if random.random() < 0.3:  # 30% chance to change humidity each update
+            if self.random.random() < 0.3:  # 30% chance to change humidity each update
                 self.humidity += self.humidity_direction
                 if self.humidity <= 96 or self.humidity >= 99:
                     self.humidity_direction *= -1
@@ -218,41 +265,26 @@ class Game:
             self.show_text(text_event)
 
         # Update ambient sounds
-        self.sound_system.update_ambient_sounds(delta_time)
+        if not self.scheduled_subsystems:
+            self.sound_system.update_ambient_sounds(delta_time)
 
         # Update echo sources
         self.world.update_echo_sources()
         
-        nearest_source, distance = self.world.get_nearest_echo_source(self.player.x, self.player.y)
-        
-        if not nearest_source:
-            distance = self.max_distance_to_echo
+        nearest_source, distance = self.get_echo_distance()
         
         # Handle echo effects
-        self.echo_cooldown -= 1
-        if self.echo_cooldown <= 0:
-            if nearest_source and distance < self.max_distance_to_echo:  # Only play echo if within range
-                direction = 0 if distance == 0 else (nearest_source.x - self.player.x) / distance
-                self.sound_system.play_echo(direction, distance)
-                # Calculate screen coordinates for the echo source
-                #self.graphics.add_ripple(nearest_source.x, nearest_source.y)
-                # Calculate cooldown based on distance to player
-                if distance > 30:
-                    self.echo_cooldown = random.randint(50, 80)
-                else:
-                    # Linear interpolation between 25 and 50 based on distance
-                    min_cooldown = 25
-                    max_cooldown = 50
-                    cooldown_range = max_cooldown - min_cooldown
-                    distance_factor = distance / 30  # Normalized distance (0 to 1)
-                    self.echo_cooldown = int(min_cooldown + (cooldown_range * distance_factor))
+        if not self.scheduled_subsystems:
+            self.echo_cooldown -= 1
+            if self.echo_cooldown <= 0:
+                self.echo_cooldown = self.play_echo(nearest_source, distance)
 
-        # Update ripples
-        self.graphics.update_ripples()
+        # Update ripples, old ones are removed
+        self.ripples = [(x, y, radius + 1) for x, y, radius in self.ripples if radius + 1 < 100]
 
         signal_change = 91 * (distance**1.5 / self.max_distance_to_echo)
         # Calculate temperature based on distance to nearest source
-        max_temp = 59 + random.uniform(-0.1, 0.1)
+        max_temp = 59 + self.random.uniform(-0.1, 0.1)
         min_temp = -148.0
         distance_factor = distance / self.max_distance_to_echo
         
@@ -262,18 +294,18 @@ class Game:
         temperature = min_temp + (max_temp - min_temp) * sigmoid
         
         # Add small random fluctuation
-        temperature += random.uniform(-0.3, 0.3)
+        temperature += self.random.uniform(-0.3, 0.3)
         
         # Ensure temperature stays within bounds
         temperature = max(min_temp, min(max_temp, temperature))
         
         self.set_temperature(temperature)
-        max_signal = 91 + random.uniform(-1, 1)+ random.uniform(-1, 1)
+        max_signal = 91 + self.random.uniform(-1, 1)+ self.random.uniform(-1, 1)
         self.set_signal_strength(min(max_signal, max(1, signal_change)))
 
         # Handle echo effects and scary texts
         if nearest_source and distance < self.max_distance_to_echo / 10:
-            if time.time() - self.last_scary_text_time > 15 and random.random() < 0.1:
+            if self.time - self.last_scary_text_time > 15 and self.random.random() < 0.1:
                 self.show_message(self.world.get_random_scary_text(), "scary")
 
         # Handle system messages only if there's no current message
@@ -281,10 +313,54 @@ class Game:
             self.check_system_messages()
 
         # Update text animations
-        self.update_text_animations()
+        if not self.scheduled_subsystems:
+            self.update_text_animations()
+
+    def is_simulating(self):
+        # False while the world stands still: text box, video, end screens
+        return not (self.text_display_active or self.video_playing or self.game_over or self.game_won)
+
+    def get_echo_distance(self):
+        nearest_source, distance = self.world.get_nearest_echo_source(self.player.x, self.player.y)
+        if not nearest_source:
+            distance = self.max_distance_to_echo
+        return nearest_source, distance
+
+    def play_echo(self, nearest_source, distance):
+        # Returns the ticks until the next echo, 0 if none was in range
+        if not (nearest_source and distance < self.max_distance_to_echo):  # Only play echo if within range
+            return 0
+        direction = 0 if distance == 0 else (nearest_source.x - self.player.x) / distance
+        self.sound_system.play_echo(direction, distance)
+        self.ripples.append((nearest_source.x + self.world.offset_x, nearest_source.y + self.world.offset_y, 0))
+        # Calculate cooldown based on distance to player
+        if distance > 30:
+            return self.random.randint(50, 80)
+        # Linear interpolation between 25 and 50 based on distance
+        min_cooldown = 25
+        max_cooldown = 50
+        cooldown_range = max_cooldown - min_cooldown
+        distance_factor = distance / 30  # Normalized distance (0 to 1)
+        return int(min_cooldown + (cooldown_range * distance_factor))
+
+    def update_typing(self):
+        # Types out the text box, or else the current message. Returns the seconds until the next character
+        # is due, None if there is nothing to type.
+        if not self.text_display_active:
+            return self.update_text_animations()
+        current_time = self.time
+        if self.text_index >= len(self.current_text):
+            self.text_fully_displayed = True
+            return None
+        if current_time - self.last_type_time > 0.02:
+            self.text_index += self.random.randint(1, 2)
+            if self.random.random() < 0.5:
+                self.sound_system.play_sound("typing")
+            self.last_type_time = current_time
+        return max(0, self.last_type_time + 0.02 - current_time)
 
     def check_system_messages(self):
-        current_time = time.time()
+        current_time = self.time
         
         # Check temperature
         if self.temperature < -100 and self.check_message_cooldown("low_temperature", current_time):
@@ -303,8 +379,8 @@ class Game:
         #    self.show_message(self.world.get_system_text("high_humidity"), "system")
 
         # Random system messages (very rare)
-        if random.random() < 0.002:  # Adjust this probability as needed
-            random_message = random.choice(["sensor_malfunction", "unknown_readings", "power_fluctuation", "radiation_spike", "magnetic_interference"])
+        if self.random.random() < 0.002:  # Adjust this probability as needed
+            random_message = self.random.choice(["sensor_malfunction", "unknown_readings", "power_fluctuation", "radiation_spike", "magnetic_interference"])
             if self.check_message_cooldown(random_message, current_time):
                 self.show_message(self.world.get_system_text(random_message), "system")
 
@@ -318,106 +394,210 @@ class Game:
         if not self.current_message or message_type == "scary":
             self.current_message = text
             self.message_index = 0
-            self.message_start_time = time.time()
+            self.message_start_time = self.time
             self.message_type = message_type
             if message_type == "scary":
-                self.last_scary_text_time = time.time()
+                self.last_scary_text_time = self.time
 
     def update_text_animations(self):
-        current_time = time.time()
+        # Returns the seconds until the message needs the next update, None without a message
+        current_time = self.time
 
         if self.current_message:
             if self.message_index < len(self.current_message):
                 if current_time - self.message_start_time > 0.02 * self.message_index:
-                    self.message_index += random.randint(1, 2)
-                    if random.random() < 0.5:
+                    self.message_index += self.random.randint(1, 2)
+                    if self.random.random() < 0.5:
                         self.sound_system.play_sound("typing")
+                return max(0, self.message_start_time + 0.02 * self.message_index - current_time)
             elif current_time - self.message_start_time > 2:
                 self.current_message = ""
                 self.message_type = None
+                return None
+            return self.message_start_time + 2 - current_time
+        return None
 
-    def render(self):
+    def take_snapshot(self):
+        # Everything render() needs from this tick, see snapshot.py
         if self.video_playing:
+            screen = "video"
+        elif self.game_won:
+            screen = "won"
+        elif self.game_over:
+            screen = "lost"
+        else:
+            screen = "world"
+        text = None
+        if self.text_display_active:
+            text = (self.current_text, self.text_index)
+        elif self.current_message:
+            text = (self.current_message[:self.message_index], self.message_index)
+        video_frame = None
+        if self.video_playing and self.video_frame is not None:
+            video_frame = (self.video_frame, self.video.frame_width, self.video.frame_height)
+        inputs, self.pending_inputs = tuple(self.pending_inputs), []
+        return FrameSnapshot(
+            time=self.time,
+            screen=screen,
+            world=WorldSnapshot.take(self.world) if screen == "world" else None,
+            player=PlayerSnapshot(self.player.x, self.player.y, self.player.char),
+            visibility_radius=self.visibility_radius,
+            ripples=tuple(self.ripples),
+            text=text,
+            stats=(self.samples_collected, self.total_samples, self.temperature, self.humidity, self.signal_strength),
+            total_time=self.total_time,
+            video_frame=video_frame,
+            inputs=inputs,
+        )
+
+    def render(self, snapshot):
+        # Only reads the snapshot, runs on the render thread while the simulation goes on
+        self.graphics.update_size()
+        for input_time, sim_time in snapshot.inputs:
+            self.graphics.track_input(input_time, sim_time)
+        if snapshot.screen == "video":
+            if snapshot.video_frame is not None:
+                self.graphics.clear()
+                self.graphics.draw_video_frame(*snapshot.video_frame)
+                self.graphics.render()
             return
 
-        if self.game_won:
-            self.render_win_screen()
-        elif self.game_over:
-            self.render_lose_screen()
+        if snapshot.screen == "won":
+            self.render_win_screen(snapshot)
+        elif snapshot.screen == "lost":
+            self.render_lose_screen(snapshot)
         else:
+            player = snapshot.player
+            signal_strength = snapshot.stats[-1]
             self.graphics.clear()
             self.graphics.draw_borders()
-            self.graphics.draw_world(self.world, self.player, self.visibility_radius, self.signal_strength)
-            self.graphics.draw_char(self.player.x, self.player.y, self.player.char)
+            self.graphics.draw_world(snapshot.world, player, snapshot.visibility_radius, signal_strength, snapshot.ripples,
+                                     snapshot.time)
+            self.graphics.draw_char(player.x, player.y, player.char)
             
-            if self.text_display_active:
-                self.graphics.draw_animated_text(self.current_text, self.text_index)
-            elif self.current_message:
-                self.graphics.draw_animated_text(self.current_message[:self.message_index], self.message_index)
+            if snapshot.text:
+                self.graphics.draw_animated_text(*snapshot.text)
             else:
-                self.graphics.draw_stats(self.samples_collected, self.total_samples, self.temperature, self.humidity, self.signal_strength)
+                self.graphics.draw_stats(*snapshot.stats)
             
             self.graphics.render()
 
-    def render_win_screen(self):
+    def render_win_screen(self, snapshot):
         self.graphics.clear()
-        self.graphics.draw_animated_background(time.time())
+        self.graphics.draw_animated_background(snapshot.time)
         self.graphics.draw_borders()
-        self.graphics.draw_text(16, 0, f"SYS: {time.strftime('%H:%M:%S')} | MEM: 64kb")
-        self.graphics.draw_text(12, 9, "| OPERATION COMPLETE |")
-        self.graphics.draw_text(13, 11, f"Total Time: {self.total_time}s")
-        self.graphics.draw_text(13, 13, " 1. Restart ")
-        self.graphics.draw_text(13, 14, " 2. Terminate ")
-        self.graphics.draw_text(12, 21, "| v1.19 | 1980 | Subterra LTD")
+        self.graphics.draw_right_text(0, f"SYS: {time.strftime('%H:%M:%S', time.localtime(snapshot.time))} | MEM: 64kb")
+        self.graphics.draw_panel_text(12, 9, "| OPERATION COMPLETE |")
+        self.graphics.draw_panel_text(13, 11, f"Total Time: {snapshot.total_time}s")
+        self.graphics.draw_panel_text(13, 13, " 1. Restart ")
+        self.graphics.draw_panel_text(13, 14, " 2. Terminate ")
+        self.graphics.draw_right_text(self.graphics.height - 1, "| v1.19 | 1980 | Subterra LTD")
         self.graphics.render()
 
-    def render_lose_screen(self):
+    def render_lose_screen(self, snapshot):
         self.graphics.clear()
-        self.graphics.draw_animated_background(time.time())
+        self.graphics.draw_animated_background(snapshot.time)
         self.graphics.draw_borders()
-        self.graphics.draw_text(16, 0, f"SYS: {time.strftime('%H:%M:%S')} | MEM: 64kb")
-        self.graphics.draw_text(13, 9, "| CONNECTION LOST |")
-        self.graphics.draw_text(13, 13, " 1. Restart ")
-        self.graphics.draw_text(13, 14, " 2. Terminate ")
-        self.graphics.draw_text(12, 21, "| v1.19 | 1980 | Subterra LTD")
+        self.graphics.draw_right_text(0, f"SYS: {time.strftime('%H:%M:%S', time.localtime(snapshot.time))} | MEM: 64kb")
+        self.graphics.draw_panel_text(13, 9, "| CONNECTION LOST |")
+        self.graphics.draw_panel_text(13, 13, " 1. Restart ")
+        self.graphics.draw_panel_text(13, 14, " 2. Terminate ")
+        self.graphics.draw_right_text(self.graphics.height - 1, "| v1.19 | 1980 | Subterra LTD")
         self.graphics.render()
 
-    def run(self):
+    def render_loop(self):
+        # Draws whatever the simulation published last. A slow terminal makes this thread skip snapshots,
+        # the simulation never waits for it.
+        try:
+            while not self.render_stop.is_set():
+                snapshot = self.snapshots.take(timeout=0.1)
+                if snapshot is None:
+                    continue
+                start = time.perf_counter()
+                self.render(snapshot)
+                if self.slow_frames:
+                    self.slow_frames.frame_done(self.graphics, time.perf_counter() - start)
+                startup.mark("game first frame")
+        except Exception as error:
+            # Handed to the simulation thread, raised there once it stopped
+            self.render_error = error
+            self.running = False
+
+    def start_render_thread(self):
+        self.render_stop.clear()
+        self.render_thread = threading.Thread(target=self.render_loop, daemon=True)
+        self.render_thread.start()
+
+    def stop_render_thread(self):
+        self.render_stop.set()
+        self.render_thread.join()
+        self.render_thread = None
+        if self.render_error:
+            raise self.render_error
+
+    def start(self):
+        # Before the first step, whichever runner runs the game
         if self.show_intro:
             self.show_text(self.intro_text)
             self.show_intro = False
 
-        while self.running:            
-            current_time = time.time()
-            frame_time = 1 / 60         
-            
-            # Calculate the time elapsed since the last update
-            elapsed_time = current_time - self.last_update_time
-            
-            # Only process the last frame
-            if elapsed_time < frame_time:
-                continue                
-            
-            self.last_update_time = current_time
-            self.handle_input()
-            self.update()
-            if not self.video_playing:
-                self.render()
-
-            if self.game_over or self.game_won:
-                choice = self.handle_end_game_input()
-                if choice == 1:
-                    return True  # Restart the game
-                elif choice == 2:
-                    self.running = False
+    def run(self, next_run=None):
+        self.start()
+        self.start_render_thread()
+        try:
+            return self.run_simulation(next_run)
+        finally:
+            self.stop_render_thread()
+
+    def run_simulation(self, next_run):
+        # Fixed tick, the simulation clock doesn't depend on how long frames take to reach the screen
+        tick = 1 / self.tick_rate
+        next_tick = time.monotonic()
+        while self.running:
+            now = time.monotonic()
+            if now < next_tick:
+                time.sleep(next_tick - now)
+                continue
+            # After a long stall (a debugger, the machine sleeping) carry on instead of running every missed tick
+            next_tick = max(next_tick + tick, now - tick)
+            if self.step(next_run):
+                return True  # Restart the game
 
         self.sound_system.stop_music()
         return False  # Terminate the game
 
+    def step(self, next_run=None):
+        # One simulation tick, whichever runner calls it. Returns True once the game should restart.
+        start = time.perf_counter()
+        self.ticks += 1
+        self.time = self.clock_start + self.ticks / self.tick_rate
+        events = self.input.poll()
+        if self.recorder:
+            self.recorder.record(self.ticks, events)
+        self.handle_input()
+        self.update()
+        self.snapshots.publish(self.take_snapshot())
+        if self.slow_frames:
+            self.slow_frames.tick_done(self, time.perf_counter() - start)
+
+        if self.game_over or self.game_won:
+            if next_run:
+                next_run.start()  # Build the next world while the end screen is up
+            choice = self.handle_end_game_input()
+            if choice == 1:
+                self.restart_requested = True
+            elif choice == 2:
+                self.running = False
+                return False
+            # Keep the end screen going until the next world is ready, restarting never waits on generation
+            if self.restart_requested and (next_run is None or next_run.is_ready()):
+                return True
+        return False
+
     def handle_end_game_input(self):
-        if keyboard.is_pressed('1'):
+        if self.input.is_pressed('1'):
             return 1
-        elif keyboard.is_pressed('2'):
+        elif self.input.is_pressed('2'):
             return 2
         return None
 
@@ -439,39 +619,66 @@ class Game:
             self.text_fully_displayed = False
 
     def play_video(self, video_file):
+        self.start_video(self.graphics.open_ascii_video(video_file))
+
+    def play_live_video(self, input_video):
+        from video_converter import LiveAsciiVideo  # Pulls in OpenCV, only load it when a video is played
+        # Converts while it plays, so there is no wait for the whole clip to be converted first
+        source = LiveAsciiVideo(input_video, width=self.graphics.width)
+        self.start_video(VideoPlayer(source, source.fps, source.width, source.height))
+
+    def start_video(self, video):
+        # The clock starts on the first update, once the source has a frame ready
+        self.video = video
+        self.video_frame = None
         self.video_playing = True
-        self.video_file = video_file
+
+    def stop_video(self):
+        self.video.stop()
+        self.video_stats = self.video.get_stats()
+        self.video_playing = False
+        self.video = None
 
     def convert_and_play_video(self, input_video, output_file):
-        convert_video_to_ascii(input_video, output_file, width=self.width)
+        from video_converter import convert_video_to_ascii
+        convert_video_to_ascii(input_video, output_file, width=self.graphics.width)
         self.play_video(output_file)
 
-def main_menu():
-    graphics = Graphics(42, 22)
-    sound_system = SoundSystem()
+def main_menu(sound_system=None, next_run=None, input_system=None):
+    sound_system = sound_system or registry.sound_system()
+    input_system = input_system or registry.input_system()
+    graphics = Graphics()  # Follows the terminal size
     sound_system.play_music("ambient_horror")
+    if next_run:
+        next_run.start()  # The first world is built while the menu is up
     t = 0
+    start_requested = False
     running = True
     while running:
         start_time = time.time()
         
+        graphics.update_size()
         graphics.clear()
         graphics.draw_animated_background(t)
         graphics.draw_borders()
-        graphics.draw_text(16, 0, f"SYS: {time.strftime('%H:%M:%S')} | MEM: 64kb")
-        graphics.draw_text(5, 9, "| SMI-1980 Operating Interface |")
-        graphics.draw_text(13, 11, " 1. Initialize ")
-        graphics.draw_text(13, 12, " 2. Terminate ")
-        graphics.draw_text(12, 21, "| v1.19 | 1980 | Subterra LTD")
+        graphics.draw_right_text(0, f"SYS: {time.strftime('%H:%M:%S')} | MEM: 64kb")
+        graphics.draw_panel_text(5, 9, "| SMI-1980 Operating Interface |")
+        graphics.draw_panel_text(13, 11, " 1. Initialize ")
+        graphics.draw_panel_text(13, 12, " 2. Terminate ")
+        graphics.draw_right_text(graphics.height - 1, "| v1.19 | 1980 | Subterra LTD")
         graphics.render()
+        startup.mark("menu first frame")
 
         t += 0.1  # Increment time for animation
 
-        if keyboard.is_pressed('1'):
-            return True
-        elif keyboard.is_pressed('2'):
+        input_system.poll()
+        if input_system.is_pressed('1'):
+            start_requested = True
+        elif input_system.is_pressed('2'):
             sound_system.stop_music()
             return False
+        if start_requested and (next_run is None or next_run.is_ready()):
+            return True
 
         # Limit the frame rate to about 20 FPS
         elapsed_time = time.time() - start_time
@@ -481,11 +688,77 @@ def main_menu():
     return False
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ASCII horror game")
+    parser.add_argument("--startup-report", action="store_true", help="Print startup timings on exit")
+    parser.add_argument("--latency-report", action="store_true", help="Print input latency histograms on exit")
+    parser.add_argument("--output", default=None, help="ansi (default), curses, null or file:PATH")
+    parser.add_argument("--adaptive-output", action="store_true",
+                        help="Skip frames when the terminal can't keep up, e.g. over slow SSH links")
+    parser.add_argument("--output-rate", type=int, default=None, help="Limit output to this many bytes per second")
+    parser.add_argument("--spectate", action="append", default=[], metavar="ADDRESS",
+                        help="Broadcast the game to spectators on tcp:[HOST:]PORT or pipe:PATH, can be repeated")
+    parser.add_argument("--input", choices=["keyboard", "stdin"], default=None,
+                        help="Keyboard hook (needs root on Linux) or terminal input, tries the hook first by default")
+    parser.add_argument("--save", metavar="PATH",
+                        help="Esc saves the run to this file, the next start resumes it")
+    parser.add_argument("--slow-frames", metavar="DIR",
+                        help="Save the game to this directory whenever a tick or frame is slow, see savegame.py")
+    parser.add_argument("--slow-frame-ms", type=float, default=1000 / 60, help="What counts as slow")
+    parser.add_argument("--record", metavar="PATH",
+                        help="Record the inputs of every run to replay it with recording.py, PATH-2 etc. for restarts")
+    parser.add_argument("--runner", choices=["threads", "asyncio"], default="threads",
+                        help="Run the game on its own simulation and render threads, or as tasks on an asyncio loop")
+    args = parser.parse_args()
+    startup.mark("imports done")
+    try:
+        registry.input_system(args.input)
+    except ValueError as error:
+        parser.error(str(error))
+    try:
+        registry.output(args.output, args.adaptive_output, args.output_rate, args.spectate)
+    except (ValueError, OSError) as error:
+        parser.error(str(error))  # Also a bad --spectate address, or its port already taken
+    # Sounds, terrain noise and character tables are built once in the background and shared
+    # by the menu and every run after it
+    registry.warm_up()
+    next_run = NextRunBuilder(256, 256)
+    runs = 0
     while True:
-        if main_menu():
-            game = Game(42, 22)
-            if not game.run():
+        if main_menu(next_run=next_run):
+            game = None
+            if args.save and os.path.exists(args.save):
+                try:
+                    game = read_save(args.save)
+                except (OSError, SaveError, struct.error) as error:
+                    print(f"Can't resume {args.save}: {error}")
+            if game is None:
+                game = Game(world=next_run.take())
+            if args.slow_frames:
+                game.slow_frames = SlowFrameRecorder(args.slow_frames, args.slow_frame_ms / 1000)
+            runs += 1
+            if args.record:
+                base, extension = os.path.splitext(args.record)
+                game.recorder = InputRecorder(args.record if runs == 1 else f"{base}-{runs}{extension}", game)
+            if args.runner == "asyncio":
+                restart = asyncio.run(AsyncGameRunner(game, next_run).run())
+            else:
+                restart = game.run(next_run)
+            if game.recorder:
+                game.recorder.close()
+            if args.save:
+                # A finished run starts over next time, one that was quit carries on
+                if game.game_over or game.game_won:
+                    if os.path.exists(args.save):
+                        os.remove(args.save)
+                else:
+                    write_save(game, args.save)
+            if not restart:
                 break
         else:
             break
-    print("Bye")
\ No newline at end of file
+    next_run.discard()
+    print("Bye")
+    if args.startup_report:
+        startup.report()
+    if args.latency_report:
+        latency.report()
\ No newline at end of file
@@ -1,178 +1,330 @@
 import os
 import random
 import math
-import sys
 import time
-from utils import is_visible, generate_perlin_noise, get_wave_char
-import keyboard
+import numpy as np
+import latency
+from utils import generate_perlin_noise_grid
+from ascii_video import AsciiVideo, is_ascii_video, load_legacy_ascii_video
+from video_player import VideoPlayer
+from assets import registry
+
+# Terminal sizes the viewport follows, smaller terminals still get the original 42x22 screen
+MIN_WIDTH, MIN_HEIGHT = 42, 22
+MAX_WIDTH, MAX_HEIGHT = 300, 90
+
+def to_codes(text):
+    return np.frombuffer(text.encode('utf-32-le'), dtype='<u4')
+
+def to_text(codes):
+    return codes.tobytes().decode('utf-32-le')
+
+def resize_array(array, shape):
+    # Same dtype, the part that fits in both shapes is kept, the rest is zeros
+    resized = np.zeros(shape, dtype=array.dtype)
+    overlap = tuple(slice(0, min(old, new)) for old, new in zip(array.shape, shape))
+    resized[overlap] = array[overlap]
+    return resized
+
+def obstacles_at(world, xs, ys):
+    # world.is_obstacle for whole arrays of positions
+    xs = xs + world.offset_x
+    ys = ys + world.offset_y
+    inside = (xs >= 0) & (xs < world.width) & (ys >= 0) & (ys < world.height)
+    obstacles = np.zeros(xs.shape, dtype=bool)
+    obstacles[inside] = world.walls[ys[inside], xs[inside]]
+    return obstacles
 
 class Graphics:
-    def __init__(self, width, height):
-        self.width = width
-        self.height = height
-        self.game_height = height - 3  # Reserve 3 lines for text
-        self.buffer = [[' ' for _ in range(width)] for _ in range(height)]
-        self.previous_buffer = [[' ' for _ in range(width)] for _ in range(height)]
-        self.distortion_map = {}
+    def __init__(self, width=None, height=None, output=None):
+        # Terminal, curses, file or nothing, see output.py
+        self.output = output or registry.output()
+        # Without a size the screen follows the terminal, see update_size()
+        self.follow_terminal = width is None
+        # Distortions are kept per screen cell: the character, and the frames it has left (0 means none)
+        self.distortion_chars = np.zeros((0, 0), dtype='<u4')
+        self.distortion_ttl = np.zeros((0, 0), dtype=np.int8)
         self.distortion_duration = 2  # frames
-        self.corrupted_lines = set()
+        self.corrupted_lines = np.zeros(0, dtype=bool)  # Rows replaced by random characters
         self.corrupted_line_duration = 3  # frames
-        self.unseen_distortions = {}
-        self.ripples = []
-        self.corrupted_chars = '!#$%^&*()_-={}[]|\\:;"\'<>,.?/'
-        self.cursed_chars = '⛧⎊⏧⏣☈☇⚯⚮⛮⛥⛤⛢⚝⚹⚶⚸⭘⭙⭔⭓⍜⍛⍭⍱⍲'
-        self.cursed_words = ['ĄBØMINĄTIØN', 'DÆMØN', 'DĘVĮŁ', 'ĘVĪŁ', 'FĪĘND', 'HĄUNT', 'HØRRØR', 'PHĄNTĄSM', 'SPĪRĪT', 'WRĄĪTH', 'BŁĄSPHĘMY', 'CĄRNĄGĘ', 'DĘSĘCRĄTĪØN', 'ĘNTRÅĪŁS', 'FŁĘSHGØŁĘM', 'GĪBBĘT', 'HĘŁŁSPĄWN', 'ĪMMØŁĄTĪØN', 'MĄDNĘSS', 'NĘCRØPHĄGĘ', 'PĘSTĪŁĘNCĘ', 'QUĘŁCH', 'RĄVĄGĘ', 'SŁĄUGHTĘR', 'TØRMĘNT', 'UNDĘĄD', 'VĪSCĘRĄ', 'WRĘTCH', 'YØKĄĪ']
-        self.obstacle_char = '▓'
-        self.unseen_char = '░'
-        self.empty_char = ' '
-        self.echo_chars = '⛧⎊⏧⏣☈☇⚯⚮⛮⛥⛤⛢⚝⚹⚶⚸⭘⭙⭔⭓⍜⍛⍭⍱⍲ĄĪĘØÆĪŁ'
+        self.unseen_distortion_grid = np.zeros((0, 0), dtype='<u4')
+        self.unseen_distortion_ttl = np.zeros((0, 0), dtype=np.int8)
+        self.pending_inputs = []  # (input time, sim time) of changes waiting to be written out
+        # Shared tables, see assets.build_char_tables
+        chars = registry.char_tables()
+        self.corrupted_chars = chars["corrupted_chars"]
+        self.cursed_chars = chars["cursed_chars"]
+        self.corrupted_and_cursed_chars = chars["corrupted_and_cursed_chars"]
+        self.cursed_words = chars["cursed_words"]
+        self.obstacle_char = chars["obstacle_char"]
+        self.unseen_char = chars["unseen_char"]
+        self.empty_char = chars["empty_char"]
+        self.echo_chars = chars["echo_chars"]
+        self.unseen_distortion_chars = chars["unseen_distortion_chars"]
+        self.corrupted_codes = to_codes(self.corrupted_chars)
+        self.corrupted_and_cursed_codes = to_codes(self.corrupted_and_cursed_chars)
+        self.echo_codes = to_codes(self.echo_chars)
+        self.unseen_distortion_codes = to_codes(self.unseen_distortion_chars)
         self.disable_render = False
+        # Distortions are random, see seed()
+        self.random = random.Random()
+        self.rng = np.random.default_rng()
         self.line_distortion_multiplier = 0.7
         self.symbol_distortion_multiplier = 0.7
+        self.visibility_offsets = {}  # radius -> cells around the player that can be visible at all
+        self.visibility_rays = {}  # (radius, player x, player y) -> rays to those cells, see get_visibility_rays
+        self.visible_cells_key = None  # Where the visible cells were found last, they stay until the world moves
+        self.visible_cells = None
+        self.ring_offsets = {}  # radius -> dx and dy arrays of the cells on a ripple of that size
+        # The echo blob is the same shape around every echo, only its noise changes over time
+        self.echo_dy, self.echo_dx = np.mgrid[-6:7, -18:19]
+        self.echo_threshold = np.sqrt((self.echo_dx / 3) ** 2 + self.echo_dy ** 2) / 15 * 0.25
+        if self.follow_terminal:
+            width, height = self.get_terminal_viewport()
+        self.resize(width, height)
+
+    def seed(self, seed):
+        # A seeded screen draws the same frames from the same snapshots, see recording.py
+        self.random = random.Random(seed)
+        self.rng = np.random.default_rng(seed)
+
+    def get_terminal_viewport(self):
+        size = self.output.get_size()
+        if size is None:
+            return MIN_WIDTH, MIN_HEIGHT
+        columns, rows = size
+        # One row is left for the cursor, see render()
+        return min(max(columns, MIN_WIDTH), MAX_WIDTH), min(max(rows - 1, MIN_HEIGHT), MAX_HEIGHT)
+
+    def resize(self, width, height):
+        self.width = width
+        self.height = height
+        self.game_height = height - 3  # Reserve 3 lines for text
+        # Screen buffers hold code points, a row is turned into text only when it is written out
+        self.buffer = np.full((height, width), ord(' '), dtype='<u4')
+        self.previous_buffer = np.zeros((height, width), dtype='<u4')  # Matches nothing, so everything is drawn
+        # Layouts made for the original 42x22 screen are centered on bigger ones
+        self.panel_x = (width - MIN_WIDTH) // 2
+        self.panel_y = (height - MIN_HEIGHT) // 2
+        self.background_y, self.background_x = np.mgrid[0:height, 0:width]
+        # Distortions that still fit on the new screen are kept
+        self.distortion_chars = resize_array(self.distortion_chars, (height, width))
+        self.distortion_ttl = resize_array(self.distortion_ttl, (height, width))
+        self.unseen_distortion_grid = resize_array(self.unseen_distortion_grid, (height, width))
+        self.unseen_distortion_ttl = resize_array(self.unseen_distortion_ttl, (height, width))
+        self.corrupted_lines = resize_array(self.corrupted_lines, (height,))
+        self.corrupted_lines[height - 1:] = False  # The bottom row is never corrupted
+
+    def update_size(self):
+        # Call once per frame, follows terminal resizes. Returns True if the size changed.
+        if not self.follow_terminal:
+            return False
+        width, height = self.get_terminal_viewport()
+        if (width, height) == (self.width, self.height):
+            return False
+        self.resize(width, height)
+        self.output.clear_screen()
+        return True
 
     def clear(self):
         if self.disable_render:
             return
-        self.buffer = [[' ' for _ in range(self.width)] for _ in range(self.height)]
+        self.buffer.fill(ord(' '))
 
     def draw_char(self, x, y, char):
         if 0 <= x < self.width and 0 <= y < self.height:
-            self.buffer[y][x] = char
+            self.buffer[y, x] = ord(char)
 
     def draw_borders(self):
-        for x in range(self.width):
-            self.draw_char(x, 0, '-')
-            self.draw_char(x, self.height - 1, '-')
-        for y in range(self.height):
-            self.draw_char(0, y, '|')
-            self.draw_char(self.width - 1, y, '|')
+        self.buffer[0, :] = ord('-')
+        self.buffer[self.height - 1, :] = ord('-')
+        self.buffer[:, 0] = ord('|')
+        self.buffer[:, self.width - 1] = ord('|')
 
     def render(self):
         if self.disable_render:
             return
+        if not self.output.begin_frame():
+            # The output is behind, previous_buffer stays as it is so the next frame brings every change
+            return
         
-        # Move cursor to top-left corner
-        sys.stdout.write("\033[H")
-        sys.stdout.flush()
-        
-        for y, row in enumerate(self.buffer):
-            if row != self.previous_buffer[y]:
-                # Move cursor to the beginning of the line
-                sys.stdout.write(f"\033[{y + 1};1H")
-                # Write the entire row
-                sys.stdout.write(''.join(row))
-                sys.stdout.flush()
-                self.previous_buffer[y] = row[:]
+        changed = np.flatnonzero((self.buffer != self.previous_buffer).any(axis=1))
+        for y in changed:
+            self.output.write_row(y, to_text(self.buffer[y]))
+        self.previous_buffer[changed] = self.buffer[changed]
         
-        # Move cursor to the bottom of the screen
-        sys.stdout.write(f"\033[{self.height + 1};1H")
-        sys.stdout.flush()
+        self.output.end_frame(self.height)
+
+        if self.pending_inputs:
+            now = time.monotonic()
+            for input_time, sim_time in self.pending_inputs:
+                latency.record("sim -> display", now - sim_time)
+                latency.record("input -> display", now - input_time)
+            self.pending_inputs = []
+
+    def track_input(self, input_time, sim_time):
+        # The change caused by this input is in the buffer, render() records when it reaches the terminal
+        self.pending_inputs.append((input_time, sim_time))
 
     def draw_text(self, x, y, text):
-        for i, char in enumerate(text):
-            self.draw_char(x + i, y, char)
+        if not 0 <= y < self.height or not text:
+            return
+        codes = to_codes(text)
+        start, end = max(x, 0), min(x + len(codes), self.width)
+        if start < end:
+            self.buffer[y, start:end] = codes[start - x:end - x]
+
+    def draw_panel_text(self, x, y, text):
+        # Positions on the original 42x22 screen, centered on bigger ones
+        self.draw_text(self.panel_x + x, self.panel_y + y, text)
 
-    def draw_world(self, world, player, visibility_radius, signal_strength):
+    def draw_right_text(self, y, text):
+        # Ends one column before the right border
+        self.draw_text(self.width - 1 - len(text), y, text)
+
+    def get_visibility_offsets(self, radius):
+        # Only cells inside the view ellipse can be visible, everything else on screen is unseen without
+        # looking, so the ray casts cost the same on any screen size
+        offsets = self.visibility_offsets.get(radius)
+        if offsets is None:
+            offsets = [(dx, dy) for dy in range(-radius, radius + 1) for dx in range(-2 * radius, 2 * radius + 1)
+                       if (dx / 2) ** 2 + dy ** 2 <= radius ** 2]
+            self.visibility_offsets[radius] = offsets
+        return offsets
+
+    def get_visibility_rays(self, radius, player_x, player_y):
+        # The cells utils.is_visible steps through on its way to each cell of the view ellipse, one row per
+        # cell, padded with the player's own cell. The player stays put while the world moves, so this is
+        # only built once.
+        key = (radius, player_x, player_y)
+        rays = self.visibility_rays.get(key)
+        if rays is None:
+            offsets = self.get_visibility_offsets(radius)
+            length = max(max(abs(dx), abs(dy)) for dx, dy in offsets)
+            ray_x = np.full((len(offsets), length), player_x, dtype=np.intp)
+            ray_y = np.full((len(offsets), length), player_y, dtype=np.intp)
+            for i, (dx, dy) in enumerate(offsets):
+                steps = max(abs(dx), abs(dy))
+                if steps == 0:
+                    continue
+                # Same float steps and rounding as is_visible, so the same cells
+                step_x, step_y = dx / steps, dy / steps
+                x, y = player_x, player_y
+                for j in range(steps):
+                    ray_x[i, j], ray_y[i, j] = round(x), round(y)
+                    x += step_x
+                    y += step_y
+            offsets = np.array(offsets, dtype=np.intp)
+            rays = offsets[:, 0], offsets[:, 1], ray_x, ray_y
+            self.visibility_rays[key] = rays
+        return rays
+
+    def get_visible_cells(self, world, player, radius):
+        # Offsets from the player of the cells it can see and which of them are walls, for all rays at once.
+        # open_cells[dy + radius, dx + 2 * radius] tells if an item there would be seen.
+        key = (radius, player.x, player.y, world.offset_x, world.offset_y, id(world.walls))
+        if key != self.visible_cells_key:
+            dx, dy, ray_x, ray_y = self.get_visibility_rays(radius, player.x, player.y)
+            on_map = (ray_x >= 0) & (ray_x < world.width) & (ray_y >= 0) & (ray_y < world.height)
+            visible = ~(obstacles_at(world, ray_x, ray_y) & on_map).any(axis=1)
+            dx, dy = dx[visible], dy[visible]
+            obstacle = obstacles_at(world, player.x + dx, player.y + dy)
+            open_cells = np.zeros((2 * radius + 1, 4 * radius + 1), dtype=bool)
+            open_cells[dy + radius, dx + 2 * radius] = ~obstacle
+            self.visible_cells = dx, dy, obstacle, open_cells
+            self.visible_cells_key = key
+        return self.visible_cells
+
+    def draw_world(self, world, player, visibility_radius, signal_strength, ripples=(), t=None):
         distortion_intensity = self.apply_distortions(signal_strength)
-        chars_set = self.corrupted_chars
+        chars_set = self.corrupted_codes
         if distortion_intensity > 0.66:
-            chars_set += self.cursed_chars        
+            chars_set = self.corrupted_and_cursed_codes
         
         player_screen_x = self.width // 2
         player_screen_y = self.game_height // 2
+        separator_y = self.game_height - 1
         
         unseen_char = self.unseen_char
         obstacle_char = self.obstacle_char
         empty_char = self.empty_char
-        if distortion_intensity > 0.7 and random.random() < 0.11:
+        if distortion_intensity > 0.7 and self.random.random() < 0.11:
             unseen_char = self.obstacle_char
             obstacle_char = self.empty_char
             empty_char = self.unseen_char
-            
-        for screen_y in range(self.height):
-            if screen_y == 18:
-                for screen_x in range(self.width):
-                    self.draw_char(screen_x, screen_y, '-')
-                continue
-            
-            line = []
-            for screen_x in range(self.width):
-                world_x = player.x + (screen_x - player_screen_x)
-                world_y = player.y + (screen_y - player_screen_y)
-                
-                if screen_y in self.corrupted_lines:
-                    if distortion_intensity > 0.4 and random.random() < 0.3:
-                        cursed_word = random.choice(self.cursed_words)
-                        start_pos = random.randint(0, self.width - len(cursed_word))
-                        for i in range(self.width):
-                            if start_pos <= i < start_pos + len(cursed_word):
-                                line.append(cursed_word[i - start_pos])
-                            else:
-                                line.append(random.choice(chars_set))
-                    else:
-                        line.append(random.choice(chars_set))
-                elif (screen_x, screen_y) in self.distortion_map:
-                    line.append(self.distortion_map[(screen_x, screen_y)][0])
-                elif screen_y < 18 and 0 <= world_x < world.width and 0 <= world_y < world.height:
-                    if is_visible(player.x, player.y, world_x, world_y, visibility_radius, world):
-                        if world.is_obstacle(world_x, world_y):
-                            line.append(obstacle_char)
-                        elif (world_x, world_y) in world.items:
-                            line.append(world.items[(world_x, world_y)])
-                        else:
-                            line.append(empty_char)
-                    else:
-                        if (screen_x, screen_y) in self.unseen_distortions:
-                            line.append(self.unseen_distortions[(screen_x, screen_y)][0])
-                        else:
-                            line.append(unseen_char)
-                else:
-                    line.append(empty_char)
-            
-            # Ensure the line is exactly self.width characters long
-            line = line[:self.width]
-            if len(line) < self.width:
-                line.extend([empty_char] * (self.width - len(line)))
-            
-            for screen_x, char in enumerate(line):
-                self.draw_char(screen_x, screen_y, char)
-                    
-        self.draw_ripples(player)
-                    
-        for echo in world.echo_sources:
-            world_x, world_y = echo.x, echo.y
-            for dy in range(-6, 7):
-                screen_y = world_y - player.y + player_screen_y + dy
-                if screen_y >= self.game_height:
-                    continue
-                for dx in range(-18, 19):
-                    screen_x = world_x - player.x + player_screen_x + dx
-                    
-                    
-                    # Use Perlin noise to create a fluctuating blob shape
-                    ping_pong_time = math.sin(time.time() % 15) + (time.time() % 100) * 0.02
-                    noise_value = generate_perlin_noise(dx, dy, ping_pong_time, scale=0.045, octaves=6, persistence=0.6, lacunarity=3.0)
+
+        view = self.buffer
+        view.fill(ord(empty_char))
+
+        # The part of the world on screen, above the separator
+        left = player.x - player_screen_x
+        top = player.y - player_screen_y
+        x0, x1 = max(0, -left), min(self.width, world.width - left)
+        y0, y1 = max(0, -top), min(separator_y, world.height - top)
+        if x0 < x1 and y0 < y1:
+            view[y0:y1, x0:x1] = ord(unseen_char)
+            np.copyto(view[y0:y1, x0:x1], self.unseen_distortion_grid[y0:y1, x0:x1],
+                      where=self.unseen_distortion_ttl[y0:y1, x0:x1] > 0)
+            dx, dy, obstacle, open_cells = self.get_visible_cells(world, player, visibility_radius)
+            screen_x = player_screen_x + dx
+            screen_y = player_screen_y + dy
+            on_screen = (screen_x >= x0) & (screen_x < x1) & (screen_y >= y0) & (screen_y < y1)
+            view[screen_y[on_screen], screen_x[on_screen]] = np.where(obstacle[on_screen], ord(obstacle_char), ord(empty_char))
+            # Few items, look each one up instead of every visible cell
+            radius = visibility_radius
+            for (item_x, item_y), char in world.items.items():
+                dx = item_x - player.x
+                dy = item_y - player.y
+                screen_x = player_screen_x + dx
+                screen_y = player_screen_y + dy
+                if abs(dx) <= 2 * radius and abs(dy) <= radius and open_cells[dy + radius, dx + 2 * radius] and \
+                   x0 <= screen_x < x1 and y0 <= screen_y < y1:
+                    view[screen_y, screen_x] = ord(char)
+
+        distorted = self.distortion_ttl > 0
+        distorted[separator_y] = False
+        np.copyto(view, self.distortion_chars, where=distorted)
+
+        corrupted_lines = self.corrupted_lines.copy()
+        corrupted_lines[separator_y] = False
+        corrupted_lines = np.flatnonzero(corrupted_lines)
+        if len(corrupted_lines):
+            # Every corrupted line filled with random characters at once
+            view[corrupted_lines] = chars_set[self.rng.integers(len(chars_set), size=(len(corrupted_lines), self.width))]
+        if distortion_intensity > 0.4:
+            for screen_y in corrupted_lines:
+                cursed_word = self.random.choice(self.cursed_words)
+                self.draw_text(self.random.randint(0, max(0, self.width - len(cursed_word))), screen_y, cursed_word)
+
+        view[separator_y] = ord('-')
                     
-                    # Determine if this position should be part of the echo
-                    # Calculate distance from center
-                    distance_from_center = math.sqrt((dx/3)**2 + dy**2)
-                    # Adjust threshold based on distance
-                    threshold = 0 + (distance_from_center / 15) * 0.25  # Adjust multiplier as needed
-                    if noise_value > threshold:
-                        # Use world coordinates to seed the random choice
-                        time_random_shift = int(time.time()*10) % len(self.echo_chars)
-                        pattern_index = ((world_x+dx)*100 + (world_y+dy)*100 + time_random_shift) % len(self.echo_chars)
-                        
-                        char = self.echo_chars[pattern_index]
-                        self.draw_char(screen_x, screen_y, char)
-                            
+        self.draw_ripples(ripples, world, player, player_screen_x, player_screen_y)
 
+        self.draw_echoes(world, player, player_screen_x, player_screen_y, time.time() if t is None else t)
         
         self.draw_char(player_screen_x, player_screen_y, player.char)
 
+    def draw_echoes(self, world, player, player_screen_x, player_screen_y, now):
+        if not world.echo_sources:
+            return
+        # Use Perlin noise to create a fluctuating blob shape, the same noise for every echo this frame
+        ping_pong_time = math.sin(now % 15) + (now % 100) * 0.02
+        noise_value = generate_perlin_noise_grid(self.echo_dx, self.echo_dy, ping_pong_time, scale=0.045, octaves=6, persistence=0.6, lacunarity=3.0)
+        # Determine if this position should be part of the echo, the threshold grows with the distance from center
+        blob = noise_value > self.echo_threshold
+        time_random_shift = int(now * 10) % len(self.echo_codes)
+        for echo in world.echo_sources:
+            screen_x = echo.x - player.x + player_screen_x + self.echo_dx
+            screen_y = echo.y - player.y + player_screen_y + self.echo_dy
+            mask = blob & (screen_x >= 0) & (screen_x < self.width) & (screen_y >= 0) & (screen_y < min(self.game_height, self.height))
+            if not mask.any():
+                continue
+            # Use world coordinates to seed the character choice
+            pattern_index = ((echo.x + self.echo_dx) * 100 + (echo.y + self.echo_dy) * 100 + time_random_shift) % len(self.echo_codes)
+            self.buffer[screen_y[mask], screen_x[mask]] = self.echo_codes[pattern_index[mask]]
+
     def draw_text_area(self):
-        for x in range(self.width):
-            self.draw_char(x, self.game_height, '-')
+        self.buffer[self.game_height] = ord('-')
         self.draw_char(0, self.game_height, '+')
         self.draw_char(self.width - 1, self.game_height, '+')
 
@@ -182,11 +334,9 @@ class Graphics:
         self.draw_text(1, self.game_height + 1, displayed_text)
 
     def draw_animated_background(self, t):
-        for y in range(self.height):
-            for x in range(self.width):
-                value = generate_perlin_noise(x, y, t)
-                char = get_wave_char(value)
-                self.draw_char(x, y, char)
+        # Same as get_wave_char for every cell, all at once
+        value = generate_perlin_noise_grid(self.background_x, self.background_y, t)
+        self.buffer[:] = np.where(value <= 0, ord('-'), ord('='))
 
     def draw_stats(self, samples_collected, total_samples, temperature, humidity, signal_strength):
         self.draw_text_area()
@@ -194,88 +344,103 @@ class Graphics:
         self.draw_text(1, self.game_height + 1, stats_text)
 
     def apply_distortions(self, signal_strength):
+        # The same few array operations every frame, however strong the distortion is
         distortion_intensity = min(1,max(0, 1 - (signal_strength**1.05 / 100)))
-        chars_set = self.corrupted_chars
+        chars_set = self.corrupted_codes
         if distortion_intensity > 0.66:
-            chars_set += self.cursed_chars
-        
+            chars_set = self.corrupted_and_cursed_codes
+        # The bottom row never gets distortions
+        rows = self.height - 1
+
         # Update existing distortions
-        for pos in list(self.distortion_map.keys()):
-            self.distortion_map[pos][1] -= 1
-            if self.distortion_map[pos][1] <= 0:
-                del self.distortion_map[pos]
-
-        # Generate new distortions
-        if random.random() < distortion_intensity * self.symbol_distortion_multiplier:
-            for _ in range(int(self.width * self.height * distortion_intensity * 0.1)):
-                x, y = random.randint(0, self.width - 1), random.randint(0, self.height - 2)
-                char = random.choice(chars_set)
-                self.distortion_map[(x, y)] = [char, self.distortion_duration]
+        np.subtract(self.distortion_ttl, 1, out=self.distortion_ttl, where=self.distortion_ttl > 0)
+
+        # Generate new distortions. Scattering count random positions hits each cell with this probability,
+        # so a random mask gives the same picture without a loop over the positions.
+        if self.random.random() < distortion_intensity * self.symbol_distortion_multiplier:
+            count = int(self.width * self.height * distortion_intensity * 0.1)
+            if count:
+                hit = self.rng.random((rows, self.width)) < -math.expm1(-count / (rows * self.width))
+                self.distortion_chars[:rows][hit] = chars_set[self.rng.integers(len(chars_set), size=np.count_nonzero(hit))]
+                self.distortion_ttl[:rows][hit] = self.distortion_duration
 
         # Update corrupted lines
-        self.corrupted_lines = {line for line in self.corrupted_lines if random.random() > 0.2}
-        if random.random() < distortion_intensity * self.line_distortion_multiplier:
-            new_corrupted_line = random.randint(0, self.height - 2)
-            self.corrupted_lines.add(new_corrupted_line)
+        self.corrupted_lines &= self.rng.random(self.height) > 0.2
+        if self.random.random() < distortion_intensity * self.line_distortion_multiplier:
+            self.corrupted_lines[self.random.randint(0, rows - 1)] = True
 
         # Update unseen area distortions
-        for pos in list(self.unseen_distortions.keys()):
-            self.unseen_distortions[pos][1] -= 1
-            if self.unseen_distortions[pos][1] <= 0:
-                del self.unseen_distortions[pos]
+        np.subtract(self.unseen_distortion_ttl, 1, out=self.unseen_distortion_ttl, where=self.unseen_distortion_ttl > 0)
 
         # Generate new unseen area distortions
-        if random.random() < distortion_intensity * self.symbol_distortion_multiplier:
-            x, y = random.randint(0, self.width - 1), random.randint(0, self.height - 2)
-            char = random.choice('▒▓█▄▀░')
-            self.unseen_distortions[(x, y)] = [char, self.distortion_duration]
+        if self.random.random() < distortion_intensity * self.symbol_distortion_multiplier:
+            x, y = self.random.randint(0, self.width - 1), self.random.randint(0, rows - 1)
+            self.unseen_distortion_grid[y, x] = self.random.choice(self.unseen_distortion_codes)
+            self.unseen_distortion_ttl[y, x] = self.distortion_duration
 
         return distortion_intensity
 
-    def add_ripple(self, x, y):
-        self.ripples.append((x, y, 0))  # (x, y, radius)
-
-    def update_ripples(self):
-        for i, (x, y, radius) in enumerate(self.ripples):
-            self.ripples[i] = (x, y, radius + 1)
-        self.ripples = [(x, y, r) for x, y, r in self.ripples if r < 100]  # Remove old ripples
-
-    def draw_ripples(self, player):
-        for x, y, radius in self.ripples:
-            for dx in range(-radius, radius + 1):
-                for dy in range(-radius, radius + 1):
-                    if dx*dx + dy*dy <= radius*radius and dx*dx + dy*dy > (radius-1)*(radius-1):
-                        x = x + dx
-                        y = y + dy
-                        screen_x = x - player.x + self.width // 2
-                        screen_y = y - player.y + self.height // 2
-                        self.draw_char(screen_x, screen_y, '~')
+    def get_ring_offsets(self, radius):
+        # Midpoint circle, the same cells for every ripple of this radius
+        offsets = self.ring_offsets.get(radius)
+        if offsets is None:
+            cells = set()
+            x, y = radius, 0
+            error = 1 - radius
+            while x >= y:
+                # One step on the first octant, mirrored onto the other seven
+                for dx, dy in ((x, y), (y, x)):
+                    cells.update(((dx, dy), (-dx, dy), (dx, -dy), (-dx, -dy)))
+                y += 1
+                if error < 0:
+                    error += 2 * y + 1
+                else:
+                    x -= 1
+                    error += 2 * (y - x) + 1
+            cells.discard((0, 0))  # A ripple of radius 0 isn't drawn
+            offsets = np.array(sorted(cells), dtype=np.intp).reshape(-1, 2).T
+            self.ring_offsets[radius] = offsets
+        return offsets
+
+    def draw_ripples(self, ripples, world, player, player_screen_x, player_screen_y):
+        # ripples are (x, y, radius) in world coordinates from before any World.move, so a ripple stays put
+        # while the world scrolls
+        if not ripples:
+            return
+        separator_y = self.game_height - 1
+        xs, ys = [], []
+        for x, y, radius in ripples:
+            center_x = x - world.offset_x - player.x + player_screen_x
+            center_y = y - world.offset_y - player.y + player_screen_y
+            if (center_x + radius < 0 or center_x - radius >= self.width or
+                    center_y + radius < 0 or center_y - radius >= separator_y):
+                continue
+            dx, dy = self.get_ring_offsets(radius)
+            xs.append(center_x + dx)
+            ys.append(center_y + dy)
+        if not xs:
+            return
+        # All rings in one write, clipped to the game view
+        xs, ys = np.concatenate(xs), np.concatenate(ys)
+        inside = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < separator_y)
+        self.buffer[ys[inside], xs[inside]] = ord('~')
 
     def load_ascii_video(self, file_path):
-        with open(file_path, 'r', encoding='utf-8') as f:
-            fps = int(f.readline().strip())
-            frame_width = int(f.readline().strip())
-            frame_height = int(f.readline().strip())
-            frames = [line.strip() for line in f.readlines()]
-        return fps, frame_width, frame_height, frames
-
-    def play_ascii_video(self, file_path):
+        if not is_ascii_video(file_path):
+            return load_legacy_ascii_video(file_path)
+        # Frames are decoded from the memory mapped file as they are played
+        video = AsciiVideo(file_path)
+        return video.fps, video.width, video.height, video
+
+    def open_ascii_video(self, file_path):
         fps, frame_width, frame_height, frames = self.load_ascii_video(file_path)
-        
+        return VideoPlayer(frames, fps, frame_width, frame_height)
+
+    def draw_video_frame(self, frame, frame_width, frame_height):
         start_x = max(0, (self.width - frame_width) // 2)
         start_y = max(0, (self.height - frame_height) // 2)
-        
-        for frame in frames:
-            self.clear()
-            for y in range(min(frame_height, self.height)):
-                for x in range(min(frame_width, self.width)):
-                    char_index = y * frame_width + x
-                    if char_index < len(frame):
-                        char = frame[char_index]
-                        self.draw_char(start_x + x, start_y + y, char)
-            self.render()
-            time.sleep(1 / fps)
-            
-            # Check for space key press to exit video playback
-            if keyboard.is_pressed('space'):
-                break
\ No newline at end of file
+        visible_width = min(frame_width, self.width - start_x)
+        for y in range(min(frame_height, self.height - start_y)):
+            # Whole rows at once instead of char by char
+            row = frame[y * frame_width:y * frame_width + visible_width]
+            self.draw_text(start_x, start_y + y, row)
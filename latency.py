@@ -0,0 +1,62 @@
+import bisect
+import sys
+import threading
+
+# Input to display/audio latency, as histograms per stage. Enabled with the --latency-report command line
+# flag, the report is printed on exit. Times are time.monotonic() seconds, like the input event times.
+ENABLED = "--latency-report" in sys.argv
+
+BUCKETS_MS = [1, 2, 4, 8, 16, 33, 50, 100, 200, 500, 1000]  # Upper bounds, one more bucket for anything slower
+STAGES = [
+    "input -> poll",  # Event read by the input thread until the game step picks it up
+    "input -> sim",  # Until the world actually moves, includes the movement step counters
+    "sim -> display",  # Drawing and writing the frame to stdout
+    "input -> display",
+    "sound -> mixer",  # play_sound() until the mixer starts the voice
+    "input -> audio",  # Key press until its footstep is started by the mixer
+]
+
+histograms = {}  # stage -> counts per bucket
+samples = {}  # stage -> all values in ms, for percentiles
+_lock = threading.Lock()  # The mixer thread records too
+
+def record(stage, seconds):
+    if not ENABLED:
+        return
+    ms = seconds * 1000
+    with _lock:
+        counts = histograms.setdefault(stage, [0] * (len(BUCKETS_MS) + 1))
+        counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        samples.setdefault(stage, []).append(ms)
+
+def get_stats():
+    stats = {}
+    with _lock:
+        for stage, values in samples.items():
+            values = sorted(values)
+            stats[stage] = {
+                "count": len(values),
+                "p50_ms": values[len(values) // 2],
+                "p95_ms": values[min(len(values) - 1, int(len(values) * 0.95))],
+                "max_ms": values[-1],
+                "histogram": list(histograms[stage]),
+            }
+    return stats
+
+def report(stream=None):
+    stream = stream or sys.stderr
+    stats = get_stats()
+    stream.write("Latency report\n")
+    for stage in STAGES + sorted(set(stats) - set(STAGES)):
+        if stage not in stats:
+            continue
+        stage_stats = stats[stage]
+        stream.write(f"  {stage:<18} n={stage_stats['count']:<6} p50 {stage_stats['p50_ms']:7.1f} ms"
+                     f"  p95 {stage_stats['p95_ms']:7.1f} ms  max {stage_stats['max_ms']:7.1f} ms\n")
+        widest = max(stage_stats["histogram"])
+        for i, count in enumerate(stage_stats["histogram"]):
+            if not count:
+                continue
+            label = f"<= {BUCKETS_MS[i]} ms" if i < len(BUCKETS_MS) else f"> {BUCKETS_MS[-1]} ms"
+            stream.write(f"    {label:>10} {count:6} {'#' * max(1, count * 40 // widest)}\n")
+    stream.flush()
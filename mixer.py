@@ -0,0 +1,119 @@
+import threading
+import time
+import numpy as np
+import pygame
+from voices import VoiceManager
+
+class Mixer:
+    def __init__(self, channel, sample_rate, block_size=2048, seed=None, voice_settings=None):
+        self.channel = channel
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.rng = np.random.default_rng(seed)
+        # Pending requests are picked up when the queued block starts playing, and the worker looks for that
+        # every quarter block, so an idle mixer can take 1.25 blocks to get to a request
+        self.voice_manager = VoiceManager(voice_settings, pickup_time=1.25 * block_size / sample_rate + 0.02)
+        self.music = None
+        self.distortion_intensity = 0.0
+        self.hum_phase = 0.0
+        # Low-pass filters for a few intensity levels, switched per block with the state carried over
+        self.lowpass_levels = 4
+        self.lowpass_filters = None
+        self.lfilter = None
+        self.lowpass_state = np.zeros((2, 2))
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._mixer_worker, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        self.channel.stop()
+
+    def play(self, name, samples, left=1.0, right=1.0, input_time=None):
+        # samples are float32 stereo, the voice manager decides if and when it actually plays
+        return self.voice_manager.request(name, samples, left, right, input_time)
+
+    def set_music(self, music):
+        self.music = music
+
+    def set_signal_strength(self, signal_strength):
+        self.distortion_intensity = min(1, max(0, 1 - (signal_strength**1.05 / 100)))
+
+    def mix_block(self):
+        n = self.block_size
+        out = np.zeros((n, 2), dtype=np.float32)
+
+        for voice in self.voice_manager.start_pending():
+            chunk = voice.samples[voice.position:voice.position + n]
+            out[:len(chunk), 0] += chunk[:, 0] * voice.left
+            out[:len(chunk), 1] += chunk[:, 1] * voice.right
+            voice.position += n
+        self.voice_manager.remove_finished()
+
+        if self.music:
+            out += self.music.render(n)[:, np.newaxis]
+
+        return self.apply_effects(out)
+
+    def design_lowpass_filters(self):
+        import scipy.signal  # Slow to import, so it's done on the mixer thread
+        self.lfilter = scipy.signal.lfilter
+        self.lowpass_filters = []
+        for level in range(1, self.lowpass_levels + 1):
+            cutoff_freq = 8000 - 6500 * level / self.lowpass_levels
+            self.lowpass_filters.append(scipy.signal.butter(2, cutoff_freq / (self.sample_rate / 2), btype='low', analog=False))
+
+    def apply_effects(self, out):
+        if self.lowpass_filters is None:
+            self.design_lowpass_filters()
+        intensity = self.distortion_intensity
+        if intensity <= 0:
+            self.lowpass_state[:] = 0
+            return out
+        n = len(out)
+
+        # Radio interference: noise, crackle and mains hum, getting louder as the signal drops
+        noise = self.rng.uniform(-1, 1, n)
+        crackle = self.rng.choice([-1, 0, 1], size=n, p=[0.05 * intensity, 1 - 0.1 * intensity, 0.05 * intensity])
+        hum_step = 2 * np.pi * 50 / self.sample_rate
+        hum = np.sin(self.hum_phase + hum_step * np.arange(n))
+        self.hum_phase = (self.hum_phase + hum_step * n) % (2 * np.pi)
+        interference = (noise * 0.3 + crackle * 0.5 + hum * 0.2) * 0.15 * intensity**2
+        out += interference[:, np.newaxis].astype(np.float32)
+
+        # Soft clipping, scaled back so quiet parts keep their level
+        drive = 1 + 3 * intensity
+        out = np.tanh(out * drive) / drive
+
+        # Muffle the whole mix on a weak signal
+        level = min(self.lowpass_levels, int(intensity * (self.lowpass_levels + 1)))
+        if level > 0:
+            b, a = self.lowpass_filters[level - 1]
+            out, self.lowpass_state = self.lfilter(b, a, out, axis=0, zi=self.lowpass_state)
+        else:
+            self.lowpass_state[:] = 0
+        return out
+
+    def _mixer_worker(self):
+        block_time = self.block_size / self.sample_rate
+        self.design_lowpass_filters()
+        while self.running:
+            # Only ever one block playing and one queued, so effects follow the signal with a block of latency
+            if self.channel.get_busy() and self.channel.get_queue() is not None:
+                time.sleep(block_time / 4)
+                continue
+            pcm = (np.clip(self.mix_block(), -1, 1) * 32767).astype(np.int16)
+            sound = pygame.sndarray.make_sound(pcm)
+            if not self.channel.get_busy():
+                self.channel.play(sound)
+            else:
+                self.channel.queue(sound)
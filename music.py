@@ -0,0 +1,102 @@
+import random
+import numpy as np
+
+class AmbientHorrorMusic:
+    def __init__(self, sample_rate, seed=None):
+        self.sample_rate = sample_rate
+        self.random = random.Random(seed)
+        self.rng = np.random.default_rng(seed)
+        self.base_freq = 77.78
+        self.harmonics = np.array([1, 1.5, 2, 2.5, 3])
+        self.low_notes = [77.78, 87.31, 103.83, 116.54, 138.59]  # D2, F2, G#2, A#2, C3
+        self.high_notes = [77.78, 87.31, 103.83, 116.54, 138.59]  # D2, F2, G#2, A#2, C3
+        self.note_duration = 4.0
+        # Low-pass filter for the noise bed, designed on the first block and its state carried from block to block
+        self.cutoff_freq = 1320
+        self.filter_b = self.filter_a = self.filter_state = self.lfilter = None
+        # Oscillator phases, so parameters can change between blocks without clicks
+        self.harmonic_phases = np.zeros(len(self.harmonics))
+        self.low_phase = 0.0
+        self.high_phase = 0.0
+        self.note_samples_left = 0
+        self.low_samples_left = 0
+        self.high_samples_left = 0
+        self.low_note = self.high_note = self.base_freq
+        self.intensity = 0.0
+        self.target_intensity = 0.0
+
+    def set_signal_strength(self, signal_strength):
+        self.target_intensity = min(1, max(0, 1 - signal_strength / 100))
+
+    def next_notes(self):
+        low_note = self.random.choice(self.low_notes)
+        high_note = self.random.choice(self.high_notes)
+        # Check if notes are equal or adjacent in the list
+        if low_note == high_note or abs(self.low_notes.index(low_note) - self.high_notes.index(high_note)) <= 1:
+            # If so, choose only one note
+            low_note = high_note = self.random.choice([low_note, high_note])
+        # Introduce very small detuning for both notes
+        self.low_note = low_note * self.random.uniform(0.95, 1.05)  # ±5% detuning
+        self.high_note = high_note * self.random.uniform(0.95, 1.05)  # ±5% detuning
+        tempo_low = self.random.choice([1, 0.5])  # 1/1 or 1/2 tempo for low notes
+        tempo_high = self.random.choice([1, 0.5, 0.25])  # 1/1 or 1/2 or 1/4 tempo for high notes
+        self.note_samples_left = int(self.sample_rate * self.note_duration)
+        self.low_samples_left = int(self.sample_rate * self.note_duration * tempo_low)
+        self.high_samples_left = int(self.sample_rate * self.note_duration * tempo_high)
+        self.low_phase = self.high_phase = 0.0
+
+    def oscillator(self, freq, phase, count):
+        step = 2 * np.pi * freq / self.sample_rate
+        phases = phase + step * np.arange(count)
+        return np.sin(phases), (phase + step * count) % (2 * np.pi)
+
+    def render_melody(self, count):
+        melody = np.zeros(count)
+        pos = 0
+        while pos < count:
+            if self.note_samples_left <= 0:
+                self.next_notes()
+            n = min(count - pos, self.note_samples_left)
+            low_n = min(n, self.low_samples_left)
+            if low_n > 0:
+                wave, self.low_phase = self.oscillator(self.low_note, self.low_phase, low_n)
+                melody[pos:pos + low_n] += wave
+            high_n = min(n, self.high_samples_left)
+            if high_n > 0:
+                wave, self.high_phase = self.oscillator(self.high_note, self.high_phase, high_n)
+                melody[pos:pos + high_n] += wave
+            self.note_samples_left -= n
+            self.low_samples_left -= n
+            self.high_samples_left -= n
+            pos += n
+        return melody / 2
+
+    def design_filter(self):
+        import scipy.signal  # Slow to import, this runs on the mixer thread
+        self.lfilter = scipy.signal.lfilter
+        self.filter_b, self.filter_a = scipy.signal.butter(6, self.cutoff_freq / (self.sample_rate / 2), btype='low', analog=False)
+        self.filter_state = np.zeros(max(len(self.filter_a), len(self.filter_b)) - 1)
+
+    def render(self, count):
+        if self.filter_b is None:
+            self.design_filter()
+        # Glide towards the current signal strength over one block instead of jumping
+        intensity = np.linspace(self.intensity, self.target_intensity, count)
+        self.intensity = self.target_intensity
+
+        # Harmonics sag in pitch as the signal gets worse
+        pitch = 1 - 0.03 * self.intensity
+        combined = np.zeros(count)
+        for i, harmonic in enumerate(self.harmonics):
+            wave, self.harmonic_phases[i] = self.oscillator(self.base_freq * harmonic * pitch, self.harmonic_phases[i], count)
+            combined += wave
+        combined /= len(self.harmonics)
+
+        noise = self.rng.uniform(-1, 1, count) * 0.1
+        filtered_noise, self.filter_state = self.lfilter(self.filter_b, self.filter_a, noise, zi=self.filter_state)
+        noise = noise * 0.1 + filtered_noise * 0.9
+
+        melody = self.render_melody(count)
+        # Noise takes over from the melody when the signal drops
+        mono = (combined * 0.3 + noise * (0.3 + 0.9 * intensity) + melody * 0.4 * (1 - 0.5 * intensity)) * 0.5
+        return np.clip(mono, -1, 1)
@@ -0,0 +1,57 @@
+import threading
+from player import Player
+from world import World
+
+class NextRunBuilder:
+    # Builds the world for the next run on a background thread while the menu or an end screen is up,
+    # so restarting only has to take the finished world instead of generating one.
+    def __init__(self, width=256, height=256):
+        self.width = width
+        self.height = height
+        self.lock = threading.Lock()
+        self.thread = None
+        self.world = None
+        self.generation = 0  # Bumped on take/discard, a build from an older generation is thrown away
+
+    def start(self):
+        with self.lock:
+            if self.thread or self.world:
+                return
+            self.thread = threading.Thread(target=self._build, args=(self.generation,), daemon=True)
+            self.thread.start()
+
+    def _build(self, generation):
+        world = None
+        try:
+            # Player starts in the center of the world
+            world = World(self.width, self.height, Player(self.width // 2, self.height // 2))
+        finally:
+            with self.lock:
+                if generation == self.generation:
+                    self.world = world
+                    self.thread = None
+
+    def is_ready(self):
+        # Also true once a failed build is over, take() then returns None and the game builds its own world
+        with self.lock:
+            return self.world is not None or self.thread is None
+
+    def take(self):
+        # Hands the finished world over exactly once. Waits for a build that is still running,
+        # returns None if it failed.
+        self.start()
+        thread = self.thread
+        if thread:
+            thread.join()
+        with self.lock:
+            world, self.world = self.world, None
+            self.generation += 1
+            self.thread = None
+        return world
+
+    def discard(self):
+        # The player quit, whatever is being built is never used
+        with self.lock:
+            self.world = None
+            self.generation += 1
+            self.thread = None
@@ -0,0 +1,232 @@
+import atexit
+import os
+import struct
+import sys
+import time
+
+class OutputBackend:
+    # Where Graphics sends its frames. A frame is begin_frame(), the changed rows, end_frame().
+    def __init__(self):
+        self.frames_written = 0
+        self.frames_coalesced = 0
+        self.bytes_written = 0
+
+    def begin_frame(self):
+        # False means skip this frame, the rows it would have changed go out with the next one
+        return True
+
+    def write_row(self, y, text):
+        self.bytes_written += len(text)  # Goes nowhere
+
+    def end_frame(self, height):
+        self.frames_written += 1
+
+    def get_size(self):
+        # (columns, rows) of the screen, None if there is no screen to follow
+        return None
+
+    def clear_screen(self):
+        pass
+
+    def close(self):
+        pass
+
+    def get_stats(self):
+        return {
+            "frames_written": self.frames_written,
+            "frames_coalesced": self.frames_coalesced,
+            "bytes_written": self.bytes_written,
+        }
+
+class AnsiOutput(OutputBackend):
+    # Raw ANSI escapes, the whole frame in a single write and flush.
+    # adaptive skips frames while the terminal is still busy with earlier ones, e.g. over SSH, so they don't
+    # pile up in the pty buffer and the display stays current. max_rate caps the bytes per second by hand.
+    def __init__(self, stream=None, adaptive=False, max_rate=None, min_interval=1 / 60, headroom=0.8):
+        super().__init__()
+        self.stream = stream or sys.stdout
+        self.adaptive = adaptive
+        self.max_rate = max_rate
+        self.min_interval = min_interval
+        self.headroom = headroom  # Use this much of the estimated rate so a backlog can drain
+        self.rate = max_rate  # Estimated bytes per second the terminal drains, None until measured
+        self.next_frame_time = 0
+        self.last_frame_size = 0
+        self.saturated_since = None  # End of the last write that had to wait, the buffers were full then
+        self.measured_rate = None
+        self.bytes_since_saturated = 0
+        self.parts = []
+
+    def begin_frame(self):
+        if self.adaptive or self.max_rate:
+            if time.monotonic() < self.next_frame_time or (self.adaptive and self.is_backed_up()):
+                self.frames_coalesced += 1
+                return False
+        self.parts = ["\033[H"]  # Move cursor to top-left corner
+        return True
+
+    def get_size(self):
+        try:
+            return tuple(os.get_terminal_size(self.stream.fileno()))
+        except (AttributeError, OSError, ValueError):
+            return None
+
+    def clear_screen(self):
+        self.stream.write("\033[2J")
+        self.stream.flush()
+
+    def queued_bytes(self):
+        # Bytes written to the terminal that the other side (sshd, the terminal emulator) hasn't taken yet,
+        # None if the OS can't tell, e.g. not a tty
+        try:
+            import fcntl
+            import termios
+            return struct.unpack('i', fcntl.ioctl(self.stream.fileno(), termios.TIOCOUTQ, b'\0' * 4))[0]
+        except (ImportError, AttributeError, OSError, ValueError):
+            return None
+
+    def is_backed_up(self):
+        # More than the last frame still waiting means the next one would only add lag
+        queued = self.queued_bytes()
+        return queued is not None and queued > self.last_frame_size
+
+    def write_row(self, y, text):
+        # Move cursor to the beginning of the line, then the entire row
+        self.parts.append(f"\033[{y + 1};1H{text}")
+
+    def end_frame(self, height):
+        # Move cursor to the bottom of the screen
+        self.parts.append(f"\033[{height + 1};1H")
+        data = ''.join(self.parts)
+        self.parts = []
+        start = time.monotonic()
+        self.stream.write(data)
+        self.stream.flush()
+        now = time.monotonic()
+        size = len(data.encode('utf-8'))
+        self.last_frame_size = size
+        self.bytes_written += size
+        self.frames_written += 1
+        if self.adaptive:
+            self.update_rate(size, now - start, now)
+        if self.rate:
+            # Leave the terminal time to take this frame before sending the next one
+            rate = self.rate * self.headroom if self.adaptive else self.rate
+            self.next_frame_time = now + max(self.min_interval, size / rate)
+
+    def update_rate(self, size, elapsed, now):
+        # A write only has to wait once the buffers between us and the screen are full. From one write that
+        # waited to the next the link was busy (if it was idle in between the result is too low, which is
+        # the safe side), so what was written in between is what it carried. Writes that don't wait let the
+        # estimate creep up to a little over the measured rate, which itself slowly creeps up, so a link
+        # that got faster is used again.
+        self.bytes_since_saturated += size
+        if elapsed > 0.002:
+            if self.saturated_since is not None:
+                self.measured_rate = self.bytes_since_saturated / (now - self.saturated_since)
+                self.rate = self.measured_rate
+            self.saturated_since = now
+            self.bytes_since_saturated = 0
+        elif self.rate is not None:
+            self.rate *= 1.1
+            if self.measured_rate:
+                self.measured_rate *= 1.002
+                self.rate = min(self.rate, self.measured_rate * 1.2)
+        if self.max_rate:
+            self.rate = min(self.rate or self.max_rate, self.max_rate)
+
+    def get_stats(self):
+        stats = super().get_stats()
+        stats["rate"] = self.rate
+        return stats
+
+class FileOutput(AnsiOutput):
+    # The same ANSI stream into a file or pipe, e.g. to record a session or feed another program
+    def __init__(self, path, **kwargs):
+        self.file = open(path, 'w', encoding='utf-8')
+        super().__init__(self.file, **kwargs)
+
+    def get_size(self):
+        return None  # Even if the file is a terminal, it isn't the one the game was started from
+
+    def close(self):
+        self.file.close()
+
+class NullOutput(OutputBackend):
+    # Writes nothing, keeps the current screen in memory. For headless runs and benchmarks.
+    def __init__(self):
+        super().__init__()
+        self.rows = {}
+
+    def write_row(self, y, text):
+        self.rows[y] = text
+        self.bytes_written += len(text)
+
+    def get_screen(self, height):
+        return [self.rows.get(y, '') for y in range(height)]
+
+class CursesOutput(OutputBackend):
+    # curses keeps its own copy of the screen and only sends what changed
+    def __init__(self):
+        super().__init__()
+        import curses
+        import locale
+        locale.setlocale(locale.LC_ALL, '')  # Needed for the non-ASCII characters
+        self.curses = curses
+        self.screen = curses.initscr()
+        curses.noecho()
+        curses.curs_set(0)
+        atexit.register(self.close)  # Always give the terminal back
+
+    def write_row(self, y, text):
+        height, width = self.screen.getmaxyx()
+        if y >= height:
+            return
+        try:
+            self.screen.addstr(y, 0, text[:width])
+        except self.curses.error:
+            pass  # Writing the bottom-right cell moves the cursor off screen, the text is drawn anyway
+        self.bytes_written += len(text)
+
+    def end_frame(self, height):
+        self.screen.refresh()
+        self.frames_written += 1
+
+    def get_size(self):
+        # curses only notices a resize while reading keys, which it never does here
+        try:
+            columns, rows = os.get_terminal_size(sys.__stdout__.fileno())
+            if self.curses.is_term_resized(rows, columns):
+                self.curses.resizeterm(rows, columns)
+        except OSError:
+            pass
+        rows, columns = self.screen.getmaxyx()
+        return columns, rows
+
+    def clear_screen(self):
+        self.screen.clear()
+
+    def close(self):
+        if not self.curses.isendwin():
+            self.curses.endwin()
+
+def create_output(backend=None, adaptive=False, max_rate=None, spectate=()):
+    # "ansi" (default), "curses", "null" or "file:PATH". spectate are addresses to broadcast the game on,
+    # see broadcast.py
+    backend = backend or "ansi"
+    if backend == "ansi":
+        output = AnsiOutput(adaptive=adaptive, max_rate=max_rate)
+    elif backend == "curses":
+        output = CursesOutput()
+    elif backend == "null":
+        output = NullOutput()
+    elif backend.startswith("file:"):
+        output = FileOutput(backend[len("file:"):], adaptive=adaptive, max_rate=max_rate)
+    else:
+        raise ValueError(f"Unknown output backend {backend}")
+    if spectate:
+        from broadcast import BroadcastOutput, listen
+        output = BroadcastOutput(output)
+        for address in spectate:
+            listen(output.broadcast, address)
+    return output
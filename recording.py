@@ -0,0 +1,191 @@
+import argparse
+import hashlib
+import struct
+import sys
+import time
+import zlib
+import savegame
+from controls import InputSystem, KeyEvent
+
+# Input recordings, for replaying a session exactly, e.g. to compare builds on the same long workload. A Game
+# takes everything random from its seed and time from its simulation clock, so the same inputs on the same
+# ticks play the same game. A recording is the game as it was when recording started (a save, see
+# savegame.py) and then every input event with its tick:
+#
+#   "AHRC" version:u16 tick_rate:u16 seed:u64 save_length:u32, the save, then zlib compressed records
+#
+# The records are flushed about once a second, a recording cut short by a crash replays up to there.
+#
+#   python game.py --record run.rec
+#   python recording.py run.rec                  # Replays headless, times every tick and frame
+#   python recording.py run.rec --digests a.txt  # Also one hash per frame, to compare the frames of two builds
+
+MAGIC = b"AHRC"
+VERSION = 1
+HEADER = struct.Struct("<4sHHQI")
+KEY_RECORD, EVENT_RECORD, END_RECORD = 0, 1, 2
+KEY = struct.Struct("<BB")  # Record type, name length, the name follows. Keys are numbered in order of appearance.
+EVENT = struct.Struct("<BIHB")  # Record type, tick since recording started, key number, flags
+END = struct.Struct("<BI")  # Record type, ticks recorded
+DOWN, REPEAT = 1, 2
+
+class InputRecorder:
+    # Game.step hands it the events of every tick
+    def __init__(self, path, game):
+        self.file = open(path, "wb")
+        self.tick_rate = game.tick_rate
+        self.start_tick = game.ticks
+        self.ticks = 0
+        self.keys = {}  # name -> number
+        self.compressor = zlib.compressobj()
+        self.flushed_tick = 0
+        save = savegame.save_game(game)
+        self.file.write(HEADER.pack(MAGIC, VERSION, game.tick_rate, game.seed, len(save)) + save)
+
+    def record(self, tick, events):
+        self.ticks = tick - self.start_tick
+        if events:
+            parts = []
+            for event in events:
+                key = self.keys.get(event.key)
+                if key is None:
+                    key = self.keys[event.key] = len(self.keys)
+                    name = event.key.encode("utf-8")
+                    parts += [KEY.pack(KEY_RECORD, len(name)), name]
+                parts.append(EVENT.pack(EVENT_RECORD, self.ticks, key, DOWN * event.down | REPEAT * event.repeat))
+            self.file.write(self.compressor.compress(b"".join(parts)))
+        if self.ticks - self.flushed_tick >= self.tick_rate:
+            self.file.write(self.compressor.flush(zlib.Z_SYNC_FLUSH))
+            self.file.flush()
+            self.flushed_tick = self.ticks
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.write(self.compressor.compress(END.pack(END_RECORD, self.ticks)) + self.compressor.flush())
+        self.file.close()
+
+class Recording:
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            data = file.read()
+        if len(data) < HEADER.size:
+            raise savegame.SaveError("Not a recording")
+        magic, version, self.tick_rate, self.seed, save_length = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise savegame.SaveError("Not a recording")
+        if version > VERSION:
+            raise savegame.SaveError(f"Recorded by a newer version ({version})")
+        self.save = data[HEADER.size:HEADER.size + save_length]
+        self.events = {}  # tick -> [(key, down, repeat)]
+        self.ticks = 0
+        self.complete = False
+        # A cut short stream decompresses as far as it got
+        self.read_records(zlib.decompressobj().decompress(data[HEADER.size + save_length:]))
+
+    def read_records(self, records):
+        keys = []
+        offset = 0
+        while offset < len(records):
+            kind = records[offset]
+            if kind == KEY_RECORD and offset + KEY.size <= len(records):
+                _, length = KEY.unpack_from(records, offset)
+                offset += KEY.size
+                keys.append(records[offset:offset + length].decode("utf-8"))
+                offset += length
+            elif kind == EVENT_RECORD and offset + EVENT.size <= len(records):
+                _, tick, key, flags = EVENT.unpack_from(records, offset)
+                offset += EVENT.size
+                self.events.setdefault(tick, []).append((keys[key], bool(flags & DOWN), bool(flags & REPEAT)))
+                self.ticks = max(self.ticks, tick)
+            elif kind == END_RECORD and offset + END.size <= len(records):
+                _, self.ticks = END.unpack_from(records, offset)
+                self.complete = True
+                break
+            else:
+                break  # Cut short
+
+class ReplayInput(InputSystem):
+    # Hands the game the recorded events, each on the tick it was recorded on
+    def __init__(self, events):
+        super().__init__()
+        self.recorded = events
+        self.tick = 0
+
+    def poll(self):
+        self.tick += 1
+        for key, down, repeat in self.recorded.get(self.tick, ()):
+            self.events.append(KeyEvent(key, down, repeat, time.monotonic()))
+        return super().poll()
+
+def run_headless(game, ticks, digests=None):
+    # Steps and draws the game on every tick as fast as it goes, its clock doesn't depend on how fast that is.
+    # Returns the seconds every tick and frame took, digests gets a hash of every frame.
+    tick_times = []
+    frame_times = []
+    game.start()
+    for _ in range(ticks):
+        start = time.perf_counter()
+        restart = game.step()
+        tick_times.append(time.perf_counter() - start)
+        snapshot = game.snapshots.take(timeout=0)
+        start = time.perf_counter()
+        game.render(snapshot)
+        frame_times.append(time.perf_counter() - start)
+        if digests is not None:
+            digests.append(hashlib.blake2b(game.graphics.buffer.tobytes(), digest_size=8).hexdigest())
+        if restart or not game.running:
+            break
+    return tick_times, frame_times
+
+def load_replay(recording):
+    # The recorded game as it was when recording started, with the recorded inputs to come
+    from output import NullOutput
+    from silent_sounds import SilentSoundSystem
+    width, height = savegame.get_screen_size(recording.save) or (None, None)  # As in savegame.replay
+    return savegame.load_game(recording.save, keep_clock=True, width=width, height=height,
+                              sound_system=SilentSoundSystem(), input_system=ReplayInput(recording.events),
+                              output=NullOutput())
+
+def describe(times):
+    times = sorted(seconds * 1000 for seconds in times)
+    if not times:
+        return "none"
+    return (f"p50 {times[len(times) // 2]:.2f} ms  p95 {times[min(len(times) - 1, int(len(times) * 0.95))]:.2f} ms"
+            f"  p99 {times[min(len(times) - 1, int(len(times) * 0.99))]:.2f} ms  max {times[-1]:.2f} ms"
+            f"  total {sum(times) / 1000:.2f} s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay an input recording headless and time every tick and frame")
+    parser.add_argument("recording")
+    parser.add_argument("--timings", metavar="CSV", help="Write tick,tick_ms,frame_ms for every tick")
+    parser.add_argument("--digests", metavar="PATH", help="Write a hash of every frame, one per line")
+    args = parser.parse_args()
+    try:
+        recording = Recording(args.recording)
+        game = load_replay(recording)
+    except (OSError, struct.error, zlib.error, savegame.SaveError) as error:
+        sys.exit(f"{args.recording}: {error}")
+    digests = []
+    start = time.perf_counter()
+    tick_times, frame_times = run_headless(game, recording.ticks, digests)
+    elapsed = time.perf_counter() - start
+    played = len(tick_times) / recording.tick_rate
+    print(f"{args.recording}: {len(tick_times)} ticks ({played / 60:.1f} min of play"
+          f"{'' if recording.complete else ', cut short'}) replayed in {elapsed:.1f} s, "
+          f"{played / max(elapsed, 1e-9):.1f}x real time")
+    print(f"  tick   {describe(tick_times)}")
+    print(f"  frame  {describe(frame_times)}")
+    # The same for two builds means they drew exactly the same frames
+    print(f"  frames digest {hashlib.blake2b(''.join(digests).encode(), digest_size=16).hexdigest()}")
+    if args.timings:
+        with open(args.timings, "w") as file:
+            file.write("tick,tick_ms,frame_ms\n")
+            for tick, (tick_time, frame_time) in enumerate(zip(tick_times, frame_times), 1):
+                file.write(f"{tick},{tick_time * 1000:.3f},{frame_time * 1000:.3f}\n")
+    if args.digests:
+        with open(args.digests, "w") as file:
+            file.write("\n".join(digests) + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+import argparse
+import math
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+import numpy as np
+from graphics import resize_array
+from player import Player
+from world import World, EchoSource
+
+# Saved games: the Game, its World with the echo sources, and the Graphics effects on screen, in a compact
+# versioned binary format. A save is a header and tagged sections:
+#
+#   "AHSV" version:u16 sections:u16, then per section tag:4 bytes length:u32 payload
+#
+# Numbers are packed records, the terrain and the screen effects are zlib compressed arrays. Times are stored
+# as how long ago (in simulation time) they were, a resumed game picks up as if no time had passed. The
+# random generators and the simulation clock are saved too, so a loaded game that keeps its clock plays on
+# exactly like the saved one would have, see recording.py. Loaders skip sections they don't know, a section
+# whose layout changes gets a new tag.
+#
+#   python game.py --save run.sav              # Esc saves the run, the next start resumes it
+#   python game.py --slow-frames slow/         # Saves the game whenever a tick or frame is slow
+#   python savegame.py slow/*.sav              # Replays those saves headless and times every tick and frame
+
+MAGIC = b"AHSV"
+VERSION = 1
+HEADER = struct.Struct("<4sHH")
+SECTION = struct.Struct("<4sI")
+
+GAME = struct.Struct("<HHdhdbbHIBIiIIHB5d")
+GAME_FLAGS = ["text_display_active", "text_fully_displayed", "game_over", "game_won", "show_intro",
+              "restart_requested"]
+WORLD = struct.Struct("<HHiihhI")
+RANDOM = struct.Struct("<Bd")  # Mersenne Twister version and gauss_next, the 625 words of its state follow
+PCG64 = struct.Struct("<16s16sBI")  # numpy's default bit generator: state, increment, has_uint32, uinteger
+SIMULATION = struct.Struct("<QddQ")  # Ticks, clock start, time, seed
+ITEM = struct.Struct("<hhI")  # Position before any World.move, character code
+TRIGGER = struct.Struct("<hh")  # Position, the text follows
+ECHO = struct.Struct("<hhBihhddH")  # The path (in positions before any move) follows
+POINT = struct.Struct("<hh")
+RIPPLE = struct.Struct("<hhH")
+SCREEN = struct.Struct("<HH")
+COUNT = struct.Struct("<I")
+SECONDS = struct.Struct("<d")
+
+class SaveError(Exception):
+    pass
+
+# What decoding a damaged or cut short save raises, turned into a SaveError
+DAMAGED = (struct.error, zlib.error, ValueError, IndexError, OverflowError)
+
+class Reader:
+    # Reads a section front to back
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def unpack(self, record):
+        values = record.unpack_from(self.data, self.offset)
+        self.offset += record.size
+        return values
+
+    def records(self, record):
+        count, = self.unpack(COUNT)
+        return [self.unpack(record) for _ in range(count)]
+
+    def bytes(self, size):
+        data = self.data[self.offset:self.offset + size]
+        self.offset += size
+        return data
+
+    def text(self):
+        size, = self.unpack(COUNT)
+        return bytes(self.bytes(size)).decode("utf-8")
+
+def pack_text(text):
+    data = text.encode("utf-8")
+    return COUNT.pack(len(data)) + data
+
+def pack_records(record, rows):
+    return COUNT.pack(len(rows)) + b"".join(record.pack(*row) for row in rows)
+
+def age(now, moment):
+    # Seconds since a time.time() moment, NaN for None
+    return math.nan if moment is None else now - moment
+
+def moment(now, seconds):
+    return None if math.isnan(seconds) else now - seconds
+
+def pack_random(generator):
+    version, state, gauss_next = generator.getstate()
+    return RANDOM.pack(version, math.nan if gauss_next is None else gauss_next) + np.array(state, dtype="<u4").tobytes()
+
+def unpack_random(generator, reader):
+    version, gauss_next = reader.unpack(RANDOM)
+    state = tuple(np.frombuffer(reader.bytes(625 * 4), dtype="<u4").tolist())
+    generator.setstate((version, state, None if math.isnan(gauss_next) else gauss_next))
+
+def pack_rng(rng):
+    state = rng.bit_generator.state
+    return PCG64.pack(state["state"]["state"].to_bytes(16, "little"), state["state"]["inc"].to_bytes(16, "little"),
+                      state["has_uint32"], state["uinteger"])
+
+def unpack_rng(rng, reader):
+    state, inc, has_uint32, uinteger = reader.unpack(PCG64)
+    rng.bit_generator.state = {
+        "bit_generator": "PCG64",
+        "state": {"state": int.from_bytes(state, "little"), "inc": int.from_bytes(inc, "little")},
+        "has_uint32": has_uint32,
+        "uinteger": uinteger,
+    }
+
+def pack_simulation(game):
+    return b"".join([SIMULATION.pack(game.ticks, game.clock_start, game.time, game.seed), pack_random(game.random),
+                     pack_random(game.graphics.random), pack_rng(game.graphics.rng)])
+
+def unpack_simulation(game, reader, keep_clock):
+    ticks, clock_start, _, game.seed = reader.unpack(SIMULATION)
+    game.ticks = ticks
+    if keep_clock:
+        game.clock_start = clock_start
+    unpack_random(game.random, reader)
+    unpack_random(game.graphics.random, reader)
+    unpack_rng(game.graphics.rng, reader)
+
+def pack_game(game, now):
+    flags = sum(1 << i for i, name in enumerate(GAME_FLAGS) if getattr(game, name))
+    parts = [GAME.pack(
+        game.samples_collected, game.total_samples, game.temperature, game.humidity, game.signal_strength,
+        game.temp_direction, game.humidity_direction, game.update_counter, game.movement_step,
+        game.vertical_step, game.step_counter, game.echo_cooldown, game.text_index, game.message_index,
+        game.visibility_radius, flags,
+        age(now, game.start_time), age(now, game.last_scary_text_time), age(now, game.message_start_time),
+        age(now, game.low_signal_start_time), age(now, game.last_type_time),
+    )]
+    parts += [pack_text(game.current_text), pack_text(game.current_message), pack_text(game.message_type or "")]
+    parts.append(COUNT.pack(len(game.text_queue)))
+    parts += [pack_text(text) for text in game.text_queue]
+    parts.append(COUNT.pack(len(game.last_system_message_time)))
+    for name, sent in game.last_system_message_time.items():
+        parts += [pack_text(name), SECONDS.pack(age(now, sent))]
+    parts.append(pack_records(RIPPLE, game.ripples))
+    return b"".join(parts)
+
+def unpack_game(game, data, now):
+    reader = Reader(data)
+    (game.samples_collected, game.total_samples, game.temperature, game.humidity, game.signal_strength,
+     game.temp_direction, game.humidity_direction, game.update_counter, game.movement_step,
+     game.vertical_step, game.step_counter, game.echo_cooldown, game.text_index, game.message_index,
+     game.visibility_radius, flags,
+     start, last_scary_text, message_start, low_signal_start, last_type) = reader.unpack(GAME)
+    for i, name in enumerate(GAME_FLAGS):
+        setattr(game, name, bool(flags >> i & 1))
+    game.start_time = moment(now, start)
+    game.last_scary_text_time = moment(now, last_scary_text)
+    game.message_start_time = moment(now, message_start)
+    game.low_signal_start_time = moment(now, low_signal_start)
+    game.last_type_time = moment(now, last_type)
+    game.last_update_time = now
+    game.current_text = reader.text()
+    game.current_message = reader.text()
+    game.message_type = reader.text() or None
+    game.text_queue = [reader.text() for _ in range(reader.unpack(COUNT)[0])]
+    game.last_system_message_time = {}
+    for _ in range(reader.unpack(COUNT)[0]):
+        name = reader.text()
+        game.last_system_message_time[name] = moment(now, reader.unpack(SECONDS)[0])
+    game.ripples = reader.records(RIPPLE)
+    game.sound_system.update_signal_strength(game.signal_strength)
+
+def pack_world(world, now):
+    # Positions are stored as they were before any move, so they don't depend on the offset
+    ox, oy = world.offset_x, world.offset_y
+    used = sum(1 << i for i, text in enumerate(world.scary_texts) if text in world.used_scary_texts)
+    parts = [
+        WORLD.pack(world.width, world.height, ox, oy, world.player.x, world.player.y, used),
+        pack_random(world.random),
+        pack_records(ITEM, [(x + ox, y + oy, ord(item)) for (x, y), item in world.items.items()]),
+        COUNT.pack(len(world.text_triggers)),
+    ]
+    for (x, y), text in world.text_triggers.items():
+        parts += [TRIGGER.pack(x + ox, y + oy), pack_text(text)]
+    parts.append(COUNT.pack(len(world.echo_sources)))
+    for source in world.echo_sources:
+        parts.append(ECHO.pack(source.x + ox, source.y + oy, source.speed, source.path_update_cooldown,
+                               *source.last_known_player_pos, age(now, source.last_move_time),
+                               source.move_cooldown, len(source.path)))
+        parts += [POINT.pack(x + ox, y + oy) for x, y in source.path]
+    return b"".join(parts)
+
+def pack_terrain(world):
+    # Open cells that can't be reached are stored instead of the reachable ones, they are few and compress well
+    unreachable = ~world.walls & ~world.reachable
+    return zlib.compress(np.packbits(world.walls).tobytes() + np.packbits(unreachable).tobytes())
+
+def unpack_terrain(data, width, height):
+    # The shared terrain if it is the same, so a resumed world doesn't keep a copy of its own
+    cells = width * height
+    bits = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+    walls = np.unpackbits(bits[:(cells + 7) // 8], count=cells).astype(bool).reshape(height, width)
+    unreachable = np.unpackbits(bits[(cells + 7) // 8:], count=cells).astype(bool).reshape(height, width)
+    reachable = ~walls & ~unreachable
+    shared = World.find_terrain(width, height)
+    if shared is not None and np.array_equal(shared[0], walls) and np.array_equal(shared[1], reachable):
+        return shared
+    walls.flags.writeable = False
+    reachable.flags.writeable = False
+    return walls, reachable
+
+def unpack_world(data, terrain_data, now):
+    reader = Reader(data)
+    width, height, ox, oy, player_x, player_y, used = reader.unpack(WORLD)
+    world = World(width, height, Player(player_x, player_y), terrain=unpack_terrain(terrain_data, width, height))
+    unpack_random(world.random, reader)
+    world.offset_x, world.offset_y = ox, oy
+    world.used_scary_texts = {text for i, text in enumerate(world.scary_texts) if used >> i & 1}
+    world.items = {(x - ox, y - oy): chr(code) for x, y, code in reader.records(ITEM)}
+    world.text_triggers = {}
+    for _ in range(reader.unpack(COUNT)[0]):
+        x, y = reader.unpack(TRIGGER)
+        world.text_triggers[(x - ox, y - oy)] = reader.text()
+    world.echo_sources = []
+    for _ in range(reader.unpack(COUNT)[0]):
+        x, y, speed, cooldown, known_x, known_y, move_age, move_cooldown, path_length = reader.unpack(ECHO)
+        source = EchoSource(x - ox, y - oy, world.player, moment(now, move_age))
+        source.speed = speed
+        source.path_update_cooldown = cooldown
+        source.last_known_player_pos = (known_x, known_y)
+        source.move_cooldown = move_cooldown
+        source.path = [(px - ox, py - oy) for px, py in (reader.unpack(POINT) for _ in range(path_length))]
+        world.echo_sources.append(source)
+    return world
+
+def pack_screen(graphics):
+    # Distortions and corrupted lines, mostly zeros
+    arrays = (graphics.distortion_chars, graphics.distortion_ttl, graphics.unseen_distortion_grid,
+              graphics.unseen_distortion_ttl, graphics.corrupted_lines)
+    return SCREEN.pack(graphics.width, graphics.height) + zlib.compress(b"".join(array.tobytes() for array in arrays))
+
+def unpack_screen(graphics, data):
+    # Effects that still fit on the current screen are kept, like on a resize
+    width, height = SCREEN.unpack_from(data)
+    arrays = np.frombuffer(zlib.decompress(data[SCREEN.size:]), dtype=np.uint8)
+    layout = (("distortion_chars", "<u4", (height, width)), ("distortion_ttl", np.int8, (height, width)),
+              ("unseen_distortion_grid", "<u4", (height, width)),
+              ("unseen_distortion_ttl", np.int8, (height, width)), ("corrupted_lines", bool, (height,)))
+    if len(arrays) != sum(int(np.prod(shape)) * np.dtype(dtype).itemsize for _, dtype, shape in layout):
+        raise SaveError(f"Screen effects don't match the {width}x{height} screen")
+    offset = 0
+    for name, dtype, shape in layout:
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        array = arrays[offset:offset + size].view(dtype).reshape(shape)
+        offset += size
+        current = getattr(graphics, name)
+        setattr(graphics, name, resize_array(array, current.shape))
+    graphics.corrupted_lines[graphics.height - 1:] = False
+
+def save_game(game, screen=None):
+    # Takes a few milliseconds, call it between ticks. The screen effects belong to the render thread, while
+    # it runs pass what pack_screen() took there.
+    sections = pack_sections(game)
+    sections.append((b"SCRN", pack_screen(game.graphics) if screen is None else screen))
+    return join_sections(sections)
+
+def pack_sections(game):
+    # Everything but the screen, which the simulation owns
+    now = game.time
+    return [
+        (b"SIMS", pack_simulation(game)),
+        (b"GAME", pack_game(game, now)),
+        (b"WRLD", pack_world(game.world, now)),
+        (b"TERR", pack_terrain(game.world)),
+    ]
+
+def join_sections(sections):
+    parts = [HEADER.pack(MAGIC, VERSION, len(sections))]
+    for tag, payload in sections:
+        parts += [SECTION.pack(tag, len(payload)), payload]
+    return b"".join(parts)
+
+def read_sections(data):
+    data = memoryview(data)
+    if len(data) < HEADER.size:
+        raise SaveError("Not a saved game")
+    magic, version, count = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise SaveError("Not a saved game")
+    if version > VERSION:
+        raise SaveError(f"Saved by a newer version ({version})")
+    sections = {}
+    offset = HEADER.size
+    for _ in range(count):
+        if offset + SECTION.size > len(data):
+            raise SaveError("Saved game is cut short")
+        tag, size = SECTION.unpack_from(data, offset)
+        offset += SECTION.size
+        sections[tag] = data[offset:offset + size]
+        offset += size
+    for tag in (b"GAME", b"WRLD", b"TERR"):
+        if tag not in sections:
+            raise SaveError(f"Saved game has no {tag.decode()} section")
+    return sections
+
+def get_screen_size(data):
+    # (width, height) of the screen the game was saved from, None if the save has no screen section
+    screen = read_sections(data).get(b"SCRN")
+    if screen is None:
+        return None
+    try:
+        return SCREEN.unpack_from(screen)
+    except struct.error as error:
+        raise SaveError(f"Damaged save: {error}") from error
+
+def load_game(data, keep_clock=False, **game_args):
+    # A Game that carries on where the saved one was, game_args go to Game(). Its clock goes on from now,
+    # with keep_clock from the time it was saved at, for replays that have to match the original exactly.
+    from game import Game
+    sections = read_sections(data)
+    now = time.time()
+    try:
+        if keep_clock and b"SIMS" in sections:
+            now = SIMULATION.unpack_from(sections[b"SIMS"])[2]
+        world = unpack_world(sections[b"WRLD"], sections[b"TERR"], now)
+    except DAMAGED as error:
+        raise SaveError(f"Damaged save: {error}") from error
+    game = Game(world=world, **game_args)
+    try:
+        if b"SIMS" in sections:
+            unpack_simulation(game, Reader(sections[b"SIMS"]), keep_clock)
+        if not keep_clock:
+            game.clock_start = now - game.ticks / game.tick_rate
+        game.time = now
+        unpack_game(game, sections[b"GAME"], now)
+        if b"SCRN" in sections:
+            unpack_screen(game.graphics, sections[b"SCRN"])
+    except DAMAGED as error:
+        raise SaveError(f"Damaged save: {error}") from error
+    return game
+
+def write_save(game, path):
+    data = save_game(game)
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as file:
+        file.write(data)
+    os.replace(temporary, path)  # A crash while writing leaves the previous save
+    return len(data)
+
+def read_save(path, **game_args):
+    with open(path, "rb") as file:
+        return load_game(file.read(), **game_args)
+
+class SlowFrameRecorder:
+    # Saves the game when a tick or a frame takes longer than threshold seconds, at most limit times, for
+    # replaying with this module's main(). The game is saved by the simulation thread and the screen effects
+    # by the render thread, each between its own ticks or frames: a slow frame's screen is taken right after
+    # it and saved with the next tick, a slow tick's save gets the screen of the next frame. Saving itself
+    # takes a few milliseconds, the tick after a save isn't timed.
+    def __init__(self, directory, threshold=1 / 60, limit=20):
+        self.directory = directory
+        self.threshold = threshold
+        self.limit = limit
+        self.saved = 0
+        self.slow_frame = None  # (seconds, screen) of the last slow frame, until the next tick saves it
+        self.slow_tick = None  # (seconds, sections) of a slow tick, until the next frame adds the screen
+        self.skip_next = False
+        os.makedirs(directory, exist_ok=True)
+
+    def frame_done(self, graphics, elapsed):
+        slow_tick = self.slow_tick
+        if slow_tick is not None:
+            self.slow_tick = None
+            seconds, sections = slow_tick
+            self.write(join_sections(sections + [(b"SCRN", pack_screen(graphics))]), "tick", seconds)
+        elif elapsed > self.threshold and self.slow_frame is None and self.saved < self.limit:
+            self.slow_frame = (elapsed, pack_screen(graphics))
+
+    def tick_done(self, game, elapsed):
+        if self.skip_next:
+            self.skip_next = False
+            return
+        if self.saved >= self.limit or self.slow_tick is not None:
+            return
+        slow_frame = self.slow_frame
+        if elapsed > self.threshold:
+            self.saved += 1
+            self.skip_next = True
+            self.slow_tick = (elapsed, pack_sections(game))
+        elif slow_frame is not None:
+            self.saved += 1
+            self.skip_next = True
+            self.slow_frame = None
+            seconds, screen = slow_frame
+            self.write(save_game(game, screen), "frame", seconds)
+
+    def write(self, data, kind, elapsed):
+        path = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{self.saved:03d}-{kind}-{elapsed * 1000:.0f}ms.sav")
+
+        def write():
+            with open(path, "wb") as file:
+                file.write(data)
+
+        threading.Thread(target=write, daemon=True).start()
+
+def replay(path, ticks):
+    # Runs a saved game headless for a number of ticks and times every tick and frame. The saved clock and
+    # random generators are kept, every replay of a save is the same.
+    from controls import TerminalInput
+    from output import NullOutput
+    from recording import run_headless
+    from silent_sounds import SilentSoundSystem
+    with open(path, "rb") as file:
+        data = file.read()
+    start = time.perf_counter()
+    width, height = get_screen_size(data) or (None, None)  # The smallest screen, NullOutput has no size to follow
+    game = load_game(data, keep_clock=True, width=width, height=height, sound_system=SilentSoundSystem(),
+                     input_system=TerminalInput(), output=NullOutput())
+    load_time = time.perf_counter() - start
+    return (load_time,) + run_headless(game, ticks)
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay saved games headless and time their ticks and frames")
+    parser.add_argument("saves", nargs="+")
+    parser.add_argument("--ticks", type=int, default=120, help="Ticks to run from every save")
+    args = parser.parse_args()
+    from recording import describe
+    for path in args.saves:
+        try:
+            load_time, tick_times, frame_times = replay(path, args.ticks)
+        except (OSError, SaveError) as error:
+            sys.stderr.write(f"{path}: {error}\n")
+            continue
+        print(f"{path}: loaded in {load_time * 1000:.1f} ms")
+        print(f"  tick   {describe(tick_times)}")
+        print(f"  frame  {describe(frame_times)}")
+        if tick_times and frame_times:
+            print(f"  first tick {tick_times[0] * 1000:.2f} ms, first frame {frame_times[0] * 1000:.2f} ms")
+
+if __name__ == "__main__":
+    main()
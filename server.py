@@ -0,0 +1,420 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+from multiprocessing import shared_memory
+import numpy as np
+from assets import registry
+from async_runner import AsyncGameRunner
+from broadcast import Broadcast, BroadcastOutput, TransportViewer
+from controls import TerminalInput
+from game import Game
+from output import AnsiOutput
+from player import Player
+from silent_sounds import SilentSoundSystem
+from world import World
+
+# Hosts one independent game per connection, over telnet or raw TCP. Every connection gets its own Game, world
+# state, input and output, the terrain and character tables are shared. Several worker processes can accept on
+# the same port (SO_REUSEPORT), the terrain is then built once and shared between them through shared memory.
+#
+#   python server.py --port 2323 --workers 4
+#   telnet localhost 2323
+#   python server.py --bench 100   # Server and 100 clients, reports what the clients got
+#
+# With --spectate-port every game can be watched: a spectator sees the oldest game and switches to the next
+# one with Tab or n. Each game's frames are encoded once for all of its spectators, see broadcast.py.
+
+WORLD_WIDTH, WORLD_HEIGHT = 256, 256
+
+# Telnet commands and options, RFC 854, 857, 858 and 1073
+IAC, DONT, DO, WONT, WILL, SB, SE = 255, 254, 253, 252, 251, 250, 240
+ECHO, SUPPRESS_GO_AHEAD, NAWS = 1, 3, 31
+
+class TelnetReader:
+    # What the client types, with the telnet commands taken out. The client's window size (NAWS) is kept
+    # for the output to follow. A raw TCP client never sends commands, so this reads it just as well.
+    def __init__(self, reader):
+        self.reader = reader
+        self.window_size = None  # (columns, rows), None until the client tells
+        self.command = None  # Bytes of a command split between two reads
+
+    async def read(self, size):
+        # Like StreamReader.read, b'' at the end of the stream
+        while True:
+            data = await self.reader.read(size)
+            if not data:
+                return data
+            data = self.filter(data)
+            if data:
+                return data
+
+    def filter(self, data):
+        if self.command is not None:
+            data = self.command + data
+            self.command = None
+        if IAC not in data:
+            return data
+        keys = bytearray()
+        i = 0
+        while i < len(data):
+            byte = data[i]
+            if byte != IAC:
+                keys.append(byte)
+                i += 1
+                continue
+            if i + 1 >= len(data):
+                self.command = data[i:]
+                break
+            command = data[i + 1]
+            if command == IAC:
+                keys.append(IAC)  # An escaped 255
+                i += 2
+            elif command in (WILL, WONT, DO, DONT):
+                if i + 2 >= len(data):
+                    self.command = data[i:]
+                    break
+                i += 3
+            elif command == SB:
+                end = data.find(bytes([IAC, SE]), i)
+                if end < 0:
+                    self.command = data[i:]
+                    break
+                self.subnegotiation(data[i + 2:end].replace(bytes([IAC, IAC]), bytes([IAC])))
+                i = end + 2
+            else:
+                i += 2
+        return bytes(keys)
+
+    def subnegotiation(self, data):
+        if len(data) == 5 and data[0] == NAWS:
+            columns = data[1] << 8 | data[2]
+            rows = data[3] << 8 | data[4]
+            if columns and rows:
+                self.window_size = (columns, rows)
+
+class ConnectionStream:
+    # What AnsiOutput writes to, the connection. The transport buffers whatever the client isn't taking yet.
+    def __init__(self, transport):
+        self.transport = transport
+
+    def write(self, text):
+        self.transport.write(text.encode('utf-8'))
+
+    def flush(self):
+        pass
+
+class ConnectionOutput(AnsiOutput):
+    # The client's terminal. Always adaptive: a client that can't keep up gets fewer frames instead of a send
+    # buffer that grows until the server runs out of memory.
+    def __init__(self, transport, telnet):
+        super().__init__(ConnectionStream(transport), adaptive=True)
+        self.transport = transport
+        self.telnet = telnet
+
+    def get_size(self):
+        return self.telnet.window_size
+
+    def queued_bytes(self):
+        return self.transport.get_write_buffer_size()
+
+class Session:
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.writer = writer
+        self.telnet = TelnetReader(reader)
+        self.broadcast = Broadcast()
+        self.output = BroadcastOutput(ConnectionOutput(writer.transport, self.telnet), self.broadcast)
+        self.runner = None
+        self.games = 0
+
+    async def run(self):
+        if self.server.telnet:
+            # Character at a time with the server echoing, which it doesn't, and the window size please
+            self.writer.write(bytes([IAC, WILL, ECHO, IAC, WILL, SUPPRESS_GO_AHEAD, IAC, DO, NAWS]))
+        self.output.clear_screen()
+        try:
+            restart = True
+            while restart and not self.writer.is_closing():
+                world = World(WORLD_WIDTH, WORLD_HEIGHT, Player(WORLD_WIDTH // 2, WORLD_HEIGHT // 2))
+                game = Game(sound_system=SilentSoundSystem(), world=world, input_system=TerminalInput(), output=self.output)
+                self.runner = AsyncGameRunner(game, reader=self.telnet, render_in_executor=False)
+                self.games += 1
+                restart = await self.runner.run()
+        finally:
+            self.writer.close()
+
+class GameServer:
+    def __init__(self, host, port, telnet=True, stats_interval=5, reuse_port=False, spectate_port=None):
+        self.host = host
+        self.port = port
+        self.telnet = telnet
+        self.stats_interval = stats_interval
+        self.reuse_port = reuse_port
+        self.spectate_port = spectate_port
+        self.sessions = {}  # Used as a set that remembers which game is the oldest
+        self.watching = {}  # Spectator viewer -> session, None while there is no game to watch
+        self.base_memory = None
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port, reuse_port=self.reuse_port)
+        servers = [server]
+        if self.spectate_port:
+            servers.append(await asyncio.start_server(self.handle_spectator, self.host, self.spectate_port,
+                                                      reuse_port=self.reuse_port))
+            log(f"spectators on {self.host}:{self.spectate_port}")
+        self.base_memory = get_memory_usage()
+        log(f"listening on {self.host}:{self.port}")
+        if self.stats_interval:
+            asyncio.ensure_future(self.report_stats())
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+
+    async def handle_connection(self, reader, writer):
+        session = Session(self, reader, writer)
+        self.sessions[session] = None
+        for viewer, watched in self.watching.items():
+            if watched is None:
+                self.watch(viewer)  # Was waiting for a game
+        try:
+            await session.run()
+        except (ConnectionError, OSError):
+            pass  # The client went away mid frame
+        finally:
+            del self.sessions[session]
+            for viewer, watched in list(self.watching.items()):
+                if watched is session:
+                    self.watch(viewer)
+
+    async def handle_spectator(self, reader, writer):
+        if self.telnet:
+            writer.write(bytes([IAC, WILL, ECHO, IAC, WILL, SUPPRESS_GO_AHEAD]))
+        viewer = TransportViewer(writer.transport)
+        telnet = TelnetReader(reader)
+        self.watching[viewer] = None
+        self.watch(viewer)
+        try:
+            while True:
+                keys = await telnet.read(64)
+                if not keys:
+                    break
+                if b'\t' in keys or b'n' in keys:
+                    self.watch(viewer, self.watching.get(viewer))
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            watched = self.watching.pop(viewer)
+            if watched:
+                watched.broadcast.remove(viewer)
+            writer.close()
+
+    def watch(self, viewer, after=None):
+        # Moves a spectator to the game that started after the given one, the oldest one by default
+        watched = self.watching[viewer]
+        if watched:
+            watched.broadcast.remove(viewer)
+        sessions = list(self.sessions)
+        if after in self.sessions:
+            index = sessions.index(after) + 1
+            sessions = sessions[index:] + sessions[:index]
+        session = sessions[0] if sessions else None
+        self.watching[viewer] = session
+        if session:
+            session.broadcast.add(viewer)
+        else:
+            viewer.transport.write(b"\033[2J\033[HWaiting for someone to play...\r\n")
+
+    def get_stats(self, reset=False):
+        runners = [session.runner for session in self.sessions if session.runner]
+        stats = [runner.get_stats(reset) for runner in runners]
+        ticks = sum(stat["ticks"] for stat in stats)
+        frames = sum(stat["frames"] for stat in stats)
+        memory = get_memory_usage()
+        broadcasts = [session.broadcast.get_stats(reset) for session in self.sessions]
+        return {
+            "sessions": len(self.sessions),
+            "spectators": len(self.watching),
+            "broadcast_frames": sum(stat["broadcast_frames"] for stat in broadcasts),
+            "keyframes": sum(stat["keyframes"] for stat in broadcasts),
+            "skipped": sum(stat["skipped"] for stat in broadcasts),
+            "encode_time_ms": sum(stat["encode_time"] for stat in broadcasts) * 1000 / max(1, sum(stat["broadcast_frames"] for stat in broadcasts)),
+            "ticks": ticks,
+            "tick_time_ms": sum(stat["tick_time"] for stat in stats) / max(1, ticks) * 1000,
+            "max_tick_time_ms": max([stat["max_tick_time"] for stat in stats], default=0) * 1000,
+            "frames": frames,
+            "frame_time_ms": sum(stat["frame_time"] for stat in stats) / max(1, frames) * 1000,
+            "memory": memory,
+            "memory_per_session": (memory - self.base_memory) / max(1, len(self.sessions)),
+        }
+
+    async def report_stats(self):
+        last = time.monotonic()
+        cpu_last = time.process_time()
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            now = time.monotonic()
+            cpu = time.process_time()
+            elapsed = now - last
+            stats = self.get_stats(reset=True)
+            sessions = max(1, stats["sessions"])
+            log(f"sessions {stats['sessions']} | per session {stats['ticks'] / elapsed / sessions:.1f} ticks/s "
+                f"{stats['frames'] / elapsed / sessions:.1f} frames/s | tick {stats['tick_time_ms']:.2f} ms "
+                f"(max {stats['max_tick_time_ms']:.1f}) frame {stats['frame_time_ms']:.2f} ms | "
+                f"cpu {(cpu - cpu_last) / elapsed * 100:.0f}% | memory {stats['memory'] / 2**20:.0f} MB, "
+                f"{stats['memory_per_session'] / 2**10:.0f} KB per session" +
+                (f" | spectators {stats['spectators']}, {stats['broadcast_frames'] / elapsed:.0f} broadcast frames/s, "
+                 f"{stats['keyframes'] / elapsed:.1f} keyframes/s, {stats['skipped'] / elapsed:.0f} skipped/s, "
+                 f"encode {stats['encode_time_ms']:.3f} ms per frame"
+                 if self.spectate_port else ""))
+            last = now
+            cpu_last = cpu
+
+def get_memory_usage():
+    # Resident memory of this process in bytes
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Peak, not current, but better than nothing
+
+def log(message):
+    sys.stderr.write(f"[{os.getpid()}] {message}\n")
+    sys.stderr.flush()
+
+def share_terrain(width, height):
+    # Walls and reachable cells in one shared memory block, built once here for all workers
+    walls, reachable = World.get_terrain(width, height)
+    block = shared_memory.SharedMemory(create=True, size=walls.nbytes + reachable.nbytes)
+    block.buf[:walls.nbytes] = walls.tobytes()
+    block.buf[walls.nbytes:walls.nbytes + reachable.nbytes] = reachable.tobytes()
+    return block
+
+def attach_terrain(name, width, height):
+    # The worker's World instances read the shared block directly, nothing is copied
+    block = shared_memory.SharedMemory(name=name)
+    cells = width * height
+    walls = np.ndarray((height, width), dtype=bool, buffer=block.buf[:cells])
+    reachable = np.ndarray((height, width), dtype=bool, buffer=block.buf[cells:2 * cells])
+    walls.flags.writeable = False
+    reachable.flags.writeable = False
+    registry.provide(("terrain", width, height), (walls, reachable))
+    return block
+
+def run_worker(host, port, telnet, stats_interval, spectate_port, terrain_name):
+    block = attach_terrain(terrain_name, WORLD_WIDTH, WORLD_HEIGHT)
+    try:
+        asyncio.run(GameServer(host, port, telnet, stats_interval, reuse_port=True, spectate_port=spectate_port).serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        block.close()
+
+def start_workers(args):
+    # Everything built before the fork is shared copy on write, the terrain goes to shared memory so it
+    # stays shared no matter how the workers are started
+    registry.char_tables()
+    block = share_terrain(WORLD_WIDTH, WORLD_HEIGHT)
+    workers = [multiprocessing.Process(target=run_worker, daemon=True,
+                                       args=(args.host, args.port, not args.raw, args.stats_interval, args.spectate_port,
+                                             block.name))
+               for _ in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    return block, workers
+
+async def run_client(host, port, duration, results, playing=True):
+    # A player that never stops walking around, or a spectator, counts the frames it gets
+    reader, writer = await asyncio.open_connection(host, port)
+    frames = 0
+    received = 0
+    keys = [b'\x1b[A', b'\x1b[B', b'\x1b[C', b'\x1b[D']
+
+    async def play():
+        for _ in range(5):
+            writer.write(b'\r')  # Past the intro text once it is typed out
+            await asyncio.sleep(0.2)
+        while True:
+            await asyncio.sleep(random.uniform(0.05, 0.3))
+            writer.write(random.choice(keys) * random.randint(1, 5))
+
+    player = asyncio.ensure_future(play() if playing else asyncio.sleep(duration))
+    end = time.monotonic() + duration
+    try:
+        while time.monotonic() < end:
+            try:
+                data = await asyncio.wait_for(reader.read(65536), end - time.monotonic())
+            except asyncio.TimeoutError:
+                break
+            if not data:
+                break
+            received += len(data)
+            frames += data.count(b'\x1b[H')  # Every frame starts at the top-left corner
+    finally:
+        player.cancel()
+        writer.close()
+    results.append((frames / duration, received / duration))
+
+async def run_bench(args):
+    # Clients connect one after another, so the server doesn't see a hundred handshakes at once
+    results = []
+    spectator_results = []
+    clients = []
+    for _ in range(args.bench):
+        clients.append(asyncio.ensure_future(run_client(args.host, args.port, args.duration, results)))
+        await asyncio.sleep(0.01)
+    for _ in range(args.bench_spectators):
+        clients.append(asyncio.ensure_future(
+            run_client(args.host, args.spectate_port, args.duration, spectator_results, playing=False)))
+        await asyncio.sleep(0.01)
+    await asyncio.gather(*clients, return_exceptions=True)
+    for name, received in (("clients", results), ("spectators", spectator_results)):
+        if received:
+            fps = sorted(fps for fps, _ in received)
+            log(f"{len(received)} {name} | frames/s received: min {fps[0]:.1f} median {fps[len(fps) // 2]:.1f} "
+                f"max {fps[-1]:.1f} | {sum(rate for _, rate in received) / len(received) / 1024:.1f} KB/s each")
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the game to telnet or raw TCP clients")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2323)
+    parser.add_argument("--workers", type=int, default=1, help="Processes accepting on the same port")
+    parser.add_argument("--raw", action="store_true", help="Don't negotiate telnet options, for nc and the like")
+    parser.add_argument("--stats-interval", type=float, default=5, help="Seconds between stats lines, 0 for none")
+    parser.add_argument("--spectate-port", type=int, default=None, help="Let spectators watch the games on this port")
+    parser.add_argument("--bench", type=int, default=0, help="Also connect this many playing clients")
+    parser.add_argument("--bench-spectators", type=int, default=0, help="Also connect this many spectators")
+    parser.add_argument("--duration", type=float, default=20, help="How long the bench clients play")
+    args = parser.parse_args()
+    if args.bench_spectators and not args.spectate_port:
+        args.spectate_port = args.port + 1
+
+    if args.workers == 1 and not args.bench:
+        try:
+            asyncio.run(GameServer(args.host, args.port, not args.raw, args.stats_interval,
+                                   spectate_port=args.spectate_port).serve())
+        except KeyboardInterrupt:
+            pass
+        return
+
+    block, workers = start_workers(args)
+    try:
+        if args.bench:
+            time.sleep(1)  # Let the workers start listening
+            asyncio.run(run_bench(args))
+        else:
+            for worker in workers:
+                worker.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.join()
+        block.close()
+        block.unlink()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+# Stands in for SoundSystem where nobody can hear it, e.g. games played over the network (see server.py).
+# Doesn't load pygame or generate any audio.
+
+class SilentSoundSystem:
+    def __init__(self):
+        self.enabled = False
+        self.signal_strength = 100
+
+    def play_sound(self, sound_name, input_time=None):
+        pass
+
+    def play_music(self, music_name):
+        pass
+
+    def stop_music(self):
+        pass
+
+    def play_echo(self, direction, distance):
+        pass
+
+    def update_ambient_sounds(self, delta_time):
+        pass
+
+    def get_ambient_interval(self):
+        # Same as SoundSystem, the async runner sleeps this long between ambient sounds
+        return min(5, max(0.05, 2 * (self.signal_strength**0.7 / 100)))
+
+    def play_random_ambient_sound(self):
+        pass
+
+    def update_signal_strength(self, signal_strength):
+        self.signal_strength = signal_strength
+
+    def memory_usage(self):
+        return 0
@@ -0,0 +1,71 @@
+import collections
+import threading
+
+# What the render thread needs to draw one frame, taken by the simulation after each tick.
+# Nothing in a snapshot is changed after it is taken, so it can be drawn while the next tick runs.
+
+EchoPosition = collections.namedtuple('EchoPosition', 'x y')
+PlayerSnapshot = collections.namedtuple('PlayerSnapshot', 'x y char')
+
+class WorldSnapshot(collections.namedtuple('WorldSnapshot', 'width height walls wall_cells items echo_sources offset_x offset_y')):
+    # Stands in for World when drawing. The terrain is read-only and shared, so the snapshot keeps a reference.
+    __slots__ = ()
+
+    @classmethod
+    def take(cls, world):
+        echo_sources = tuple(EchoPosition(source.x, source.y) for source in world.echo_sources)
+        return cls(world.width, world.height, world.walls, world.wall_cells, dict(world.items), echo_sources,
+                   world.offset_x, world.offset_y)
+
+    def is_obstacle(self, x, y):
+        # Same as World.is_obstacle
+        x += self.offset_x
+        y += self.offset_y
+        return 0 <= x < self.width and 0 <= y < self.height and self.wall_cells[y * self.width + x]
+
+FrameSnapshot = collections.namedtuple('FrameSnapshot', [
+    'time',  # time.time() of the tick, animations are drawn for this time
+    'screen',  # "world", "won", "lost" or "video"
+    'world',
+    'player',
+    'visibility_radius',
+    'ripples',  # (x, y, radius) in world coordinates from before any World.move
+    'text',  # (text, index) being typed out in the text area, None shows the stats
+    'stats',  # (samples collected, total samples, temperature, humidity, signal strength)
+    'total_time',
+    'video_frame',  # (frame, width, height), None until the video has a frame ready
+    'inputs',  # (input time, sim time) of the inputs whose changes this frame shows first
+])
+
+class SnapshotBuffer:
+    # Double buffer between the simulation and the render thread. The render thread draws the snapshot
+    # it took last while the simulation publishes the next one. If the simulation publishes again before
+    # that one was taken, the newer one replaces it, so a slow terminal only drops frames and never holds
+    # up a tick.
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.latest = None
+        self.published = 0
+        self.dropped = 0
+
+    def publish(self, snapshot):
+        with self.condition:
+            if self.latest is not None:
+                # Never drawn, its inputs show up first in this one
+                snapshot = snapshot._replace(inputs=self.latest.inputs + snapshot.inputs)
+                self.dropped += 1
+            self.latest = snapshot
+            self.published += 1
+            self.condition.notify()
+
+    def take(self, timeout=None):
+        # The newest snapshot nobody has taken yet, None if there was none within timeout
+        with self.condition:
+            if self.latest is None:
+                self.condition.wait(timeout)
+            snapshot, self.latest = self.latest, None
+            return snapshot
+
+    def get_stats(self):
+        with self.condition:
+            return {"published": self.published, "dropped": self.dropped}
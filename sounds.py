@@ -1,41 +1,134 @@
+import atexit
+import hashlib
+import os
+import zlib
 import numpy as np
 import pygame
 import threading
-import queue
 import random
-import scipy.signal
+import time
+import startup
+from mixer import Mixer
+from music import AmbientHorrorMusic
+from voices import VoiceSettings
+
+# Bump whenever a generator changes, so stale cache files are not picked up
+GENERATOR_VERSION = 1
+DEFAULT_SEED = 1980
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ascii_horror", "sounds")
 
 class SoundSystem:
-    def __init__(self):
+    def __init__(self, seed=DEFAULT_SEED, cache_dir=DEFAULT_CACHE_DIR):
         self.enabled = True  # New variable to control sound system
         self.sample_rate = 44100
+        self.seed = seed
+        self.cache_dir = cache_dir
+        self.echo_distortion_range = 30  # Echoes closer than this get distorted
+        self.echo_distortion_levels = 6  # Pre-rendered distortion buckets inside that range
+        self.echo_max_distance = 50  # Echo volume fades to zero here
+        self.ambient_sound_count = 15
         pygame.mixer.init(frequency=self.sample_rate, size=-16, channels=2, buffer=1024)
-        self.sounds = {
-            "item_pickup": self.generate_item_pickup_sound(),
-            "footstep": self.generate_footstep_sound(),
-            "ambient": self.generate_ambient_sound(),
-            "typing": self.generate_typing_sound(),
-            "echo": self.generate_echo_sound(),
+        # Filled in by the loader thread, anything not loaded yet is just skipped on play
+        self.sounds = {}
+        self.echo_bank = []
+        self.ambient_sounds = []
+        self.echo_pcm = None
+        self.current_music = None
+        # Everything is mixed in software into this one channel
+        pygame.mixer.set_reserved(1)
+        # Priorities go echo > pickup > footstep > typing, repeats of short effects are merged
+        self.voice_settings = {
+            "echo": VoiceSettings(priority=4, polyphony=4, coalesce_window=0.1, max_age=0.5),
+            "item_pickup": VoiceSettings(priority=3, polyphony=2, coalesce_window=0.05),
+            "footstep": VoiceSettings(priority=2, polyphony=2, coalesce_window=0.08),
+            "ambient": VoiceSettings(priority=1, polyphony=1),
+            "typing": VoiceSettings(priority=0, polyphony=2, coalesce_window=0.03, max_age=0.1),
         }
+        self.mixer = Mixer(pygame.mixer.Channel(0), self.sample_rate, seed=self.seed, voice_settings=self.voice_settings)
+        self.mixer.start()
+        # The sound system lives for the whole process now, stop the mixer thread before pygame goes away
+        atexit.register(self.mixer.stop)
+        # Music is synthesized block by block while it plays
         self.music = {
-            "ambient_horror": self.generate_ambient_horror_music(),
+            "ambient_horror": AmbientHorrorMusic(self.sample_rate, self.seed),
         }
-        self.current_music = None
-        self.music_channel = pygame.mixer.Channel(0)
-        self.ambient_channel = pygame.mixer.Channel(1)
-        self.sound_queue = queue.Queue()
-        self.sound_thread = threading.Thread(target=self._sound_worker, daemon=True)
-        self.sound_thread.start()
         self.signal_strength = 100
-        self.ambient_sounds = self.generate_ambient_sounds()
         self.ambient_timer = 0
+        self.load_progress = 0.0
+        self.loaded = threading.Event()
+        self.load_thread = threading.Thread(target=self._load_assets, daemon=True)
+        self.load_thread.start()
+
+    def _load_assets(self):
+        start_time = time.perf_counter()
+        # Cheap effects first so they are available almost immediately, the echo is needed last
+        assets = [
+            ("item_pickup", self.generate_item_pickup_sound),
+            ("footstep", self.generate_footstep_sound),
+            ("typing", self.generate_typing_sound),
+            ("ambient", self.generate_ambient_sound),
+        ]
+        assets += [(f"ambient_{i}", self.generate_ambient_variation) for i in range(self.ambient_sound_count)]
+        assets.append(("echo", self.generate_echo_sound))
+        assets += [(f"echo_level_{level}", self.generate_echo_level) for level in range(self.echo_distortion_levels)]
+        for done, (name, generator) in enumerate(assets, 1):
+            sound = self._load_or_generate(name, generator)
+            if name.startswith("ambient_"):
+                self.ambient_sounds.append(self.to_float(sound))
+            elif name.startswith("echo_level_"):
+                self.echo_bank.append(self.to_float(sound))
+            else:
+                if name == "echo":
+                    self.echo_pcm = sound  # Source for the distortion levels
+                self.sounds[name] = self.to_float(sound)
+            self.load_progress = done / len(assets)
+        # Undistorted echo for everything outside the distortion range
+        self.echo_bank.append(self.sounds["echo"])
+        startup.record("audio assets", time.perf_counter() - start_time)
+        self.loaded.set()
+
+    def _cache_path(self, name):
+        params = f"{name}|{self.seed}|{self.sample_rate}|{self.echo_distortion_range}|{self.echo_distortion_levels}|{self.echo_max_distance}|{GENERATOR_VERSION}"
+        key = hashlib.sha1(params.encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{name}-{key}.npy")
+
+    def _load_or_generate(self, name, generator):
+        path = self._cache_path(name) if self.cache_dir else None
+        if path and os.path.exists(path):
+            try:
+                pcm = np.load(path)
+                # Sounds that are identical on both channels are stored as mono
+                return np.column_stack((pcm, pcm)) if pcm.ndim == 1 else pcm
+            except (OSError, ValueError):
+                pass  # Corrupt or truncated, regenerate it
+        # Every asset gets its own generators so it doesn't matter which ones came from the cache
+        self.random = random.Random(f"{self.seed}:{name}")
+        self.rng = np.random.default_rng(zlib.crc32(name.encode()) ^ self.seed)
+        pcm = self.to_pcm(generator())
+        if path:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    np.save(f, pcm[:, 0] if np.array_equal(pcm[:, 0], pcm[:, 1]) else pcm)
+                os.replace(tmp_path, path)
+            except OSError:
+                pass  # Read-only or full disk, the game still works without the cache
+        return pcm
+
+    def to_pcm(self, sound):
+        return (np.clip(sound, -1, 1) * 32767).astype(np.int16)
+
+    def to_float(self, pcm):
+        # What the mixer works with
+        return pcm.astype(np.float32) / 32767
 
     def generate_sine_wave(self, freq, duration):
         t = np.linspace(0, duration, int(self.sample_rate * duration), False)
         return np.sin(2 * np.pi * freq * t)
 
     def generate_noise(self, duration):
-        return np.random.uniform(-1, 1, int(self.sample_rate * duration))
+        return self.rng.uniform(-1, 1, int(self.sample_rate * duration))
 
     def to_stereo(self, mono_audio):
         return np.column_stack((mono_audio, mono_audio))
@@ -82,137 +175,35 @@ class SoundSystem:
         mono = (noise * 0.3 + low_freq * 0.7) * 0.5
         return self.to_stereo(mono)
 
-    def generate_ambient_horror_music(self):
-        duration = 16.0
-        base_freq = 77.78
-        harmonics = [1, 1.5, 2, 2.5, 3]
-        waves = [self.generate_sine_wave(base_freq * h, duration) for h in harmonics]
-        combined = sum(waves) / len(waves)
-        noise = self.generate_noise(duration) * 0.1
-        # Apply low-pass filter to noise
-        cutoff_freq = 1320  # Adjust this value to change the filter's cutoff frequency
-        b, a = scipy.signal.butter(6, cutoff_freq / (self.sample_rate / 2), btype='low', analog=False)
-        filtered_noise = scipy.signal.lfilter(b, a, noise)
-        
-        # Replace the original noise with the filtered noise
-        noise = noise * 0.1 + filtered_noise * 0.9
-        
-        
-        # Add low melody and harmony
-        low_notes = [77.78, 87.31, 103.83, 116.54, 138.59]  # D2, F2, G#2, A#2, C3
-        high_notes = [77.78, 87.31, 103.83, 116.54, 138.59]  # D2, F2, G#2, A#2, C3
-        #high_notes = [155.56, 174.61, 207.65, 233.08, 277.18, 349.23]  # D3, F3, G#3, A#3, C4, F4
-        low_melody = np.zeros(int(self.sample_rate * duration))
-        high_melody = np.zeros(int(self.sample_rate * duration))
-        note_duration = 4.0  # Shorter duration to fit more notes
-
-        for i in range(0, int(duration), int(note_duration)):
-            low_note = random.choice(low_notes)
-            high_note = random.choice(high_notes)
-            # Check if notes are equal or adjacent in the list
-            if low_note == high_note or abs(low_notes.index(low_note) - high_notes.index(high_note)) <= 1:
-                # If so, choose only one note
-                chosen_note = random.choice([low_note, high_note])
-                low_note = high_note = chosen_note
-            # Introduce very small detuning for both notes
-            detune_factor_low = random.uniform(0.95, 1.05)  # ±5% detuning
-            detune_factor_high = random.uniform(0.95, 1.05)  # ±5% detuning
-            low_note *= detune_factor_low
-            high_note *= detune_factor_high
-            tempo_low = random.choice([1, 0.5])  # 1/1 or 1/2 tempo for low notes
-            tempo_high = random.choice([1, 0.5, 0.25])  # 1/1 or 1/2 or 1/4 tempo for high notes
-            
-            t_low = np.linspace(0, note_duration * tempo_low, int(self.sample_rate * note_duration * tempo_low), False)
-            t_high = np.linspace(0, note_duration * tempo_high, int(self.sample_rate * note_duration * tempo_high), False)
-            
-            low_wave = np.sin(2 * np.pi * low_note * t_low)
-            high_wave = np.sin(2 * np.pi * high_note * t_high)
-            
-            start_low = int(i * self.sample_rate)
-            end_low = start_low + len(low_wave)
-            if end_low > len(low_melody):
-                end_low = len(low_melody)
-                low_wave = low_wave[:end_low-start_low]
-            low_melody[start_low:end_low] += low_wave
-
-            start_high = int(i * self.sample_rate)
-            end_high = start_high + len(high_wave)
-            if end_high > len(high_melody):
-                end_high = len(high_melody)
-                high_wave = high_wave[:end_high-start_high]
-            high_melody[start_high:end_high] += high_wave
-
-        # Normalize and combine melodies
-        low_melody = low_melody / np.max(np.abs(low_melody))
-        high_melody = high_melody / np.max(np.abs(high_melody))
-        melody = (low_melody + high_melody) / 2
-        
-        melody = melody / np.max(np.abs(melody))  # Normalize
-        mono = (combined * 0.3 + noise * 0.3 + melody * 0.4) * 0.5
-        return self.to_stereo(mono)
-
-    def generate_distortion_sound(self):
-        duration = random.uniform(0.05, 0.2)
-        noise = self.generate_noise(duration)
-        crackle = np.random.choice([-1, 0, 1], size=int(self.sample_rate * duration), p=[0.05, 0.9, 0.05])
-        hum = self.generate_sine_wave(50, duration) * 0.1
-        combined = (noise * 0.3 + crackle * 0.5 + hum * 0.2) * 0.5
-        return self.to_stereo(combined)
-
-    def update_distortion(self, signal_strength):
-        if not self.enabled:
-            return
-        self.distortion_intensity = min(1,max(0, 1 - (signal_strength**1.05 / 100)))
-        if self.distortion_intensity > 0:
-            if not self.distortion_channel.get_busy():
-                distortion = pygame.sndarray.make_sound((self.distortion_sound * 32767 * self.distortion_intensity).astype(np.int16))
-                self.distortion_channel.play(distortion, loops=-1)
-            self.distortion_channel.set_volume(self.distortion_intensity)
-        else:
-            self.distortion_channel.stop()
-
-    def apply_distortion_to_sound(self, sound):
-        if not self.enabled:
-            return sound
-        if self.distortion_intensity > 0:
-            noise = self.generate_noise(len(sound) / self.sample_rate) * self.distortion_intensity * 0.3
-            distorted_sound = sound + noise[:, np.newaxis]
-            return np.clip(distorted_sound, -1, 1)
-        return sound
-
-    def play_sound(self, sound_name):
+    def play_sound(self, sound_name, input_time=None):
+        # input_time is the key press that caused the sound, for latency tracking
         if not self.enabled:
             return
         if sound_name in self.sounds:
-            self.sound_queue.put(sound_name)
+            self.mixer.play(sound_name, self.sounds[sound_name], input_time=input_time)
 
-    def _sound_worker(self):
-        while True:
-            sound_info = self.sound_queue.get()
-            if not self.enabled:
-                continue
-            if isinstance(sound_info, tuple):
-                sound_name, pygame_sound = sound_info
-                pygame_sound.play()
-            else:
-                sound_name = sound_info
-                if sound_name in self.sounds:
-                    sound = self.sounds[sound_name]
-                    pygame_sound = pygame.sndarray.make_sound((sound * 32767).astype(np.int16))
-                    pygame_sound.play()
+    def memory_usage(self):
+        arrays = list(self.sounds.values()) + self.ambient_sounds + self.echo_bank
+        if self.echo_pcm is not None:
+            arrays.append(self.echo_pcm)
+        # The clean echo is in both sounds and the bank
+        return sum(array.nbytes for array in {id(array): array for array in arrays}.values())
+
+    def get_voice_stats(self):
+        return self.mixer.voice_manager.get_stats()
 
     def play_music(self, music_name):
         if not self.enabled:
             return
         if music_name in self.music:
-            music = self.music[music_name]
-            pygame_music = pygame.sndarray.make_sound((music * 32767).astype(np.int16))
-            self.music_channel.play(pygame_music, loops=-1)
+            self.mixer.set_music(self.music[music_name])
+            self.current_music = music_name
 
     def stop_music(self):
         if not self.enabled:
             return
-        self.music_channel.stop()
+        self.mixer.set_music(None)
+        self.current_music = None
 
     def generate_typing_sound(self):
         duration = 0.05
@@ -233,16 +224,12 @@ class SoundSystem:
         mono = combined * envelope * 0.1  # Reduced volume
         return self.to_stereo(mono)
 
-    def generate_ambient_sounds(self):
-        sounds = []
-        for _ in range(15):  # Generate 15 different ambient sounds
-            duration = random.uniform(0.15, 0.5)
-            freq = random.uniform(100, 500)
-            noise = self.generate_noise(duration) * 0.3
-            tone = self.generate_sine_wave(freq, duration) * 0.2
-            sound = self.to_stereo((noise + tone) * 0.35)
-            sounds.append(pygame.sndarray.make_sound((sound * 32767).astype(np.int16)))
-        return sounds
+    def generate_ambient_variation(self):
+        duration = self.random.uniform(0.15, 0.5)
+        freq = self.random.uniform(100, 500)
+        noise = self.generate_noise(duration) * 0.3
+        tone = self.generate_sine_wave(freq, duration) * 0.2
+        return self.to_stereo((noise + tone) * 0.35)
 
     def update_ambient_sounds(self, delta_time):
         if not self.enabled:
@@ -259,39 +246,40 @@ class SoundSystem:
     def play_random_ambient_sound(self):
         if not self.enabled:
             return
-        if random.random() < 1 - (self.signal_strength / 100):
+        if self.ambient_sounds and random.random() < 1 - (self.signal_strength / 100):
             sound = random.choice(self.ambient_sounds)
-            self.ambient_channel.play(sound)
+            volume = (1 - (self.signal_strength / 100)) * 0.5  # Max volume of 0.5 for ambient sounds
+            self.mixer.play("ambient", sound, volume, volume)
 
     def update_signal_strength(self, signal_strength):
         if not self.enabled:
             return
         self.signal_strength = signal_strength
-        # Adjust the volume of the background noise
-        noise_volume = 1 - (signal_strength / 100)
-        self.ambient_channel.set_volume(noise_volume * 0.5)  # Max volume of 0.5 for ambient sounds
+        for music in self.music.values():
+            music.set_signal_strength(signal_strength)
+        self.mixer.set_signal_strength(signal_strength)
 
     def generate_echo_sound(self):
-        duration = random.uniform(7.0, 9.0)  # Variable duration for unpredictability
+        duration = self.random.uniform(7.0, 9.0)  # Variable duration for unpredictability
         t = np.linspace(0, duration, int(self.sample_rate * duration), False)
         
         # Generate a base for the unsettling sound
-        base_freq = random.uniform(40, 50)  # Random base frequency for variability
-        pitch_curve = np.cumsum(np.random.normal(0, 0.5, len(t)))  # Natural, random pitch curve
+        base_freq = self.random.uniform(40, 50)  # Random base frequency for variability
+        pitch_curve = np.cumsum(self.rng.normal(0, 0.5, len(t)))  # Natural, random pitch curve
         pitch_curve = pitch_curve / np.max(np.abs(pitch_curve)) * 20  # Normalize and scale
         base_sound = 0.7 * np.tanh(np.sin(2 * np.pi * (base_freq + pitch_curve) * t))  # Use tanh for soft clipping
         
         # Add a distorted, low-pitched scream/moo component with slow vibrato
-        scream_freq = random.uniform(50, 60)
-        scream_mod = 60 * np.cumsum(np.random.normal(0, 0.3, len(t)))  # Another random curve
+        scream_freq = self.random.uniform(50, 60)
+        scream_mod = 60 * np.cumsum(self.rng.normal(0, 0.3, len(t)))  # Another random curve
         scream_mod = scream_mod / np.max(np.abs(scream_mod))
-        vibrato_rate = random.uniform(0.7, 1.2)  # Hz, adjust for desired vibrato speed
-        vibrato_depth = random.uniform(1.5, 2.5)  # Hz, adjust for desired vibrato intensity
+        vibrato_rate = self.random.uniform(0.7, 1.2)  # Hz, adjust for desired vibrato speed
+        vibrato_depth = self.random.uniform(1.5, 2.5)  # Hz, adjust for desired vibrato intensity
         vibrato = vibrato_depth * np.sin(2 * np.pi * vibrato_rate * t)
         scream = 0.5 * np.tanh(np.sin(2 * np.pi * (scream_freq + scream_mod + vibrato) * t))
         
         # Add a deep, rumbling component
-        rumble_freq = random.uniform(20, 30)
+        rumble_freq = self.random.uniform(20, 30)
         rumble = 0.6 * np.tanh(np.sin(2 * np.pi * rumble_freq * t))
         
         # Combine all components with some randomness
@@ -305,43 +293,53 @@ class SoundSystem:
         sound *= envelope
         
         # Add some random distortions
-        distortion_points = np.random.randint(0, len(sound), 50)  # Increased number of distortion points
-        sound[distortion_points] *= np.random.uniform(0.5, 1.5, 50)
+        distortion_points = self.rng.integers(0, len(sound), 50)  # Increased number of distortion points
+        sound[distortion_points] *= self.rng.uniform(0.5, 1.5, 50)
         
         # Normalize
         sound = sound / np.max(np.abs(sound))
         
         # Apply low-pass filter2
-        cutoff_freq = 550 + random.uniform(-40, 40)  # Adjust this value to change the filter's cutoff frequency
+        import scipy.signal  # Only needed when the echo isn't cached yet, and then on the loader thread
+        cutoff_freq = 550 + self.random.uniform(-40, 40)  # Adjust this value to change the filter's cutoff frequency
         b, a = scipy.signal.butter(6, cutoff_freq / (self.sample_rate / 2), btype='low', analog=False)
         filtered_sound = scipy.signal.lfilter(b, a, sound)
         
         # Adjust volume and convert to stereo
-        return self.to_stereo(filtered_sound * random.uniform(0.8, 0.8))  # Randomize final volume slightly
+        return self.to_stereo(filtered_sound * self.random.uniform(0.8, 0.8))  # Randomize final volume slightly
+
+    def generate_echo_level(self):
+        # Pre-render the echo at a few distortion levels so playing one is just a lookup.
+        # Each level is rendered at the volume of its bucket centre and scaled back up, the
+        # voice gains then restore the actual attenuation.
+        level = len(self.echo_bank)
+        bucket_size = self.echo_distortion_range / self.echo_distortion_levels
+        distance = (level + 0.5) * bucket_size
+        volume = max(0.01, 1 - (distance / self.echo_max_distance))
+        distortion_factor = max(0, (self.echo_distortion_range - distance) / self.echo_distortion_range)
+        sound = self.echo_pcm / 32767 * volume
+        distortion = np.tanh(sound * (1 + 3 * distortion_factor))  # Soft clipping distortion
+        return (sound * (1 - distortion_factor) + distortion * distortion_factor) / volume
+
+    def get_echo_bucket(self, distance):
+        if distance >= self.echo_distortion_range:
+            return self.echo_distortion_levels
+        bucket_size = self.echo_distortion_range / self.echo_distortion_levels
+        return min(self.echo_distortion_levels - 1, int(max(0, distance) / bucket_size))
 
     def play_echo(self, direction, distance):
-        if not self.enabled:
+        if not self.enabled or len(self.echo_bank) <= self.echo_distortion_levels:
+            return
+        # Adjust volume based on distance
+        volume = max(0, 1 - (distance / self.echo_max_distance))
+        if volume <= 0:
             return
-        if "echo" in self.sounds:
-            sound = self.sounds["echo"].copy()
-            
-            # Adjust volume based on distance
-            volume = max(0, 1 - (distance / 50))  # Assume max distance is 50
-            sound *= volume
-            
-            # Adjust stereo based on direction
-            if direction < 0:  # Source is to the left
-                sound[:, 1] *= max(0, 1 + direction)  # Reduce right channel
-            elif direction > 0:  # Source is to the right
-                sound[:, 0] *= max(0, 1 - direction)  # Reduce left channel
-                
-            if distance < 30:
-                # Apply extra distortion based on distance
-                distortion_factor = max(0, (30 - distance) / 30)  # Smoothly increases as distance decreases
-                distortion = np.tanh(sound * (1 + 3 * distortion_factor))  # Soft clipping distortion
-                sound = sound * (1 - distortion_factor) + distortion * distortion_factor  # Blend original and distorted sound
-                
-            
-            pygame_sound = pygame.sndarray.make_sound((sound * 32767).astype(np.int16))
-            self.sound_queue.put(("echo", pygame_sound))
-2
\ No newline at end of file
+
+        # Adjust stereo based on direction
+        left = right = volume
+        if direction < 0:  # Source is to the left
+            right *= max(0, 1 + direction)  # Reduce right channel
+        elif direction > 0:  # Source is to the right
+            left *= max(0, 1 - direction)  # Reduce left channel
+
+        self.mixer.play("echo", self.echo_bank[self.get_echo_bucket(distance)], left, right)
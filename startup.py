@@ -0,0 +1,63 @@
+import builtins
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Import this first, before anything heavy, so the import timings cover the whole startup.
+# Enabled with the --startup-report command line flag, the report is printed on exit.
+ENABLED = "--startup-report" in sys.argv
+
+process_start = time.perf_counter()
+import_times = {}  # Top level module -> seconds, including everything it imported itself
+timings = []  # (label, seconds) of startup phases
+marks = {}  # label -> seconds since process start
+_original_import = builtins.__import__
+_import_state = threading.local()
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level or name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+    depth = getattr(_import_state, "depth", 0)
+    _import_state.depth = depth + 1
+    start = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        _import_state.depth = depth
+        if depth == 0:
+            import_times[name] = import_times.get(name, 0) + time.perf_counter() - start
+
+if ENABLED:
+    builtins.__import__ = _timed_import
+
+def record(label, seconds):
+    if ENABLED:
+        timings.append((label, seconds))
+
+@contextmanager
+def timed(label):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(label, time.perf_counter() - start)
+
+def mark(label):
+    # Only the first time counts, e.g. the first rendered frame
+    if ENABLED and label not in marks:
+        marks[label] = time.perf_counter() - process_start
+
+def report(stream=None):
+    stream = stream or sys.stderr
+    stream.write("Startup report\n")
+    stream.write("  Imports:\n")
+    for name, seconds in sorted(import_times.items(), key=lambda item: -item[1]):
+        stream.write(f"    {name:<24} {seconds * 1000:8.1f} ms\n")
+    stream.write("  Phases:\n")
+    for label, seconds in timings:
+        stream.write(f"    {label:<24} {seconds * 1000:8.1f} ms\n")
+    stream.write("  Since process start:\n")
+    for label, seconds in sorted(marks.items(), key=lambda item: item[1]):
+        stream.write(f"    {label:<24} {seconds * 1000:8.1f} ms\n")
+    stream.flush()
@@ -1,9 +1,10 @@
 import random
 import math
 import noise
+import numpy as np
 
-def get_random_position(width, height):
-    return random.randint(0, width - 1), random.randint(0, height - 1)
+def get_random_position(width, height, rng=random):
+    return rng.randint(0, width - 1), rng.randint(0, height - 1)
 
 def distance(x1, y1, x2, y2):
     return ((x2 - x1) ** 2 + (y2 - y1) ** 2) ** 0.5
@@ -46,6 +47,76 @@ def generate_perlin_noise(x, y, t, scale=0.1, octaves=6, persistence=0.5, lacuna
                          repeaty=1024, 
                          base=0)
 
+# Same permutation and gradients as the noise module, so generate_perlin_noise_grid matches pnoise3
+PERLIN_PERM = [151, 160, 137, 91, 90, 15, 131, 13, 201, 95, 96, 53, 194, 233, 7, 225, 140, 36, 103, 30, 69, 142,
+    8, 99, 37, 240, 21, 10, 23, 190, 6, 148, 247, 120, 234, 75, 0, 26, 197, 62, 94, 252, 219, 203, 117, 35, 11, 32,
+    57, 177, 33, 88, 237, 149, 56, 87, 174, 20, 125, 136, 171, 168, 68, 175, 74, 165, 71, 134, 139, 48, 27, 166, 77,
+    146, 158, 231, 83, 111, 229, 122, 60, 211, 133, 230, 220, 105, 92, 41, 55, 46, 245, 40, 244, 102, 143, 54, 65,
+    25, 63, 161, 1, 216, 80, 73, 209, 76, 132, 187, 208, 89, 18, 169, 200, 196, 135, 130, 116, 188, 159, 86, 164,
+    100, 109, 198, 173, 186, 3, 64, 52, 217, 226, 250, 124, 123, 5, 202, 38, 147, 118, 126, 255, 82, 85, 212, 207,
+    206, 59, 227, 47, 16, 58, 17, 182, 189, 28, 42, 223, 183, 170, 213, 119, 248, 152, 2, 44, 154, 163, 70, 221, 153,
+    101, 155, 167, 43, 172, 9, 129, 22, 39, 253, 19, 98, 108, 110, 79, 113, 224, 232, 178, 185, 112, 104, 218, 246,
+    97, 228, 251, 34, 242, 193, 238, 210, 144, 12, 191, 179, 162, 241, 81, 51, 145, 235, 249, 14, 239, 107, 49, 192,
+    214, 31, 181, 199, 106, 157, 184, 84, 204, 176, 115, 121, 50, 45, 127, 4, 150, 254, 138, 236, 205, 93, 222, 114,
+    67, 29, 24, 72, 243, 141, 128, 195, 78, 66, 215, 61, 156, 180]
+PERLIN_PERM_TABLE = np.array(PERLIN_PERM * 2 + PERLIN_PERM[:2], dtype=np.intp)
+PERLIN_GRADIENTS = np.array([[1, 1, 0], [-1, 1, 0], [1, -1, 0], [-1, -1, 0], [1, 0, 1], [-1, 0, 1], [1, 0, -1],
+    [-1, 0, -1], [0, 1, 1], [0, -1, 1], [0, 1, -1], [0, -1, -1], [1, 0, -1], [-1, 0, -1], [0, -1, 1], [0, 1, 1]],
+    dtype=np.float32)
+# Gradient components by hash value, so the lookups need no & 15
+PERLIN_GX, PERLIN_GY, PERLIN_GZ = (np.ascontiguousarray(PERLIN_GRADIENTS[np.arange(256) & 15, i]) for i in range(3))
+
+def _perlin_fade(t):
+    return t * t * t * (t * (t * 6 - 15) + 10)
+
+def _perlin_grad(h, x, y, z):
+    return x * PERLIN_GX[h] + y * PERLIN_GY[h] + z * PERLIN_GZ[h]
+
+def _perlin_lerp(t, a, b):
+    return a + t * (b - a)
+
+def _perlin_noise3(x, y, z, repeatx, repeaty, repeatz):
+    perm = PERLIN_PERM_TABLE
+    i = np.floor(np.fmod(x, repeatx)).astype(np.intp)
+    j = np.floor(np.fmod(y, repeaty)).astype(np.intp)
+    k = np.floor(np.fmod(z, repeatz)).astype(np.intp)
+    ii = np.fmod(i + 1, repeatx) & 255
+    jj = np.fmod(j + 1, repeaty) & 255
+    kk = np.fmod(k + 1, repeatz) & 255
+    i &= 255
+    j &= 255
+    k &= 255
+    x = (x - np.floor(x)).astype(np.float32)
+    y = (y - np.floor(y)).astype(np.float32)
+    z = (z - np.floor(z)).astype(np.float32)
+    fx, fy, fz = _perlin_fade(x), _perlin_fade(y), _perlin_fade(z)
+    a = perm[i]
+    b = perm[ii]
+    aa, ab, ba, bb = perm[a + j], perm[a + jj], perm[b + j], perm[b + jj]
+    x1, y1, z1 = x - 1, y - 1, z - 1
+    lerp, grad = _perlin_lerp, _perlin_grad
+    return lerp(fz, lerp(fy, lerp(fx, grad(perm[aa + k], x, y, z), grad(perm[ba + k], x1, y, z)),
+                             lerp(fx, grad(perm[ab + k], x, y1, z), grad(perm[bb + k], x1, y1, z))),
+                    lerp(fy, lerp(fx, grad(perm[aa + kk], x, y, z1), grad(perm[ba + kk], x1, y, z1)),
+                             lerp(fx, grad(perm[ab + kk], x, y1, z1), grad(perm[bb + kk], x1, y1, z1))))
+
+def generate_perlin_noise_grid(x, y, t, scale=0.1, octaves=6, persistence=0.5, lacunarity=2.0):
+    # generate_perlin_noise for whole arrays of positions at once, same values up to float32 rounding
+    x = np.asarray(x, dtype=np.float64) * scale
+    y = np.asarray(y, dtype=np.float64) * scale
+    z = np.float64(t * scale)
+    frequency = 1.0
+    amplitude = 1.0
+    max_amplitude = 0.0
+    total = 0.0
+    for _ in range(octaves):
+        repeat = int(1024 * frequency)
+        total = total + _perlin_noise3(x * frequency, y * frequency, z * frequency, repeat, repeat, repeat) * amplitude
+        max_amplitude += amplitude
+        frequency *= lacunarity
+        amplitude *= persistence
+    return total / max_amplitude
+
 def get_wave_char(value):
     if value <= 0:
         return '-'
@@ -1,61 +1,222 @@
+import argparse
+import collections
+import itertools
+import multiprocessing
+import os
+import threading
+import time
 import cv2
 import numpy as np
-from PIL import Image
+from ascii_video import AsciiVideoWriter
 
 ASCII_CHARS = ['█', '█', '█', '▓', '▓', '▓', '▓', '░', '░', '░', '░']
 ASCII_CHARS = ['=', '=', '=', '+', '+', '+', '-', '-', '-', '⠀', '⠀']
 INVERTED_ASCII_CHARS = ASCII_CHARS[::-1]
 
+# Gray level -> palette index of its character, so a whole frame maps with a single indexing op
+PALETTE = list(dict.fromkeys(INVERTED_ASCII_CHARS))
+PALETTE_LUT = np.array([PALETTE.index(INVERTED_ASCII_CHARS[value // 25]) for value in range(256)], dtype=np.uint8)
+PALETTE_CODES = np.array([ord(char) for char in PALETTE], dtype='<u4')
 
+CHUNK_SIZE = 240  # Frames per task handed to a worker process
+DEFAULT_FPS = 30  # For streams and containers OpenCV reports no frame rate for
 
-def resize_image(image, new_width=42):
-    width, height = image.size
-    ratio = height / width
-    new_height = int(new_width * ratio)
-    resized_image = image.resize((new_width, new_height))
-    return resized_image
+def get_frame_size(frame_width, frame_height, width):
+    return width, int(width * frame_height / frame_width)
 
-def grayify(image):
-    return image.convert('L')
+def convert_frame_to_cells(frame, width):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    size = get_frame_size(gray.shape[1], gray.shape[0], width)
+    gray = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+    return PALETTE_LUT[gray]
 
-def pixels_to_ascii(image):
-    pixels = image.getdata()
-    characters = "".join([INVERTED_ASCII_CHARS[pixel//25] for pixel in pixels])
-    return characters
+def cells_to_ascii(cells):
+    return PALETTE_CODES[cells].tobytes().decode('utf-32-le')
 
 def convert_frame_to_ascii(frame, width):
-    image = Image.fromarray(frame)
-    image = resize_image(image, width)
-    image = grayify(image)
-    ascii_str = pixels_to_ascii(image)
-    return ascii_str
+    return cells_to_ascii(convert_frame_to_cells(frame, width))
 
-def convert_video_to_ascii(video_path, output_path, width=42):
+def select_frames(total_frames, fps, start=0, end=None, stride=1, target_fps=None):
+    # Returns the output frame rate and the source frame index of every output frame.
+    # Resampling to a lower rate skips frames, to a higher one repeats them.
+    if not fps > 0:
+        fps = DEFAULT_FPS
+    end = total_frames if end is None else min(end, total_frames)
+    step = stride * (fps / target_fps if target_fps else 1)
+    output_fps = target_fps or fps / stride
+    count = max(0, int(np.ceil((end - start) / step)))
+    indices = (start + int(i * step) for i in range(count))
+    return output_fps, indices
+
+def decode_frames(cap, indices):
+    # indices must be sorted, repeats are allowed
+    position = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    frame = None
+    for index in indices:
+        if frame is None or index != position - 1:
+            while position < index:
+                cap.grab()  # Skipped frames don't need to be retrieved
+                position += 1
+            ret, frame = cap.read()
+            if not ret:
+                return
+            position += 1
+        yield frame
+
+def convert_frames(frames, width):
+    for frame in frames:
+        yield convert_frame_to_cells(frame, width)
+
+def convert_chunk(args):
+    video_path, indices, width = args
     cap = cv2.VideoCapture(video_path)
-    fps = int(cap.get(cv2.CAP_PROP_FPS))
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    
-    ascii_frames = []
-    
-    for i in range(total_frames):
-        ret, frame = cap.read()
-        if not ret:
-            break
-        ascii_frame = convert_frame_to_ascii(frame, width)
-        ascii_frames.append(ascii_frame)
-    
+    cap.set(cv2.CAP_PROP_POS_FRAMES, indices[0])
+    frames = list(convert_frames(decode_frames(cap, indices), width))
     cap.release()
-    
+    return frames
+
+def convert_chunks(video_path, indices, width, workers):
+    # Each worker decodes its own part of the clip. Only a couple of chunks per worker are in flight,
+    # and they are handed back in order.
+    chunks = iter(lambda: list(itertools.islice(indices, CHUNK_SIZE)), [])
+    in_flight = collections.deque()
+    with multiprocessing.Pool(workers) as pool:
+        for chunk in chunks:
+            in_flight.append(pool.apply_async(convert_chunk, ((video_path, chunk, width),)))
+            if len(in_flight) >= workers * 2:
+                yield from in_flight.popleft().get()
+        while in_flight:
+            yield from in_flight.popleft().get()
+
+def write_ascii_video(output_path, fps, width, height, frames):
+    count = 0
+    with AsciiVideoWriter(output_path, fps, width, height, PALETTE) as writer:
+        for cells in frames:
+            writer.write_frame(cells)
+            count += 1
+    return count
+
+def write_legacy_ascii_video(output_path, fps, width, height, frames):
+    count = 0
     with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(f"{fps}\n")
+        f.write(f"{int(round(fps))}\n")
         f.write(f"{width}\n")
-        f.write(f"{len(ascii_frames[0]) // width}\n")
-        for frame in ascii_frames:
-            f.write(frame + '\n')
-    
-    print(f"Converted video saved to {output_path}")
+        f.write(f"{height}\n")
+        for cells in frames:
+            f.write(cells_to_ascii(cells) + '\n')
+            count += 1
+    return count
+
+def convert_video_to_ascii(video_path, output_path, width=42, start=0, end=None, stride=1, target_fps=None, workers=None):
+    start_time = time.time()
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Could not open video {video_path}")
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    _, height = get_frame_size(cap.get(cv2.CAP_PROP_FRAME_WIDTH), cap.get(cv2.CAP_PROP_FRAME_HEIGHT), width)
+    output_fps, indices = select_frames(total_frames, fps, start, end, stride, target_fps)
+
+    # decode -> resize -> map -> write, one frame (or one chunk per worker) at a time
+    workers = workers or os.cpu_count() or 1
+    if workers > 1:
+        cap.release()
+        frames = convert_chunks(video_path, indices, width, workers)
+    else:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        frames = convert_frames(decode_frames(cap, indices), width)
+    # The old text format is still written for .txt outputs
+    writer = write_legacy_ascii_video if output_path.endswith('.txt') else write_ascii_video
+    count = writer(output_path, output_fps, width, height, frames)
+    cap.release()
+
+    elapsed = max(time.time() - start_time, 1e-6)
+    print(f"Converted {count} frames in {elapsed:.1f}s ({count / elapsed:.1f} frames/s), saved to {output_path}")
+    return count
+
+class LiveAsciiVideo:
+    # Converts a video while it plays. A producer thread decodes a few frames ahead into a bounded
+    # buffer, VideoPlayer reads frames from it by number like from any other frame sequence.
+    def __init__(self, video_path, width=42, capacity=16, lookahead=3):
+        self.cap = cv2.VideoCapture(video_path)
+        if not self.cap.isOpened():
+            raise IOError(f"Could not open video {video_path}")
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        if not self.fps > 0:
+            self.fps = DEFAULT_FPS
+        self.total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.width, self.height = get_frame_size(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH), self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT), width)
+        self.capacity = capacity
+        self.lookahead = lookahead
+        self.buffer = collections.deque()  # (frame number, text), oldest first
+        self.condition = threading.Condition()
+        self.wanted = 0  # Frames before this one are no longer needed and can be skipped
+        self.produced = 0
+        self.done = False
+        self.running = True
+        self.thread = threading.Thread(target=self._produce, daemon=True)
+        self.thread.start()
+
+    def _produce(self):
+        number = 0
+        while number < self.total_frames:
+            with self.condition:
+                while self.running and len(self.buffer) >= self.capacity:
+                    self.condition.wait()
+                if not self.running:
+                    break
+                skip = number < self.wanted
+            if skip:
+                self.cap.grab()  # The player is already past this frame
+            else:
+                ret, frame = self.cap.read()
+                if not ret:
+                    break
+                text = convert_frame_to_ascii(frame, self.width)
+                with self.condition:
+                    self.buffer.append((number, text))
+                    self.condition.notify_all()
+            number += 1
+            self.produced = number
+        with self.condition:
+            self.done = True
+            self.condition.notify_all()
+        self.cap.release()
+
+    def is_ready(self):
+        return self.done or len(self.buffer) >= min(self.lookahead, self.total_frames)
+
+    def __len__(self):
+        # Only an estimate until the producer has reached the end
+        return self.produced if self.done else self.total_frames
+
+    def __getitem__(self, number):
+        # Returns None if the frame isn't converted yet, never blocks
+        with self.condition:
+            self.wanted = max(self.wanted, number)
+            while self.buffer and self.buffer[0][0] < number:
+                self.buffer.popleft()
+            self.condition.notify_all()
+            if self.buffer and self.buffer[0][0] == number:
+                return self.buffer[0][1]
+        return None
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
 
 if __name__ == "__main__":
-    input_video = "input_video.mp4"
-    output_file = "output_ascii_video.txt"
-    convert_video_to_ascii(input_video, output_file, width=42)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Convert a video to an ASCII video for the game")
+    parser.add_argument("input_video", nargs="?", default="input_video.mp4")
+    parser.add_argument("output_file", nargs="?", default="output_ascii_video.ahv")
+    parser.add_argument("--width", type=int, default=42)
+    parser.add_argument("--start", type=int, default=0, help="First source frame")
+    parser.add_argument("--end", type=int, default=None, help="Source frame to stop at")
+    parser.add_argument("--stride", type=int, default=1, help="Keep every n-th frame")
+    parser.add_argument("--fps", type=float, default=None, help="Resample to this frame rate")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    convert_video_to_ascii(args.input_video, args.output_file, width=args.width, start=args.start, end=args.end,
+                           stride=args.stride, target_fps=args.fps, workers=args.workers)
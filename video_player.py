@@ -0,0 +1,64 @@
+import time
+
+class VideoPlayer:
+    def __init__(self, frames, fps, frame_width, frame_height):
+        self.frames = frames
+        self.fps = fps
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        self.start_time = None
+        self.frame_number = -1
+        self.frames_shown = 0
+        self.frames_dropped = 0
+        self.finished = False
+
+    def start(self, now=None):
+        self.start_time = time.monotonic() if now is None else now
+
+    def update(self, now=None):
+        # Frame times come from the start time, not from the previous frame, so slow frames never add
+        # up to drift. If we are behind, the frames in between are skipped.
+        # Returns the frame to show, or None if the current one is still up.
+        if self.finished:
+            return None
+        now = time.monotonic() if now is None else now
+        if self.start_time is None:
+            if not self.is_ready():
+                return None
+            self.start(now)
+        due = int((now - self.start_time) * self.fps)
+        if due >= len(self.frames):
+            self.stop()
+            return None
+        if due <= self.frame_number:
+            return None
+        frame = self.frames[due]
+        if frame is None:
+            return None  # Live source hasn't converted it yet, keep showing the current one
+        self.frames_dropped += due - self.frame_number - 1
+        self.frame_number = due
+        self.frames_shown += 1
+        return frame
+
+    def is_ready(self):
+        # Live sources want a few frames of lookahead before the clock starts
+        is_ready = getattr(self.frames, "is_ready", None)
+        return is_ready() if is_ready else True
+
+    def stop(self):
+        if self.finished:
+            return
+        self.finished = True
+        close = getattr(self.frames, "close", None)
+        if close:
+            close()
+
+    def get_stats(self, now=None):
+        now = time.monotonic() if now is None else now
+        elapsed = max(now - self.start_time, 1e-6) if self.start_time is not None else 0
+        return {
+            "target_fps": self.fps,
+            "achieved_fps": self.frames_shown / elapsed if elapsed else 0.0,
+            "frames_shown": self.frames_shown,
+            "frames_dropped": self.frames_dropped,
+        }
@@ -0,0 +1,119 @@
+import threading
+import time
+import latency as latency_stats
+
+class Voice:
+    def __init__(self, name, samples, left, right, priority, request_time, input_time=None):
+        self.name = name
+        self.samples = samples
+        self.left = left
+        self.right = right
+        self.priority = priority
+        self.request_time = request_time
+        self.input_time = input_time  # Key press that caused this sound, if any
+        self.position = 0
+
+class VoiceSettings:
+    def __init__(self, priority=0, polyphony=4, coalesce_window=0.0, max_age=0.15):
+        self.priority = priority  # Higher wins when voices or queue slots run out
+        self.polyphony = polyphony  # Voices of this sound playing at once, the oldest one is cut
+        self.coalesce_window = coalesce_window  # Repeats within this many seconds are dropped
+        self.max_age = max_age  # Requests older than this when the mixer gets to them are dropped
+
+class VoiceManager:
+    def __init__(self, settings=None, max_voices=16, max_pending=32, pickup_time=0.0):
+        self.settings = settings or {}
+        # How long a request can wait for the mixer even when nothing else is going on, no request is
+        # counted as stale before that
+        self.pickup_time = pickup_time
+        self.default_settings = VoiceSettings()
+        self.max_voices = max_voices
+        self.max_pending = max_pending
+        self.pending = []
+        self.active = []
+        self.last_request_time = {}
+        self.lock = threading.Lock()
+        self.stats = {
+            "requested": 0,
+            "played": 0,
+            "coalesced": 0,
+            "dropped_full": 0,
+            "dropped_stale": 0,
+            "dropped_priority": 0,
+            "stolen": 0,
+            "queue_depth": 0,
+            "max_queue_depth": 0,
+            "max_latency": 0.0,
+        }
+
+    def get_settings(self, name):
+        return self.settings.get(name, self.default_settings)
+
+    def request(self, name, samples, left=1.0, right=1.0, input_time=None):
+        # Called from the game thread, must stay cheap and never block on the mixer
+        settings = self.get_settings(name)
+        now = time.monotonic()
+        with self.lock:
+            self.stats["requested"] += 1
+            last_time = self.last_request_time.get(name)
+            if last_time is not None and now - last_time < settings.coalesce_window:
+                self.stats["coalesced"] += 1
+                return False
+            self.last_request_time[name] = now
+
+            if len(self.pending) >= self.max_pending:
+                # Make room by dropping the lowest priority, oldest request, unless that is this one
+                victim = min(self.pending, key=lambda v: (v.priority, v.request_time))
+                if victim.priority >= settings.priority:
+                    self.stats["dropped_full"] += 1
+                    return False
+                self.pending.remove(victim)
+                self.stats["dropped_full"] += 1
+
+            self.pending.append(Voice(name, samples, left, right, settings.priority, now, input_time))
+            self.stats["queue_depth"] = len(self.pending)
+            self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], len(self.pending))
+        return True
+
+    def start_pending(self):
+        # Called by the mixer once per block, returns the voices to mix
+        with self.lock:
+            pending = self.pending
+            self.pending = []
+            self.stats["queue_depth"] = 0
+        now = time.monotonic()
+        # Most important first so they get the free voices
+        for voice in sorted(pending, key=lambda v: -v.priority):
+            latency = now - voice.request_time
+            if latency > max(self.get_settings(voice.name).max_age, self.pickup_time):
+                self.stats["dropped_stale"] += 1
+                continue
+            if self.make_room(voice):
+                self.active.append(voice)
+                self.stats["played"] += 1
+                self.stats["max_latency"] = max(self.stats["max_latency"], latency)
+                latency_stats.record("sound -> mixer", latency)
+                if voice.input_time is not None:
+                    latency_stats.record("input -> audio", now - voice.input_time)
+        return self.active
+
+    def make_room(self, voice):
+        same = [v for v in self.active if v.name == voice.name]
+        if len(same) >= self.get_settings(voice.name).polyphony:
+            self.active.remove(same[0])
+            self.stats["stolen"] += 1
+        elif len(self.active) >= self.max_voices:
+            victim = min(self.active, key=lambda v: (v.priority, v.request_time))
+            if victim.priority > voice.priority:
+                self.stats["dropped_priority"] += 1
+                return False
+            self.active.remove(victim)
+            self.stats["stolen"] += 1
+        return True
+
+    def remove_finished(self):
+        self.active = [v for v in self.active if v.position < len(v.samples)]
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, active_voices=len(self.active))
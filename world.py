@@ -1,11 +1,30 @@
 import random
 import time
-from utils import get_random_position, distance, generate_perlin_noise
+from utils import get_random_position, distance
 from collections import deque
 import heapq
+import numpy as np
+from assets import registry
+
+def find_reachable(walls, start_x, start_y):
+    # Flood fill from the start, done once per terrain so spawning an echo mid game doesn't have to
+    height, width = walls.shape
+    wall_cells = memoryview(walls.reshape(-1))
+    reachable = bytearray(width * height)
+    reachable[start_y * width + start_x] = 1
+    queue = deque([(start_x, start_y)])
+    while queue:
+        x, y = queue.popleft()
+        for nx, ny in ((x, y + 1), (x + 1, y), (x, y - 1), (x - 1, y)):
+            if 0 <= nx < width and 0 <= ny < height:
+                cell = ny * width + nx
+                if not reachable[cell] and not wall_cells[cell]:
+                    reachable[cell] = 1
+                    queue.append((nx, ny))
+    return np.frombuffer(reachable, dtype=bool).reshape(height, width).copy()
 
 class EchoSource:
-    def __init__(self, x, y, player):
+    def __init__(self, x, y, player, now):
         self.x = x
         self.y = y
         self.player = player
@@ -13,10 +32,10 @@ class EchoSource:
         self.path = []
         self.path_update_cooldown = 0
         self.last_known_player_pos = (player.x, player.y)
-        self.last_move_time = time.time()
+        self.last_move_time = now
         self.move_cooldown = 0.33        
     def move(self, world):
-        self.last_move_time = time.time()
+        self.last_move_time = world.clock()
         current_player_pos = (self.player.x, self.player.y)
         
         # Check if player has moved significantly
@@ -38,7 +57,7 @@ class EchoSource:
 
     def update_path(self, world):
         self.path = self.find_path(world, (self.x, self.y), (self.player.x, self.player.y))
-        self.path_update_cooldown = random.randint(160, 240)  # Update path every 4-6 seconds (assuming 30 FPS)
+        self.path_update_cooldown = world.random.randint(160, 240)  # Update path every 4-6 seconds (assuming 30 FPS)
 
     def find_path(self, world, start, goal):
         def heuristic(a, b):
@@ -80,13 +99,18 @@ class EchoSource:
         return path[:self.speed]  # Return only the next few steps based on speed
 
 class World:
-    def __init__(self, width, height, player):
+    def __init__(self, width, height, player, seed=None, terrain=None):
         self.player = player
         self.width = width
         self.height = height
-        self.obstacles = set()
+        # Own generator, so a world can be built on another thread without touching the game's random state
+        self.random = random.Random(seed)
+        # Where echo sources get the time from, the game's simulation clock once a Game runs this world
+        self.clock = time.time
+        self.offset_x = 0  # How far the world has been moved, see move()
+        self.offset_y = 0
         self.items = {}
-        self.generate_world()
+        self.generate_world(terrain)
         self.text_triggers = {}
         self.echo_sources = []
         #self.generate_echo_sources()
@@ -118,30 +142,48 @@ class World:
             "magnetic_interference": "CAUTION: Magnetic interference."
         }
 
-    def generate_world(self):
-        # Generate cave-like terrain using Perlin noise
+    @staticmethod
+    def get_terrain_noise(width, height):
+        # The noise field is the same for every run, so it is built once and shared
         scale = 0.2
         octaves = 6
         persistence = 0.5
         lacunarity = 2.0
+        return registry.terrain_noise(width, height, scale, octaves, persistence, lacunarity)
+
+    @staticmethod
+    def get_terrain(width, height):
+        # Walls and the cells reachable from the start are the same for every world of this size, so they are
+        # built once and shared read-only by every World, see server.py for sharing them between processes
+        return registry.get(("terrain", width, height), lambda: World.build_terrain(width, height))
+
+    @staticmethod
+    def find_terrain(width, height):
+        # The shared terrain if it has been built already, None instead of building it
+        return registry.find(("terrain", width, height))
+
+    @staticmethod
+    def build_terrain(width, height):
+        # Generate cave-like terrain using Perlin noise
         threshold = 0.1  # Adjust this to control cave density
+        walls = World.get_terrain_noise(width, height) > threshold
 
-        for x in range(self.width):
-            for y in range(self.height):
-                if x < 10 or x >= self.width - 10 or y < 10 or y >= self.height - 10:
-                    self.obstacles.add((x, y))  # Create border walls
-                else:
-                    value = generate_perlin_noise(x, y, 0, scale, octaves, persistence, lacunarity)
-                    if value > threshold:
-                        self.obstacles.add((x, y))
+        # Create border walls
+        walls[:10, :] = walls[-10:, :] = walls[:, :10] = walls[:, -10:] = True
 
         # Ensure the player's starting position is clear
-        player_area = [(x, y) for x in range(self.width // 2 - 5, self.width // 2 + 6)
-                              for y in range(self.height // 2 - 5, self.height // 2 + 6)]
-        for pos in player_area:
-            if pos in self.obstacles:
-                self.obstacles.remove(pos)
-
+        walls[height // 2 - 5:height // 2 + 6, width // 2 - 5:width // 2 + 6] = False
+
+        reachable = find_reachable(walls, width // 2, height // 2)
+        walls.flags.writeable = False
+        reachable.flags.writeable = False
+        return walls, reachable
+
+    def generate_world(self, terrain=None):
+        # Grids in the coordinates from before any move(), see is_obstacle(). A given terrain (walls, reachable)
+        # is used instead of the shared one, e.g. from a saved game.
+        self.walls, self.reachable = terrain if terrain is not None else World.get_terrain(self.width, self.height)
+        self.wall_cells = memoryview(self.walls.reshape(-1))  # Faster than indexing the array one cell at a time
         self.generate_items()
 
     def generate_items(self):
@@ -152,23 +194,26 @@ class World:
         for _ in range(num_items):
             attempts = 0
             while attempts < 100:  # Limit attempts to avoid infinite loop
-                x, y = get_random_position(self.width, self.height)
-                if (x, y) not in self.obstacles and (x, y) not in self.items and \
+                x, y = get_random_position(self.width, self.height, self.random)
+                if not self.is_obstacle(x, y) and (x, y) not in self.items and \
                    (x, y) != (self.width // 2, self.height // 2) and \
                    all(distance(x, y, ix, iy) >= min_distance for ix, iy in self.items):
-                    self.items[(x, y)] = random.choice(items)
+                    self.items[(x, y)] = self.random.choice(items)
                     break
                 attempts += 1
 
         # Ensure we have enough items
         while len(self.items) < num_items:
-            x, y = get_random_position(self.width, self.height)
-            if (x, y) not in self.obstacles and (x, y) not in self.items and \
+            x, y = get_random_position(self.width, self.height, self.random)
+            if not self.is_obstacle(x, y) and (x, y) not in self.items and \
                (x, y) != (self.width // 2, self.height // 2):
-                self.items[(x, y)] = random.choice(items)
+                self.items[(x, y)] = self.random.choice(items)
 
     def is_obstacle(self, x, y):
-        return (x, y) in self.obstacles
+        # The terrain stays where it was generated, the offset says how far the world has moved since
+        x += self.offset_x
+        y += self.offset_y
+        return 0 <= x < self.width and 0 <= y < self.height and self.wall_cells[y * self.width + x]
 
     def get_item(self, x, y):
         return self.items.get((x, y))
@@ -181,13 +226,13 @@ class World:
 
     def generate_new_item(self):
         items = ['+']
-        x, y = get_random_position(self.width, self.height)
+        x, y = get_random_position(self.width, self.height, self.random)
         attempts = 0
         while attempts < 100:  # Limit attempts to avoid infinite loop
-            if (x, y) not in self.obstacles and (x, y) not in self.items:
-                self.items[(x, y)] = random.choice(items)
+            if not self.is_obstacle(x, y) and (x, y) not in self.items:
+                self.items[(x, y)] = self.random.choice(items)
                 return
-            x, y = get_random_position(self.width, self.height)
+            x, y = get_random_position(self.width, self.height, self.random)
             attempts += 1
 
     def check_text_trigger(self, x, y):
@@ -197,10 +242,8 @@ class World:
 
     def move(self, dx, dy):
         # Move all objects in the opposite direction of player movement
-        new_obstacles = set()
-        for x, y in self.obstacles:
-            new_obstacles.add((x - dx, y - dy))
-        self.obstacles = new_obstacles
+        self.offset_x += dx
+        self.offset_y += dy
 
         new_items = {}
         for (x, y), item in self.items.items():
@@ -234,34 +277,20 @@ class World:
             if not valid_positions:
                 break  # No valid positions far enough from the player
             
-            pos = random.choice(valid_positions)
-            self.echo_sources.append(EchoSource(pos[0], pos[1], self.player))
+            pos = self.random.choice(valid_positions)
+            self.echo_sources.append(EchoSource(pos[0], pos[1], self.player, self.clock()))
             accessible_positions.remove(pos)
 
     def get_accessible_positions(self):
-        start_x, start_y = self.width // 2, self.height // 2  # Assuming player starts at the center
-        visited = set()
-        queue = deque([(start_x, start_y)])
-        accessible = []
-
-        while queue:
-            x, y = queue.popleft()
-            if (x, y) in visited:
-                continue
-
-            visited.add((x, y))
-            if not self.is_obstacle(x, y):
-                accessible.append((x, y))
-
-            for dx, dy in [(0, 1), (1, 0), (0, -1), (-1, 0)]:
-                nx, ny = x + dx, y + dy
-                if 0 <= nx < self.width and 0 <= ny < self.height and (nx, ny) not in visited:
-                    queue.append((nx, ny))
-
-        return accessible
+        # Reachable cells from generation, moved to where the world is now
+        ys, xs = np.nonzero(self.reachable)
+        xs -= self.offset_x
+        ys -= self.offset_y
+        inside = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        return list(zip(xs[inside].tolist(), ys[inside].tolist()))
 
     def update_echo_sources(self):
-        current_time = time.time()
+        current_time = self.clock()
         for source in self.echo_sources:            
             # Move once every X seconds
             # Calculate distance to player
@@ -283,12 +312,13 @@ class World:
         return nearest, distance(x, y, nearest.x, nearest.y)
 
     def get_random_scary_text(self):
-        available_texts = set(self.scary_texts) - self.used_scary_texts
+        # In list order, a set's order changes from one process to the next and replays have to pick the same
+        available_texts = [text for text in self.scary_texts if text not in self.used_scary_texts]
         if not available_texts:
             self.used_scary_texts.clear()
-            available_texts = set(self.scary_texts)
+            available_texts = list(self.scary_texts)
         
-        chosen_text = random.choice(list(available_texts))
+        chosen_text = self.random.choice(available_texts)
         self.used_scary_texts.add(chosen_text)
         return chosen_text
 